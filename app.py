@@ -1,75 +1,110 @@
 import os
+import sys
 import json
-import subprocess
-import shutil
 import threading
-import tkinter as tk
-from tkinter import filedialog
-from flask import Flask, render_template, request, jsonify, send_from_directory
-
-app = Flask(__name__)
-
-# Configuration
-UPLOAD_FOLDER = 'uploads'
-OUTPUT_FOLDER = 'Output'
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-os.makedirs(OUTPUT_FOLDER, exist_ok=True)
-
-def get_duration(input_file):
-    """Gets the duration of the media file using ffprobe."""
-    cmd = [
-        'ffprobe',
-        '-v', 'error',
-        '-show_entries', 'format=duration',
-        '-of', 'json',
-        input_file
-    ]
-    try:
-        # startupinfo to hide console window on Windows
-        startupinfo = None
-        if os.name == 'nt':
-            startupinfo = subprocess.STARTUPINFO()
-            startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-            
-        result = subprocess.run(cmd, capture_output=True, text=True, check=True, startupinfo=startupinfo)
-        data = json.loads(result.stdout)
-        return float(data['format']['duration'])
-    except Exception as e:
-        raise Exception(f"Error getting duration: {e}")
+import webbrowser
+from urllib.parse import quote
+from flask import Blueprint, Flask, Response, current_app, render_template, request, jsonify
+from file_response import send_media_file
+from jobs import FINISHED_STATES, JobManager, JobStore
+from join_engine import join_files
+from media_probe import CACHE_DIR, SORT_KEYS, list_media_files, probe, probe_many, sort_media_files
+import metrics
+import loudness
+import segment_cache
+import silence
+import smart_render
+from split_engine import BACKENDS, split_segments, stream_segments
+from uploads import DEFAULT_CHUNK_BYTES, MAX_CHUNK_BYTES, OffsetMismatch, UploadError, UploadManager
+from waveform import read_window
+from zip_stream import iter_zip
+
+# Seconds between SSE keepalive comments while a job is idle
+SSE_KEEPALIVE_SECONDS = 15
+
+bp = Blueprint('cutfile', __name__)
+
+def _env_flag(name, default):
+    value = os.environ.get(name)
+    if value is None or value == '':
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+def _has_desktop():
+    """True when a native file dialog can be shown to the person using the app."""
+    return sys.platform in ('win32', 'darwin') or bool(os.environ.get('DISPLAY') or os.environ.get('WAYLAND_DISPLAY'))
+
+def create_app(config=None):
+    """Build the web app.
+
+    Settings come from CUTFILE_* environment variables and can be
+    overridden with config. Each worker process of a WSGI server (e.g.
+    gunicorn -w 4 'app:create_app()') builds its own app; they share jobs
+    through the SQLite job store and media through the on-disk caches.
+    """
+    app = Flask(__name__)
+    app.config.update(
+        UPLOAD_FOLDER=os.environ.get('CUTFILE_UPLOAD_FOLDER', 'uploads'),
+        OUTPUT_FOLDER=os.environ.get('CUTFILE_OUTPUT_FOLDER', 'Output'),
+        # Native browse dialogs; off on headless servers, where files are uploaded instead
+        DESKTOP=_env_flag('CUTFILE_DESKTOP', _has_desktop()),
+        # Shared job store; an empty value keeps jobs in this process only
+        JOB_DB=os.environ.get('CUTFILE_JOB_DB', os.path.join(CACHE_DIR, 'jobs.sqlite3')),
+        # Shared metric values of all workers (with CUTFILE_METRICS); empty keeps them per process
+        METRICS_DB=os.environ.get('CUTFILE_METRICS_DB', os.path.join(CACHE_DIR, 'metrics.sqlite3')),
+    )
+    if config:
+        app.config.update(config)
 
-@app.route('/')
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+    os.makedirs(app.config['OUTPUT_FOLDER'], exist_ok=True)
+    store = JobStore(app.config['JOB_DB']) if app.config['JOB_DB'] else None
+    app.extensions['cutfile_jobs'] = JobManager(store=store)
+    app.extensions['cutfile_uploads'] = UploadManager(app.config['UPLOAD_FOLDER'])
+    app.register_blueprint(bp)
+    metrics.init_app(app)
+    return app
+
+def _job_manager():
+    return current_app.extensions['cutfile_jobs']
+
+def _upload_manager():
+    return current_app.extensions['cutfile_uploads']
+
+@bp.route('/')
 def index():
     return render_template('index.html')
 
-@app.route('/api/browse-file')
-def browse_file():
+def _ask_path(ask, **options):
+    """Show a native dialog on the server's desktop; tkinter is only imported when needed."""
+    import tkinter as tk
+    from tkinter import filedialog
     root = tk.Tk()
     root.withdraw()
     root.attributes('-topmost', True)
-    file_path = filedialog.askopenfilename(filetypes=[("MP3 Files", "*.mp3")])
+    path = getattr(filedialog, ask)(**options)
     root.destroy()
-    if file_path:
-        return jsonify({'path': file_path})
-    return jsonify({'path': None})
+    return path or None
 
-@app.route('/api/browse-folder')
+@bp.route('/api/browse-file')
+def browse_file():
+    if not current_app.config['DESKTOP']:
+        return jsonify({'error': 'File dialogs are not available on this server; use Upload instead'}), 404
+    return jsonify({'path': _ask_path('askopenfilename', filetypes=[("MP3 Files", "*.mp3")])})
+
+@bp.route('/api/browse-folder')
 def browse_folder():
-    root = tk.Tk()
-    root.withdraw()
-    root.attributes('-topmost', True)
-    folder_path = filedialog.askdirectory()
-    root.destroy()
-    if folder_path:
-        return jsonify({'path': folder_path})
-    return jsonify({'path': None})
+    if not current_app.config['DESKTOP']:
+        return jsonify({'error': 'Folder dialogs are not available on this server; type the folder path instead'}), 404
+    return jsonify({'path': _ask_path('askdirectory')})
 
-@app.route('/api/get-output-folder')
+@bp.route('/api/get-output-folder')
 def get_output_folder():
     """Return the path to the project's Output folder"""
-    output_path = os.path.abspath(OUTPUT_FOLDER)
+    output_path = os.path.abspath(current_app.config['OUTPUT_FOLDER'])
     return jsonify({'path': output_path})
 
-@app.route('/api/file-info', methods=['POST'])
+@bp.route('/api/file-info', methods=['POST'])
 def file_info():
     data = request.json
     file_path = data.get('path')
@@ -77,140 +112,427 @@ def file_info():
         return jsonify({'error': 'File not found'}), 404
     
     try:
-        duration = get_duration(file_path)
-        return jsonify({'duration': duration})
+        info = probe(file_path)
+        return jsonify(info)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/file/<path:filename>')
-def serve_file(filename):
-    directory = os.path.dirname(filename)
-    name = os.path.basename(filename)
-    return send_from_directory(directory, name)
+@bp.route('/api/waveform', methods=['POST'])
+def waveform_peaks():
+    """Peaks for the visible window as raw little-endian int16 (min, max) pairs.
 
-import zipfile
-import io
+    The zoom level is picked from 'width' (buckets wanted) unless 'levelMs'
+    is given; X-Bucket-Ms and X-First-Bucket describe the returned slice.
+    """
+    data = request.json
+    file_path = data.get('path')
+    if not file_path or not os.path.exists(file_path):
+        return jsonify({'error': 'File not found'}), 404
 
-# ... (existing imports)
+    try:
+        start = float(data.get('start') or 0)
+        end = float(data['end']) if data.get('end') is not None else probe(file_path)['duration']
+        width = max(1, int(data.get('width') or 1000))
+        level_ms = data.get('levelMs')
+        level_ms = None if level_ms is None else int(level_ms)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'start, end, width and levelMs must be numbers'}), 400
 
-@app.route('/api/split', methods=['POST'])
+    try:
+        level_ms, first, peaks = read_window(file_path, start, end, width, level_ms)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+    return Response(peaks, mimetype='application/octet-stream', headers={
+        'X-Bucket-Ms': str(level_ms),
+        'X-First-Bucket': str(first)
+    })
+
+@bp.route('/api/detect-silence', methods=['POST'])
+def detect_silence():
+    """Proposes segments of about segmentLength seconds, cut in the middle of pauses."""
+    data = request.json
+    file_path = data.get('path')
+    if not file_path or not os.path.exists(file_path):
+        return jsonify({'error': 'File not found'}), 404
+
+    try:
+        segment_length = float(data.get('segmentLength') or 0)
+        threshold_db = float(data.get('thresholdDb', silence.DEFAULT_THRESHOLD_DB))
+        min_silence = float(data.get('minSilence', silence.DEFAULT_MIN_SILENCE))
+        search_window = data.get('searchWindow')
+        search_window = None if search_window is None else float(search_window)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'segmentLength, thresholdDb, minSilence and searchWindow must be numbers'}), 400
+    if segment_length <= 0:
+        return jsonify({'error': 'Segment length must be greater than 0'}), 400
+
+    try:
+        duration = probe(file_path)['duration']
+        ranges, silences = silence.detect_segments(file_path, duration, segment_length,
+                                                   threshold_db, min_silence, search_window)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+    return jsonify({
+        'segments': [{'start': start, 'end': end} for start, end in ranges],
+        'silences': silences,
+        'duration': duration
+    })
+
+@bp.route('/api/uploads', methods=['POST'])
+def upload_init():
+    """Start a chunked upload: {filename, size, sha256?} -> uploadId.
+
+    Send the bytes with PUT /api/uploads/<id>?offset=N (any chunk size up
+    to maxChunkBytes), then POST /api/uploads/<id>/complete to get a
+    server path that /api/split, /api/join-mp3 etc. accept.
+    """
+    data = request.json or {}
+    try:
+        upload = _upload_manager().init(data.get('filename'), data.get('size'), data.get('sha256'))
+    except UploadError as e:
+        return jsonify({'error': str(e)}), e.status
+    return jsonify(dict(upload.to_dict(), chunkSize=DEFAULT_CHUNK_BYTES, maxChunkBytes=MAX_CHUNK_BYTES)), 201
+
+@bp.route('/api/uploads/<upload_id>', methods=['GET'])
+def upload_status(upload_id):
+    """Where to resume: 'offset' is the number of bytes received so far."""
+    try:
+        return jsonify(_upload_manager().get(upload_id).to_dict())
+    except UploadError as e:
+        return jsonify({'error': str(e)}), e.status
+
+@bp.route('/api/uploads/<upload_id>', methods=['PUT'])
+def upload_chunk(upload_id):
+    """Write the request body at ?offset=N, streamed to disk without buffering it."""
+    try:
+        offset = int(request.args.get('offset', ''))
+    except ValueError:
+        return jsonify({'error': 'offset must be an integer'}), 400
+    if request.content_length is None:
+        return jsonify({'error': 'Content-Length is required'}), 411
+
+    try:
+        new_offset = _upload_manager().write_chunk(upload_id, offset, request.stream, request.content_length)
+    except OffsetMismatch as e:
+        return jsonify({'error': str(e), 'offset': e.offset}), e.status
+    except UploadError as e:
+        return jsonify({'error': str(e)}), e.status
+    return jsonify({'offset': new_offset})
+
+@bp.route('/api/uploads/<upload_id>/complete', methods=['POST'])
+def upload_complete(upload_id):
+    """Check size and SHA-256, then move the upload into place and return its path."""
+    try:
+        upload = _upload_manager().finish(upload_id)
+    except UploadError as e:
+        return jsonify({'error': str(e)}), e.status
+    return jsonify(dict(upload.to_dict(), sha256=upload.sha256))
+
+@bp.route('/api/uploads/<upload_id>', methods=['DELETE'])
+def upload_abort(upload_id):
+    try:
+        _upload_manager().abort(upload_id)
+    except UploadError as e:
+        return jsonify({'error': str(e)}), e.status
+    return jsonify({'success': True})
+
+@bp.route('/file/<path:filename>')
+def serve_file(filename):
+    """Serve a local file with range, ETag and conditional GET support (for audio seeking)."""
+    # Relative paths resolve against the app folder, like send_from_directory did
+    path = os.path.join(current_app.root_path, filename)
+    if not os.path.isfile(path):
+        return jsonify({'error': 'File not found'}), 404
+    return send_media_file(path, request)
+
+@bp.route('/api/split', methods=['POST'])
 def split_file():
+    """Queue a split job; progress and the result are available under /api/jobs/<id>"""
     data = request.json
     input_file = data.get('inputFile')
     output_dir = data.get('outputDir')
-    segments = data.get('segments')
-    create_zip = data.get('createZip', False)
+    backend = data.get('backend', 'ffmpeg')
 
     if not input_file or not os.path.exists(input_file):
         return jsonify({'error': 'Input file not found'}), 400
     if not output_dir:
         return jsonify({'error': 'Output directory not specified'}), 400
+    if data.get('createZip'):
+        # Writing segments.zip next to the segments cost a second full pass; the archive is streamed instead
+        return jsonify({'error': 'createZip is no longer supported; download the ZIP from /api/split-zip'}), 400
+    try:
+        segments = expand_segments(data.get('segments'))
+    except (KeyError, TypeError, ValueError, AttributeError):
+        return jsonify({'error': 'Invalid segments'}), 400
     if not segments:
         return jsonify({'error': 'No segments defined'}), 400
+    if backend not in BACKENDS:
+        return jsonify({'error': f'Unknown backend: {backend}'}), 400
+    try:
+        normalize = parse_normalize(data.get('normalize'))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'normalize must be true or {targetLufs, truePeak}'}), 400
 
+    args = (input_file, output_dir, segments, backend, normalize)
+    # ?trace=1 (or CUTFILE_TRACE) logs where this split's time goes once the job ends
+    if metrics.TRACE_ALL or request.args.get('trace') == '1':
+        with metrics.tracing(f"split {os.path.basename(input_file)}"):
+            job = _job_manager().submit('split', run_split, *args)
+    else:
+        job = _job_manager().submit('split', run_split, *args)
+    return jsonify({'success': True, 'jobId': job.id}), 202
+
+def parse_normalize(value):
+    """None, or (target_lufs, true_peak) from a request's 'normalize' field (true or an object)."""
+    if not value:
+        return None
+    if value is True:
+        return loudness.DEFAULT_TARGET_LUFS, loudness.DEFAULT_TRUE_PEAK
+    if not isinstance(value, dict):
+        raise ValueError('normalize must be true or an object')
+    return (float(value.get('targetLufs', loudness.DEFAULT_TARGET_LUFS)),
+            float(value.get('truePeak', loudness.DEFAULT_TRUE_PEAK)))
+
+def parse_crossfade(data):
+    """None, or the crossfade in seconds from a join request ('crossfade' seconds, or 'gapless': true for 0)."""
+    value = data.get('crossfade')
+    if value is None:
+        return 0.0 if data.get('gapless') else None
+    seconds = float(value)
+    if not 0 <= seconds <= smart_render.MAX_CROSSFADE_SECONDS:
+        raise ValueError('crossfade out of range')
+    return seconds
+
+def expand_segments(segments):
+    """The UI segment list, expanding the compact form large plans are sent in.
+
+    The compact form is {starts, ends, namePrefix, nameSuffix, names}: start
+    and end times as parallel arrays, names derived as prefix + number +
+    suffix, and names only listing the ones that differ, keyed by index.
+    """
+    if not isinstance(segments, dict):
+        return segments
+    starts = segments['starts']
+    ends = segments['ends']
+    if len(starts) != len(ends):
+        raise ValueError('starts and ends differ in length')
+    prefix = segments.get('namePrefix', 'part_')
+    suffix = segments.get('nameSuffix', '')
+    names = segments.get('names') or {}
+    return [{'start': start, 'end': end, 'outputName': str(names.get(str(i), f'{prefix}{i + 1}{suffix}'))}
+            for i, (start, end) in enumerate(zip(starts, ends))]
+
+def build_segment_plan(segments, output_dir):
+    """Turns UI segments (start, end, outputName) into split_engine segment dicts."""
+    plan = []
+    for seg in segments:
+        output_name = seg.get('outputName')
+        if not output_name.endswith('.mp3'):
+            output_name += '.mp3'
+        plan.append({
+            'start': float(seg.get('start')),
+            'end': float(seg.get('end')),
+            'path': os.path.join(output_dir, output_name),
+            'name': output_name
+        })
+    return plan
+
+def run_split(job, input_file, output_dir, segments, backend, normalize=None):
+    """Cuts all segments; runs on a job worker."""
+    trace = metrics.current_trace()
+    if trace is not None:
+        trace.add('queued', trace.started, job.started - job.created)
+    try:
+        result = _run_split(job, input_file, output_dir, segments, backend, normalize)
+    finally:
+        if trace is not None:
+            trace.log()
+    if trace is not None:
+        result['trace'] = trace.to_list()
+    return result
+
+def _run_split(job, input_file, output_dir, segments, backend, normalize=None):
     os.makedirs(output_dir, exist_ok=True)
     
     results = []
     errors = []
-    created_files = []
 
-    startupinfo = None
-    if os.name == 'nt':
-        startupinfo = subprocess.STARTUPINFO()
-        startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+    jobs = build_segment_plan(segments, output_dir)
 
-    for i, seg in enumerate(segments):
-        start = seg.get('start')
-        end = seg.get('end')
-        output_name = seg.get('outputName')
-        
-        if not output_name.endswith('.mp3'):
-            output_name += '.mp3'
-            
-        output_path = os.path.join(output_dir, output_name)
-        
-        cmd = [
-            'ffmpeg',
-            '-y',
-            '-i', input_file,
-            '-ss', str(start),
-            '-to', str(end),
-            '-c', 'copy',
-            '-map', '0',
-            '-vn',
-            output_path
-        ]
+    job.update(segmentsDone=0, segmentsTotal=len(jobs))
 
+    # Segments exported before with the same input, range and options come from the cache
+    options = backend if normalize is None else ['loudnorm'] + list(normalize)
+    outcomes = {}
+    keys = {}
+    with metrics.span('cache', segments=len(jobs)):
+        for seg_job in jobs:
+            job.check_cancelled()
+            keys[id(seg_job)] = key = segment_cache.segment_key(input_file, seg_job['start'], seg_job['end'], options)
+            if segment_cache.fetch(key, seg_job['path']):
+                outcomes[id(seg_job)] = (seg_job['path'], None)
+    to_cut = [seg_job for seg_job in jobs if id(seg_job) not in outcomes]
+    job.update(segmentsReused=len(jobs) - len(to_cut))
+
+    gain_db = None
+    if to_cut:
+        for seg_job in to_cut:
+            segment_cache.release_output(seg_job['path'])
+        if normalize is not None:
+            # One measurement pass per source (cached), then the segments are encoded in parallel
+            job.update(stage='analyze')
+            gain_db = loudness.gain_for(loudness.measure(input_file, job), *normalize)
+            job.update(stage='encode')
+            with metrics.span('encode', segments=len(to_cut)):
+                cut = loudness.normalize_segments(input_file, to_cut, gain_db, job)
+        else:
+            # All remaining segments are cut in a single pass over the input
+            with metrics.span('cut', segments=len(to_cut), backend=backend):
+                cut = split_segments(input_file, to_cut, backend, job)
+        for seg_job, outcome in zip(to_cut, cut):
+            outcomes[id(seg_job)] = outcome
+            if outcome[1] is None:
+                segment_cache.store(keys[id(seg_job)], outcome[0])
+
+    for seg_job in jobs:
+        error = outcomes[id(seg_job)][1]
+        if error is None:
+            results.append(seg_job['name'])
+        else:
+            errors.append(f"Error creating {seg_job['name']}: {error}")
+
+    return {'success': True, 'created': results, 'errors': errors,
+            'reused': len(jobs) - len(to_cut), 'cut': len(to_cut), 'gainDb': gain_db}
+
+@bp.route('/api/split-zip', methods=['POST'])
+def split_zip():
+    """Stream the segments as a ZIP download, cutting each one as it is sent.
+
+    Accepts the /api/split body as JSON or as a 'plan' form field (so a
+    plain form post can trigger the download). Nothing touches the disk.
+    With "check": true only the plan is validated, so a page can report
+    errors before it hands the download to the browser.
+    """
+    data = request.get_json(silent=True)
+    if data is None:
         try:
-            subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, startupinfo=startupinfo)
-            results.append(output_name)
-            created_files.append(output_path)
-        except subprocess.CalledProcessError as e:
-            errors.append(f"Error creating {output_name}: {e.stderr.decode() if e.stderr else 'Unknown error'}")
-
-    zip_path = None
-    if create_zip and created_files:
-        zip_name = "segments.zip"
-        zip_path = os.path.join(output_dir, zip_name)
-        try:
-            with zipfile.ZipFile(zip_path, 'w') as zipf:
-                for file in created_files:
-                    zipf.write(file, os.path.basename(file))
-            results.append(zip_name)
-        except Exception as e:
-            errors.append(f"Error creating zip: {str(e)}")
+            data = json.loads(request.form.get('plan') or '{}')
+        except ValueError:
+            return jsonify({'error': 'Invalid plan'}), 400
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Invalid plan'}), 400
+    input_file = data.get('inputFile')
+    backend = data.get('backend', 'auto')
+
+    if not input_file or not os.path.exists(input_file):
+        return jsonify({'error': 'Input file not found'}), 400
+    try:
+        segments = expand_segments(data.get('segments'))
+    except (KeyError, TypeError, ValueError, AttributeError):
+        return jsonify({'error': 'Invalid segments'}), 400
+    if not segments:
+        return jsonify({'error': 'No segments defined'}), 400
+    if backend not in BACKENDS:
+        return jsonify({'error': f'Unknown backend: {backend}'}), 400
+
+    plan = build_segment_plan(segments, '')
+    if data.get('check'):
+        return jsonify({'success': True, 'segments': len(plan)})
 
-    return jsonify({'success': True, 'created': results, 'errors': errors, 'zipPath': zip_path})
+    def members():
+        errors = []
+        for seg, chunks in stream_segments(input_file, plan, backend, errors):
+            yield seg['name'], chunks
+        # Failures can no longer change the HTTP status, so they ship inside the archive
+        if errors:
+            yield 'errors.txt', [('\n'.join(errors) + '\n').encode('utf-8')]
 
-@app.route('/api/list-mp3-files', methods=['POST'])
+    zip_name = os.path.splitext(os.path.basename(input_file))[0] + '_segments.zip'
+    return Response(iter_zip(members()), mimetype='application/zip', headers={
+        'Content-Disposition': f"attachment; filename*=UTF-8''{quote(zip_name)}",
+        'X-Accel-Buffering': 'no'
+    })
+
+@bp.route('/api/list-mp3-files', methods=['POST'])
 def list_mp3_files():
-    """List all MP3 files in a folder with metadata"""
+    """List MP3 files in a folder with metadata.
+
+    Options: recursive, offset/limit paging, sortKey (name, size, mtime) and
+    descending. With stream=true the result is NDJSON: a 'meta' line, one
+    'file' or 'error' line per file as soon as it is probed, then 'done'.
+    """
     data = request.json
     folder_path = data.get('folderPath')
+    recursive = bool(data.get('recursive', False))
+    sort_key = data.get('sortKey', 'name')
+    descending = bool(data.get('descending', False))
+    stream = bool(data.get('stream', False))
     
     if not folder_path or not os.path.exists(folder_path):
         return jsonify({'error': 'Folder not found'}), 404
     
     if not os.path.isdir(folder_path):
         return jsonify({'error': 'Path is not a directory'}), 400
-    
-    mp3_files = []
-    startupinfo = None
-    if os.name == 'nt':
-        startupinfo = subprocess.STARTUPINFO()
-        startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+
+    if sort_key not in SORT_KEYS:
+        return jsonify({'error': f'Unknown sort key: {sort_key}'}), 400
+
+    try:
+        offset = max(0, int(data.get('offset') or 0))
+        limit = data.get('limit')
+        limit = None if limit is None else max(0, int(limit))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'offset and limit must be integers'}), 400
     
     try:
-        # Get all MP3 files in the folder
-        for filename in sorted(os.listdir(folder_path)):
-            if filename.lower().endswith('.mp3'):
-                file_path = os.path.join(folder_path, filename)
-                try:
-                    # Get duration
-                    duration = get_duration(file_path)
-                    # Get file size
-                    size = os.path.getsize(file_path)
-                    
-                    mp3_files.append({
-                        'filename': filename,
-                        'path': file_path,
-                        'duration': duration,
-                        'size': size
-                    })
-                except Exception as e:
-                    print(f"Error processing {filename}: {e}")
-                    continue
-        
-        return jsonify({'files': mp3_files})
+        # Walk and stat first, then only probe the requested page
+        files = sort_media_files(list_media_files(folder_path, recursive), sort_key, descending)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/join-mp3', methods=['POST'])
+    total = len(files)
+    page = files[offset:] if limit is None else files[offset:offset + limit]
+
+    def file_record(entry, info):
+        name, path, st = entry
+        return {
+            'filename': name,
+            'path': path,
+            'duration': info['duration'],
+            'size': st.st_size
+        }
+
+    if stream:
+        def generate():
+            yield json.dumps({'type': 'meta', 'total': total, 'offset': offset, 'count': len(page)}) + '\n'
+            for entry, info, error in probe_many(page):
+                if error is None:
+                    line = dict(file_record(entry, info), type='file')
+                else:
+                    line = {'type': 'error', 'filename': entry[0], 'error': error}
+                yield json.dumps(line) + '\n'
+            yield json.dumps({'type': 'done'}) + '\n'
+
+        return Response(generate(), mimetype='application/x-ndjson')
+
+    mp3_files = []
+    for entry, info, error in probe_many(page):
+        if error is None:
+            mp3_files.append(file_record(entry, info))
+        else:
+            print(f"Error processing {entry[0]}: {error}")
+
+    return jsonify({'files': mp3_files, 'total': total, 'offset': offset})
+
+@bp.route('/api/join-mp3', methods=['POST'])
 def join_mp3():
-    """Join multiple MP3 files into a single output file"""
+    """Queue a job joining multiple MP3 files into a single output file"""
     data = request.json
     file_paths = data.get('filePaths')
     output_path = data.get('outputPath')
+    backend = data.get('backend', 'auto')
     
     if not file_paths or len(file_paths) == 0:
         return jsonify({'error': 'No files provided'}), 400
@@ -222,69 +544,80 @@ def join_mp3():
     for file_path in file_paths:
         if not os.path.exists(file_path):
             return jsonify({'error': f'File not found: {file_path}'}), 404
-    
-    # Create a temporary file list for FFmpeg concat
-    temp_list_path = os.path.join(os.path.dirname(output_path), 'temp_filelist.txt')
-    
+
+    if backend not in BACKENDS:
+        return jsonify({'error': f'Unknown backend: {backend}'}), 400
     try:
-        # Write file list
-        with open(temp_list_path, 'w', encoding='utf-8') as f:
-            for file_path in file_paths:
-                # Escape single quotes and use absolute paths
-                escaped_path = file_path.replace("'", "'\\''")
-                f.write(f"file '{escaped_path}'\n")
-        
-        # Ensure output has .mp3 extension
-        if not output_path.lower().endswith('.mp3'):
-            output_path += '.mp3'
-        
-        # Run FFmpeg concat
-        startupinfo = None
-        if os.name == 'nt':
-            startupinfo = subprocess.STARTUPINFO()
-            startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-        
-        cmd = [
-            'ffmpeg',
-            '-y',
-            '-f', 'concat',
-            '-safe', '0',
-            '-i', temp_list_path,
-            '-c', 'copy',
-            output_path
-        ]
-        
-        result = subprocess.run(
-            cmd,
-            capture_output=True,
-            text=True,
-            startupinfo=startupinfo
-        )
-        
-        # Clean up temp file
-        if os.path.exists(temp_list_path):
-            os.remove(temp_list_path)
-        
-        if result.returncode != 0:
-            error_msg = result.stderr if result.stderr else 'Unknown error'
-            return jsonify({'error': f'FFmpeg error: {error_msg}'}), 500
-        
-        if not os.path.exists(output_path):
-            return jsonify({'error': 'Output file was not created'}), 500
-        
-        return jsonify({
-            'success': True,
-            'outputPath': output_path,
-            'message': f'Successfully joined {len(file_paths)} files'
-        })
-        
-    except Exception as e:
-        # Clean up temp file on error
-        if os.path.exists(temp_list_path):
-            os.remove(temp_list_path)
-        return jsonify({'error': str(e)}), 500
+        normalize = parse_normalize(data.get('normalize'))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'normalize must be true or {targetLufs, truePeak}'}), 400
+    try:
+        crossfade = parse_crossfade(data)
+    except (TypeError, ValueError):
+        return jsonify({'error': f'crossfade must be a number of seconds from 0 to '
+                                 f'{smart_render.MAX_CROSSFADE_SECONDS:g}'}), 400
+
+    job = _job_manager().submit('join', run_join, file_paths, output_path, backend, normalize, crossfade)
+    return jsonify({'success': True, 'jobId': job.id}), 202
+
+def run_join(job, file_paths, output_path, backend, normalize=None, crossfade=None):
+    """Joins the files; runs on a job worker."""
+    output_path = join_files(file_paths, output_path, job, backend, normalize, crossfade)
+    return {
+        'success': True,
+        'outputPath': output_path,
+        'message': f'Successfully joined {len(file_paths)} files'
+    }
+
+@bp.route('/metrics')
+def metrics_endpoint():
+    """Prometheus text exposition of subprocess and API timings (CUTFILE_METRICS=1)."""
+    if not metrics.ENABLED:
+        return Response('Metrics are disabled; set CUTFILE_METRICS=1\n', status=404, mimetype='text/plain')
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@bp.route('/api/jobs/<job_id>')
+def job_status(job_id):
+    job = _job_manager().get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job.to_dict())
+
+@bp.route('/api/jobs/<job_id>/events')
+def job_events(job_id):
+    """Server-sent events with a job snapshot on every change until it finishes"""
+    job = _job_manager().get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+
+    def generate():
+        version = None
+        while True:
+            current = job.wait_for_change(version, SSE_KEEPALIVE_SECONDS)
+            if current == version:
+                yield ': keepalive\n\n'
+                continue
+            version = current
+            snapshot = job.to_dict()
+            yield f"data: {json.dumps(snapshot)}\n\n"
+            if snapshot['status'] in FINISHED_STATES:
+                break
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@bp.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    job = _job_manager().cancel(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job.to_dict())
 
 if __name__ == '__main__':
-    # Open browser automatically
-    threading.Timer(1.5, lambda: subprocess.run(['start', 'http://127.0.0.1:5000'], shell=True)).start()
-    app.run(debug=True, use_reloader=False)
+    app = create_app()
+    host = os.environ.get('CUTFILE_HOST', '127.0.0.1')
+    port = int(os.environ.get('CUTFILE_PORT', 5000))
+    # Open browser automatically on the desktop
+    if _env_flag('CUTFILE_OPEN_BROWSER', app.config['DESKTOP']):
+        threading.Timer(1.5, webbrowser.open, [f'http://{host}:{port}']).start()
+    app.run(host=host, port=port, debug=_env_flag('CUTFILE_DEBUG', False), use_reloader=False)
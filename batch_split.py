@@ -0,0 +1,330 @@
+import csv
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from media_probe import list_media_files, probe_many
+from split_engine import build_fixed_segments, split_segments
+
+# Manifest formats recognised by file extension
+MANIFEST_EXTENSIONS = ('.json', '.csv')
+# Default journal name, created in the output root
+JOURNAL_NAME = '.cutfile_journal.jsonl'
+# Bytes read at a time when checksumming outputs
+HASH_CHUNK_SIZE = 1024 * 1024
+# Seconds of audio one task cuts at most; its outputs are journaled when it ends,
+# so an interrupted batch redoes at most this much per worker
+MAX_TASK_SECONDS = 300
+
+
+class BatchError(Exception):
+    """Raised when a batch manifest or directory cannot be turned into a plan."""
+
+
+def is_batch_input(path):
+    """True for inputs handled in batch mode: folders and JSON/CSV manifests."""
+    return os.path.isdir(path) or path.lower().endswith(MANIFEST_EXTENSIONS)
+
+
+def file_checksum(path):
+    """SHA-256 of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _entry(input_file, output_dir=None, segment_length=None, segments=None):
+    return {'input': input_file, 'outputDir': output_dir, 'segmentLength': segment_length, 'segments': segments}
+
+
+def _float(value, what, source):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise BatchError(f"{source}: invalid {what}: {value!r}")
+
+
+def load_json_manifest(path):
+    """Reads a JSON manifest: a list of entries, or {"files": [...]}.
+
+    Each entry has 'input' and either 'segmentLength' (seconds) or
+    'segments' (a list of {start, end, name?}); 'outputDir' is optional.
+    Relative paths are resolved against the manifest's folder.
+    """
+    with open(path, encoding='utf-8') as f:
+        try:
+            data = json.load(f)
+        except ValueError as e:
+            raise BatchError(f"{path}: {e}")
+    items = data.get('files') if isinstance(data, dict) else data
+    if not isinstance(items, list):
+        raise BatchError(f"{path}: expected a list of files")
+
+    base = os.path.dirname(os.path.abspath(path))
+    entries = []
+    for i, item in enumerate(items, 1):
+        source = f"{os.path.basename(path)} entry {i}"
+        if not isinstance(item, dict) or not item.get('input'):
+            raise BatchError(f"{source}: 'input' is required")
+        segments = None
+        if item.get('segments') is not None:
+            if not isinstance(item['segments'], list):
+                raise BatchError(f"{source}: 'segments' must be a list")
+            segments = []
+            for j, seg in enumerate(item['segments'], 1):
+                if not isinstance(seg, dict):
+                    raise BatchError(f"{source} segment {j}: expected an object with start and end")
+                segments.append((_float(seg.get('start'), 'start', f"{source} segment {j}"),
+                                 _float(seg.get('end'), 'end', f"{source} segment {j}"), seg.get('name')))
+        segment_length = item.get('segmentLength')
+        if segment_length is not None:
+            segment_length = _float(segment_length, 'segmentLength', source)
+        output_dir = item.get('outputDir')
+        entries.append(_entry(os.path.normpath(os.path.join(base, item['input'])),
+                              os.path.normpath(os.path.join(base, output_dir)) if output_dir else None,
+                              segment_length, segments))
+    return entries
+
+
+def load_csv_manifest(path):
+    """Reads a CSV manifest with a header row.
+
+    Columns: input, and either start/end (one row per segment, optional
+    name) or segment_length (one row per file); output_dir is optional.
+    Rows of the same input are merged in file order.
+    """
+    base = os.path.dirname(os.path.abspath(path))
+    entries = {}
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        reader = csv.DictReader(f)
+        if not reader.fieldnames or 'input' not in reader.fieldnames:
+            raise BatchError(f"{path}: an 'input' column is required")
+        for line, row in enumerate(reader, 2):
+            source = f"{os.path.basename(path)} line {line}"
+            if not (row.get('input') or '').strip():
+                continue
+            input_file = os.path.normpath(os.path.join(base, row['input'].strip()))
+            output_dir = (row.get('output_dir') or '').strip()
+            entry = entries.setdefault(input_file, _entry(input_file, os.path.normpath(os.path.join(base, output_dir)) if output_dir else None))
+            if (row.get('start') or '').strip() or (row.get('end') or '').strip():
+                entry['segments'] = entry['segments'] or []
+                entry['segments'].append((_float(row.get('start'), 'start', source),
+                                          _float(row.get('end'), 'end', source),
+                                          (row.get('name') or '').strip() or None))
+            elif (row.get('segment_length') or '').strip():
+                entry['segmentLength'] = _float(row['segment_length'], 'segment_length', source)
+    return list(entries.values())
+
+
+def load_directory(folder, recursive=False):
+    """One entry per MP3 under folder, to be cut at the default segment length."""
+    return [_entry(path) for _, path, _ in sorted(list_media_files(folder, recursive))]
+
+
+def build_plan(entries, output_root, default_length):
+    """Expands entries into per-input lists of segment dicts (start, end, path, index).
+
+    Each input gets its own folder under output_root (unless the entry
+    names one) and deterministic names, '<index>_<stem>.mp3' by default,
+    so a rerun maps every segment to the same path. Returns (plan, errors)
+    where plan is a list of (input_file, segments).
+    """
+    errors = [f"{e['input']}: file not found" for e in entries if not os.path.isfile(e['input'])]
+    entries = [e for e in entries if os.path.isfile(e['input'])]
+    needs_duration = [e for e in entries if e['segments'] is None]
+    durations = {}
+    for (name, path, st), info, error in probe_many([(e['input'], e['input'], None) for e in needs_duration]):
+        if error is None:
+            durations[path] = info['duration']
+        else:
+            errors.append(f"{path}: {error}")
+
+    plan = []
+    used_dirs = set()
+    for entry in entries:
+        input_file = entry['input']
+        stem = os.path.splitext(os.path.basename(input_file))[0]
+        output_dir = entry['outputDir']
+        if not output_dir:
+            # Same-named recordings from different folders get '<stem>_2', ... in input order
+            output_dir = os.path.join(output_root, stem)
+            suffix = 2
+            while output_dir in used_dirs:
+                output_dir = os.path.join(output_root, f"{stem}_{suffix}")
+                suffix += 1
+            used_dirs.add(output_dir)
+        if entry['segments'] is not None:
+            ranges = entry['segments']
+        elif input_file in durations:
+            length = entry['segmentLength'] or default_length
+            if length <= 0:
+                errors.append(f"{input_file}: segment length must be greater than 0")
+                continue
+            ranges = [(start, end, None) for start, end in build_fixed_segments(durations[input_file], length)]
+        else:
+            continue
+        segments = []
+        for index, (start, end, name) in enumerate(ranges, 1):
+            name = name or f"{index}_{stem}"
+            if not name.lower().endswith('.mp3'):
+                name += '.mp3'
+            segments.append({'start': start, 'end': end, 'path': os.path.join(output_dir, name), 'index': index})
+        plan.append((input_file, segments))
+    return plan, errors
+
+
+class Journal:
+    """Append-only JSON Lines record of verified outputs, used to resume a batch."""
+
+    def __init__(self, path):
+        self.path = path
+        self._done = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                        self._done[self._key(record)] = record
+                    except (ValueError, KeyError):
+                        continue  # a line cut short by an interrupted run
+        self._file = open(path, 'a', encoding='utf-8')
+        if self._file.tell() > 0:
+            with open(path, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    self._file.write('\n')
+
+    @staticmethod
+    def _key(record):
+        return (record['input'], record['inputSize'], record['inputMtimeNs'],
+                round(record['start'], 6), round(record['end'], 6), os.path.abspath(record['path']))
+
+    @staticmethod
+    def source_record(input_file, seg):
+        st = os.stat(input_file)
+        return {'input': os.path.abspath(input_file), 'inputSize': st.st_size, 'inputMtimeNs': st.st_mtime_ns,
+                'start': seg['start'], 'end': seg['end'], 'path': os.path.abspath(seg['path'])}
+
+    def is_done(self, input_file, seg):
+        """True when seg was produced before and its file still has the recorded size and checksum."""
+        record = self._done.get(self._key(self.source_record(input_file, seg)))
+        if record is None:
+            return False
+        try:
+            if os.path.getsize(record['path']) != record['size']:
+                return False
+            return file_checksum(record['path']) == record['sha256']
+        except OSError:
+            return False
+
+    def record(self, input_file, seg):
+        entry = self.source_record(input_file, seg)
+        entry['size'] = os.path.getsize(seg['path'])
+        entry['sha256'] = file_checksum(seg['path'])
+        line = json.dumps(entry)
+        with self._lock:
+            self._file.write(line + '\n')
+            self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+def _bounded(segments):
+    """Cuts time-ordered segments into runs spanning at most MAX_TASK_SECONDS (one segment at least)."""
+    runs = []
+    for seg in segments:
+        if runs and seg['end'] - runs[-1][0]['start'] <= MAX_TASK_SECONDS:
+            runs[-1].append(seg)
+        else:
+            runs.append([seg])
+    return runs
+
+
+def _tasks(plan, workers):
+    """Splits each input's segments into time-ordered chunks for the shared pool.
+
+    Inputs get more chunks when there are fewer inputs than workers, so a
+    handful of long recordings still keeps every worker busy. No chunk
+    spans more than MAX_TASK_SECONDS of audio.
+    """
+    per_input = max(1, workers // max(1, len(plan)))
+    tasks = []
+    for input_file, segments in plan:
+        ordered = sorted(segments, key=lambda seg: seg['start'])
+        size = -(-len(ordered) // min(per_input, len(ordered)))
+        for i in range(0, len(ordered), size):
+            tasks.extend((input_file, run) for run in _bounded(ordered[i:i + size]))
+    return tasks
+
+
+def run_batch(plan, journal, workers=1, backend='ffmpeg', log=print):
+    """Cuts every pending segment of plan on one pool of `workers` threads.
+
+    Segments the journal already vouches for are skipped. New outputs are
+    checksummed and journaled as soon as their task ends; tasks span at
+    most MAX_TASK_SECONDS of one input, so an interrupted batch redoes
+    little more than the tasks that were running. Returns (created,
+    skipped, failures) where failures lists (path, error).
+    """
+    pending = []
+    skipped = 0
+    for input_file, segments in plan:
+        todo = [seg for seg in segments if not journal.is_done(input_file, seg)]
+        skipped += len(segments) - len(todo)
+        if todo:
+            pending.append((input_file, todo))
+    if skipped:
+        log(f"Skipping {skipped} segments already completed.")
+
+    def cut(input_file, segments):
+        for output_dir in {os.path.dirname(seg['path']) for seg in segments}:
+            os.makedirs(output_dir, exist_ok=True)
+        results = []
+        # Tasks after the first of an input seek to their start instead of re-reading the file
+        seek = segments[0]['start'] > 0
+        for seg, (path, error) in zip(segments, split_segments(input_file, segments, backend, seek=seek)):
+            if error is None:
+                journal.record(input_file, seg)
+            results.append((input_file, path, error))
+        return results
+
+    created = 0
+    failures = []
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = {pool.submit(cut, input_file, segments): segments
+                   for input_file, segments in _tasks(pending, workers)}
+        for future in as_completed(futures):
+            try:
+                results = future.result()
+            except Exception as e:
+                for seg in futures[future]:
+                    failures.append((seg['path'], str(e)))
+                    log(f"Error creating {seg['path']}: {e}")
+                continue
+            for input_file, path, error in results:
+                if error is None:
+                    created += 1
+                    log(f"Created: {path}")
+                else:
+                    failures.append((path, error))
+                    log(f"Error creating {path}: {error}")
+    return created, skipped, failures
+
+
+def load_entries(source, recursive=False):
+    """Reads a folder, JSON manifest or CSV manifest into batch entries."""
+    if os.path.isdir(source):
+        return load_directory(source, recursive)
+    if not os.path.isfile(source):
+        raise BatchError(f"{source}: not found")
+    if source.lower().endswith('.json'):
+        return load_json_manifest(source)
+    if source.lower().endswith('.csv'):
+        return load_csv_manifest(source)
+    raise BatchError(f"{source}: expected a folder or a .json/.csv manifest")
@@ -0,0 +1,460 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Synthetic corpus: name -> (lavfi source, encoder options, seconds, quick seconds)
+CORPUS = {
+    'cbr_short': ('sine=frequency=440:sample_rate=44100', ['-b:a', '128k'], 60, 60),
+    'vbr_short': ('anoisesrc=color=pink:amplitude=0.3:sample_rate=44100', ['-q:a', '4'], 60, 60),
+    'cbr_long': ('sine=frequency=440:sample_rate=44100', ['-b:a', '128k'], 2 * 3600, 600),
+    'vbr_long': ('anoisesrc=color=pink:amplitude=0.3:sample_rate=44100', ['-q:a', '4'], 2 * 3600, 600),
+}
+# Folder corpus: copies of one short clip, so generating thousands of files stays cheap
+FOLDER_FILES = 2000
+FOLDER_FILES_QUICK = 200
+FOLDER_CLIP_SECONDS = 5
+
+# Extra encodings for probe-check: name -> (lavfi source, ffmpeg output options, seconds)
+PROBE_VARIANTS = {
+    'cbr_no_xing': ('sine=frequency=440:sample_rate=44100', ['-ac', '2', '-b:a', '128k', '-write_xing', '0'], 37),
+    'cbr_id3v1': ('sine=frequency=440:sample_rate=44100',
+                  ['-ac', '2', '-b:a', '192k', '-write_id3v1', '1', '-metadata', 'title=probe'], 37),
+    'cbr_48k_320': ('sine=frequency=440:sample_rate=48000', ['-ac', '2', '-b:a', '320k'], 37),
+    'cbr_mpeg25_8k': ('sine=frequency=440:sample_rate=8000', ['-ac', '1', '-b:a', '16k'], 37),
+    'vbr_mpeg2_mono': ('anoisesrc=color=pink:amplitude=0.3:sample_rate=22050', ['-ac', '1', '-q:a', '5'], 37),
+    'vbr_no_xing': ('anoisesrc=color=pink:amplitude=0.3:sample_rate=44100',
+                    ['-ac', '2', '-q:a', '2', '-write_xing', '0'], 37),
+}
+
+# Benchmark cases: name -> (kind, corpus entry, options)
+CASES = {
+    'split_file[cbr_short]': ('split_file', 'cbr_short', {'segment': 10}),
+    'split_file[cbr_long]': ('split_file', 'cbr_long', {'segment': 300}),
+    'split_file[vbr_long]': ('split_file', 'vbr_long', {'segment': 300}),
+    'join_mp3[cbr_long]': ('join_mp3', 'cbr_long', {'segment': 300}),
+    'join_mp3[vbr_long]': ('join_mp3', 'vbr_long', {'segment': 300}),
+    'list_mp3_files[folder]': ('list_mp3_files', 'folder', {}),
+    'startup[cbr_short]': ('startup', 'cbr_short', {}),
+    'split_mp3[cbr_long,ffmpeg]': ('split_mp3', 'cbr_long', {'segment': 300, 'backend': 'ffmpeg'}),
+    'split_mp3[cbr_long,native]': ('split_mp3', 'cbr_long', {'segment': 300, 'backend': 'native'}),
+    'split_mp3[vbr_long,native]': ('split_mp3', 'vbr_long', {'segment': 300, 'backend': 'native'}),
+    'split_mp3[vbr_short,ffmpeg]': ('split_mp3', 'vbr_short', {'segment': 10, 'backend': 'ffmpeg'}),
+}
+
+# A case is flagged when it gets slower (or bigger) than the baseline by more than this
+DEFAULT_THRESHOLD = 0.10
+# Differences below this many seconds are noise, whatever the ratio
+MIN_DELTA_SECONDS = 0.05
+
+
+def _encode(path, source, options, seconds):
+    cmd = ['ffmpeg', '-v', 'error', '-y', '-f', 'lavfi', '-i', f"{source}:duration={seconds}",
+           '-ac', '2', '-c:a', 'libmp3lame'] + options + [path]
+    subprocess.run(cmd, check=True)
+
+
+def build_corpus(corpus_dir, quick=False):
+    """Creates the synthetic inputs under corpus_dir, reusing files from earlier runs."""
+    suffix = '_quick' if quick else ''
+    os.makedirs(corpus_dir, exist_ok=True)
+    files = {}
+    for name, (source, options, seconds, quick_seconds) in CORPUS.items():
+        path = os.path.join(corpus_dir, f"{name}{suffix}.mp3")
+        if not os.path.exists(path):
+            print(f"Generating {os.path.basename(path)}...", file=sys.stderr)
+            _encode(path + '.tmp.mp3', source, options, quick_seconds if quick else seconds)
+            os.replace(path + '.tmp.mp3', path)
+        files[name] = path
+
+    count = FOLDER_FILES_QUICK if quick else FOLDER_FILES
+    folder = os.path.join(corpus_dir, f"folder_{count}")
+    if not os.path.isdir(folder):
+        print(f"Generating {os.path.basename(folder)}...", file=sys.stderr)
+        clip = os.path.join(corpus_dir, 'clip.mp3')
+        if not os.path.exists(clip):
+            _encode(clip, CORPUS['cbr_short'][0], CORPUS['cbr_short'][1], FOLDER_CLIP_SECONDS)
+        temp_folder = folder + '.tmp'
+        shutil.rmtree(temp_folder, ignore_errors=True)
+        # Spread over subfolders so the recursive walk is exercised too
+        for i in range(count):
+            subdir = os.path.join(temp_folder, f"d{i // 500:02d}")
+            os.makedirs(subdir, exist_ok=True)
+            shutil.copyfile(clip, os.path.join(subdir, f"track_{i:05d}.mp3"))
+        os.replace(temp_folder, folder)
+    files['folder'] = folder
+    return files
+
+
+def build_probe_variants(corpus_dir):
+    """Creates the PROBE_VARIANTS files under corpus_dir/probe, reusing earlier ones."""
+    folder = os.path.join(corpus_dir, 'probe')
+    os.makedirs(folder, exist_ok=True)
+    paths = []
+    for name, (source, options, seconds) in PROBE_VARIANTS.items():
+        path = os.path.join(folder, f"{name}.mp3")
+        if not os.path.exists(path):
+            cmd = ['ffmpeg', '-v', 'error', '-y', '-f', 'lavfi', '-i', f"{source}:duration={seconds}",
+                   '-c:a', 'libmp3lame'] + options + [path + '.tmp.mp3']
+            subprocess.run(cmd, check=True)
+            os.replace(path + '.tmp.mp3', path)
+        paths.append(path)
+    return paths
+
+
+def check_probe(corpus_dir, quick=False):
+    """Compares header-probed durations with ffprobe; returns the files off by more than the tolerance."""
+    from media_probe import HEADER_PROBE_TOLERANCE, run_ffprobe
+    from mp3_frames import Mp3FormatError, read_stream_info
+
+    files = build_corpus(corpus_dir, quick)
+    paths = [files[name] for name in CORPUS] + [os.path.join(corpus_dir, 'clip.mp3')]
+    paths += build_probe_variants(corpus_dir)
+    mismatches = []
+    for path in paths:
+        started = time.perf_counter()
+        expected = run_ffprobe(path)['duration']
+        ffprobe_seconds = time.perf_counter() - started
+        started = time.perf_counter()
+        try:
+            duration = read_stream_info(path)['duration']
+        except Mp3FormatError as e:
+            # Falling back is always allowed; media_probe then uses ffprobe's answer
+            print(f"{os.path.basename(path):28} fallback ({e})")
+            continue
+        header_seconds = time.perf_counter() - started
+        delta = duration - expected
+        flag = ''
+        if abs(delta) > HEADER_PROBE_TOLERANCE:
+            mismatches.append(path)
+            flag = '  MISMATCH'
+        print(f"{os.path.basename(path):28} {duration:12.3f} vs {expected:12.3f} {delta:+.4f}s"
+              f"  ({header_seconds * 1000:.2f} ms vs {ffprobe_seconds * 1000:.1f} ms){flag}")
+    return mismatches
+
+
+def _peak_rss_kb():
+    """Peak resident set size of this process and of its largest child, in KB."""
+    if resource is None:
+        return None
+    scale = 1024 if sys.platform == 'darwin' else 1  # bytes on macOS, KB elsewhere
+    return {
+        'self': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // scale,
+        'children': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss // scale,
+    }
+
+
+class Stages:
+    """Collects wall-clock seconds per named stage."""
+
+    def __init__(self):
+        self.seconds = {}
+
+    @contextlib.contextmanager
+    def time(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[name] = self.seconds.get(name, 0.0) + time.perf_counter() - started
+
+
+def _fixed_plan(duration, segment_length):
+    from split_engine import build_fixed_segments
+    return [{'start': start, 'end': end, 'outputName': f"part_{i + 1}"}
+            for i, (start, end) in enumerate(build_fixed_segments(duration, segment_length))]
+
+
+def _wait_for_job(app_module, client, response):
+    data = response.get_json()
+    if response.status_code != 202:
+        raise RuntimeError(data.get('error', f"HTTP {response.status_code}"))
+    job = client.application.extensions['cutfile_jobs'].get(data['jobId'])
+    version = None
+    while job.status not in app_module.FINISHED_STATES:
+        version = job.wait_for_change(version, 1)
+    if job.error:
+        raise RuntimeError(job.error)
+    return job.result
+
+
+def _case_split_file(app_module, client, stages, path, work_dir, options):
+    with stages.time('probe'):
+        info = client.post('/api/file-info', json={'path': path}).get_json()
+    plan = _fixed_plan(info['duration'], options['segment'])
+    with stages.time('cut'):
+        _wait_for_job(app_module, client, client.post('/api/split', json={
+            'inputFile': path, 'outputDir': work_dir, 'segments': plan}))
+    with stages.time('zip'):
+        response = client.post('/api/split-zip', json={'inputFile': path, 'segments': plan})
+        size = sum(len(chunk) for chunk in response.response)
+        response.close()
+    return {'segments': len(plan), 'zipBytes': size}, info['duration']
+
+
+def _case_join_mp3(app_module, client, stages, path, work_dir, options):
+    info = client.post('/api/file-info', json={'path': path}).get_json()
+    plan = _fixed_plan(info['duration'], options['segment'])
+    parts_dir = os.path.join(work_dir, 'parts')
+    _wait_for_job(app_module, client, client.post('/api/split', json={
+        'inputFile': path, 'outputDir': parts_dir, 'segments': plan}))
+    # A sub-frame tail yields no file, which is not what this case measures
+    parts = [p for p in (os.path.join(parts_dir, seg['outputName'] + '.mp3') for seg in plan) if os.path.exists(p)]
+    with stages.time('concat'):
+        _wait_for_job(app_module, client, client.post('/api/join-mp3', json={
+            'filePaths': parts, 'outputPath': os.path.join(work_dir, 'joined.mp3')}))
+    return {'inputs': len(parts)}, info['duration']
+
+
+def _case_list_mp3_files(app_module, client, stages, path, work_dir, options):
+    body = {'folderPath': path, 'recursive': True}
+    with stages.time('scan_cold'):
+        cold = client.post('/api/list-mp3-files', json=body).get_json()
+    with stages.time('scan_warm'):
+        client.post('/api/list-mp3-files', json=body).get_json()
+    return {'files': cold['total']}, sum(f['duration'] for f in cold['files'])
+
+
+def _case_split_mp3(app_module, client, stages, path, work_dir, options):
+    import mp3_splitter
+    from media_probe import get_duration
+    with stages.time('probe'):
+        duration = get_duration(path)
+    with stages.time('cut'), contextlib.redirect_stdout(io.StringIO()):
+        mp3_splitter.split_mp3(path, options['segment'], work_dir, options['backend'], jobs=1)
+    return {'segments': len(os.listdir(work_dir))}, duration
+
+
+# Run in a fresh interpreter: prints seconds to import app, build it and answer the first requests
+STARTUP_SCRIPT = """
+import json, sys, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+client = app.create_app().test_client()
+created = time.perf_counter()
+client.get('/')
+first = time.perf_counter()
+client.post('/api/file-info', json={'path': sys.argv[1]})
+probed = time.perf_counter()
+print(json.dumps({'import': imported - started, 'create_app': created - imported,
+                  'first_request': first - created, 'first_probe': probed - first}))
+"""
+
+
+def _case_startup(app_module, client, stages, path, work_dir, options):
+    here = os.path.dirname(os.path.abspath(__file__))
+    result = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT, path], capture_output=True, text=True,
+                            check=True, cwd=work_dir, env=dict(os.environ, PYTHONPATH=here, CUTFILE_DESKTOP='0'))
+    stages.seconds.update(json.loads(result.stdout.strip().splitlines()[-1]))
+    return {}, 0
+
+
+CASE_RUNNERS = {
+    'split_file': _case_split_file,
+    'join_mp3': _case_join_mp3,
+    'list_mp3_files': _case_list_mp3_files,
+    'split_mp3': _case_split_mp3,
+    'startup': _case_startup,
+}
+
+
+def run_case_here(name, path):
+    """Runs one case in this (fresh) process and returns its measurements."""
+    import app as app_module
+    kind, _, options = CASES[name]
+    client = app_module.create_app().test_client()
+    stages = Stages()
+    work_dir = tempfile.mkdtemp(prefix='cutfile_bench_')
+    try:
+        started = time.perf_counter()
+        details, audio_seconds = CASE_RUNNERS[kind](app_module, client, stages, path, work_dir, options)
+        seconds = time.perf_counter() - started
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if os.path.isdir(path):
+        size = sum(os.path.getsize(os.path.join(root, f)) for root, _, names in os.walk(path) for f in names)
+    else:
+        size = os.path.getsize(path)
+    return {
+        'seconds': seconds,
+        'stages': stages.seconds,
+        'inputBytes': size,
+        'audioSeconds': audio_seconds,
+        'details': details,
+        'peakRssKb': _peak_rss_kb(),
+    }
+
+
+def run_case(name, path):
+    """Runs a case in a child process so caches, imports and peak RSS start clean."""
+    with tempfile.TemporaryDirectory(prefix='cutfile_bench_cache_') as cache_dir:
+        env = dict(os.environ, CUTFILE_CACHE_DIR=cache_dir)
+        result = subprocess.run([sys.executable, os.path.abspath(__file__), '_case', name, path],
+                                capture_output=True, text=True, env=env)
+    if result.returncode != 0:
+        raise RuntimeError(f"{name} failed: {result.stderr.strip()}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def summarize(runs):
+    """Median over repeated runs, plus throughput derived from it."""
+    seconds = statistics.median(r['seconds'] for r in runs)
+    stage_names = runs[0]['stages']
+    first = runs[0]
+    rss = [r['peakRssKb'] for r in runs if r['peakRssKb']]
+    return {
+        'seconds': seconds,
+        'runs': [r['seconds'] for r in runs],
+        'stages': {s: statistics.median(r['stages'][s] for r in runs) for s in stage_names},
+        'inputBytes': first['inputBytes'],
+        'audioSeconds': first['audioSeconds'],
+        'mbPerSecond': first['inputBytes'] / seconds / 1e6 if seconds else None,
+        'realtimeFactor': first['audioSeconds'] / seconds if seconds else None,
+        'peakRssKb': {k: max(r[k] for r in rss) for k in ('self', 'children')} if rss else None,
+        'details': first['details'],
+    }
+
+
+def _ffmpeg_version():
+    try:
+        out = subprocess.run(['ffmpeg', '-version'], capture_output=True, text=True).stdout
+        return out.splitlines()[0] if out else None
+    except OSError:
+        return None
+
+
+def run_benchmarks(corpus_dir, output, quick=False, repeat=3, only=None):
+    files = build_corpus(corpus_dir, quick)
+    results = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'ffmpeg': _ffmpeg_version(),
+        'quick': quick,
+        'repeat': repeat,
+        'cases': {},
+    }
+    for name, (kind, corpus_name, _) in CASES.items():
+        if only and not any(pattern in name for pattern in only):
+            continue
+        print(f"{name}...", end=' ', flush=True, file=sys.stderr)
+        runs = [run_case(name, files[corpus_name]) for _ in range(repeat)]
+        summary = summarize(runs)
+        results['cases'][name] = summary
+        stages = ', '.join(f"{s} {v:.2f}s" for s, v in summary['stages'].items())
+        print(f"{summary['seconds']:.2f}s ({stages})", file=sys.stderr)
+
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {output}", file=sys.stderr)
+    return results
+
+
+def _metrics(case):
+    """Comparable numbers of one case: lower is better for all of them."""
+    metrics = {'seconds': case['seconds']}
+    metrics.update({f"stage:{name}": value for name, value in case['stages'].items()})
+    if case.get('peakRssKb'):
+        metrics['peakRssKb:self'] = case['peakRssKb']['self']
+    return metrics
+
+
+def compare(baseline, current, threshold=DEFAULT_THRESHOLD):
+    """Returns (rows, regressions); a row is (case, metric, before, after, change)."""
+    rows = []
+    regressions = []
+    for name, case in current['cases'].items():
+        before_case = baseline['cases'].get(name)
+        if before_case is None:
+            continue
+        before_metrics = _metrics(before_case)
+        for metric, after in _metrics(case).items():
+            before = before_metrics.get(metric)
+            if not before:
+                continue
+            change = (after - before) / before
+            row = (name, metric, before, after, change)
+            rows.append(row)
+            is_time = not metric.startswith('peakRssKb')
+            if change > threshold and (not is_time or after - before > MIN_DELTA_SECONDS):
+                regressions.append(row)
+    return rows, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the split, join and scan code paths on synthetic MP3s.")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = sub.add_parser('run', help="Generate the corpus (once) and time every case.")
+    run_parser.add_argument("--corpus-dir", default=os.path.join(tempfile.gettempdir(), 'cutfile_bench_corpus'),
+                            help="Where synthetic inputs are generated and reused (default: system temp).")
+    run_parser.add_argument("--output", default='benchmark_results.json', help="JSON results file.")
+    run_parser.add_argument("--quick", action="store_true",
+                            help="Use 10-minute long files and a smaller folder instead of 2 hours / 2000 files.")
+    run_parser.add_argument("--repeat", type=int, default=3, help="Runs per case; the median is kept (default: 3).")
+    run_parser.add_argument("--only", nargs='+', help="Only run cases whose name contains one of these strings.")
+
+    compare_parser = sub.add_parser('compare', help="Flag regressions of a results file against a baseline.")
+    compare_parser.add_argument("baseline", help="Baseline results JSON.")
+    compare_parser.add_argument("current", help="Current results JSON.")
+    compare_parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                                help=f"Relative slowdown that counts as a regression (default: {DEFAULT_THRESHOLD}).")
+
+    probe_parser = sub.add_parser('probe-check',
+                                  help="Check header-probed MP3 durations against ffprobe on the corpus.")
+    probe_parser.add_argument("--corpus-dir", default=os.path.join(tempfile.gettempdir(), 'cutfile_bench_corpus'),
+                              help="Where synthetic inputs are generated and reused (default: system temp).")
+    probe_parser.add_argument("--quick", action="store_true", help="Use the quick corpus.")
+
+    case_parser = sub.add_parser('_case')
+    case_parser.add_argument("name")
+    case_parser.add_argument("path")
+
+    args = parser.parse_args()
+
+    if args.command == '_case':
+        print(json.dumps(run_case_here(args.name, args.path)))
+    elif args.command == 'run':
+        if args.repeat < 1:
+            print("Error: --repeat must be at least 1.", file=sys.stderr)
+            sys.exit(1)
+        run_benchmarks(args.corpus_dir, args.output, args.quick, args.repeat, args.only)
+    elif args.command == 'probe-check':
+        mismatches = check_probe(args.corpus_dir, args.quick)
+        if mismatches:
+            print(f"{len(mismatches)} file(s) outside the tolerance", file=sys.stderr)
+            sys.exit(1)
+        print("All header durations within tolerance.", file=sys.stderr)
+    else:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        with open(args.current, encoding='utf-8') as f:
+            current = json.load(f)
+        rows, regressions = compare(baseline, current, args.threshold)
+        for name, metric, before, after, change in rows:
+            flag = '  REGRESSION' if (name, metric, before, after, change) in regressions else ''
+            print(f"{name:32} {metric:22} {before:12.3f} -> {after:12.3f} {change:+7.1%}{flag}")
+        if regressions:
+            print(f"{len(regressions)} regression(s) above {args.threshold:.0%}", file=sys.stderr)
+            sys.exit(1)
+        print("No regressions.", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+import mimetypes
+import os
+from email.utils import formatdate
+
+from flask import Response
+from werkzeug.http import parse_date
+
+# Bytes read per iteration when a range has to be streamed from Python
+SEND_CHUNK_SIZE = 256 * 1024
+
+
+def make_etag(st):
+    """Strong ETag from size and mtime: it changes whenever the file does."""
+    return f'"{st.st_size:x}-{st.st_mtime_ns:x}"'
+
+
+def _etag_matches(header, etag):
+    """True when an If-None-Match / If-Range header lists etag (or is '*')."""
+    if header.strip() == '*':
+        return True
+    candidates = [tag.strip() for tag in header.split(',')]
+    # If-None-Match compares weakly, so W/"x" matches "x"
+    return any(tag == etag or tag == 'W/' + etag for tag in candidates)
+
+
+def _not_modified(request, etag, mtime):
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match is not None:
+        return _etag_matches(if_none_match, etag)
+    # If-Modified-Since is only considered without If-None-Match
+    since = parse_date(request.headers.get('If-Modified-Since'))
+    return since is not None and int(mtime) <= since.timestamp()
+
+
+def _range_applies(request, etag, mtime):
+    """Evaluates If-Range: a stale validator means the whole file is sent instead."""
+    if_range = request.headers.get('If-Range')
+    if if_range is None:
+        return True
+    if_range = if_range.strip()
+    if if_range.startswith('"'):
+        return if_range == etag
+    date = parse_date(if_range)
+    return date is not None and int(mtime) == int(date.timestamp())
+
+
+def parse_byte_range(header, size):
+    """Parses a single 'bytes=' range against size.
+
+    Returns (start, end) inclusive, 'multi' for multi-range requests,
+    'unsatisfiable' when the range lies outside the file, or None when the
+    header is malformed (and should be ignored per RFC 9110).
+    """
+    unit, _, spec = header.partition('=')
+    if unit.strip().lower() != 'bytes' or not spec.strip():
+        return None
+    if ',' in spec:
+        return 'multi'
+    first, sep, last = spec.strip().partition('-')
+    if not sep:
+        return None
+    try:
+        if first == '':
+            # Suffix range: the last N bytes
+            length = int(last)
+            if length <= 0 or size == 0:
+                return 'unsatisfiable'
+            return max(0, size - length), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if start >= size:
+        return 'unsatisfiable'
+    if end < start:
+        return None
+    return start, min(end, size - 1)
+
+
+def _iter_range(f, start, length):
+    try:
+        f.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = f.read(min(SEND_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        f.close()
+
+
+def send_media_file(path, request):
+    """Serves path with ETag/Last-Modified validation and single byte ranges.
+
+    Answers 304 for fresh conditional requests, 206 for one satisfiable
+    range, and 416 for unsatisfiable or multi-range requests. Bodies that
+    run to the end of the file go through the server's wsgi.file_wrapper,
+    which lets servers such as gunicorn or waitress use sendfile.
+    """
+    f = open(path, 'rb')
+    try:
+        st = os.fstat(f.fileno())
+        size = st.st_size
+        etag = make_etag(st)
+        headers = {
+            'ETag': etag,
+            'Last-Modified': formatdate(st.st_mtime, usegmt=True),
+            'Accept-Ranges': 'bytes',
+            # Always revalidate; an unchanged file then costs a 304 only
+            'Cache-Control': 'no-cache',
+        }
+        mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+
+        if _not_modified(request, etag, st.st_mtime):
+            f.close()
+            return Response(status=304, headers=headers)
+
+        status = 200
+        start, end = 0, size - 1
+        range_header = request.headers.get('Range')
+        if range_header and _range_applies(request, etag, st.st_mtime):
+            byte_range = parse_byte_range(range_header, size)
+            if byte_range in ('multi', 'unsatisfiable'):
+                f.close()
+                headers['Content-Range'] = f'bytes */{size}'
+                message = ('Multiple ranges are not supported' if byte_range == 'multi'
+                           else 'Requested range not satisfiable')
+                return Response(message + '\n', status=416, headers=headers, mimetype='text/plain')
+            if byte_range is not None:
+                start, end = byte_range
+                status = 206
+                headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+
+        length = max(0, end - start + 1)
+        headers['Content-Length'] = str(length)
+        file_wrapper = request.environ.get('wsgi.file_wrapper')
+        if file_wrapper is not None and end == size - 1:
+            f.seek(start)
+            body = file_wrapper(f, SEND_CHUNK_SIZE)
+        else:
+            body = _iter_range(f, start, length)
+        return Response(body, status=status, headers=headers, mimetype=mimetype, direct_passthrough=True)
+    except BaseException:
+        f.close()
+        raise
@@ -0,0 +1,372 @@
+import contextvars
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlite_store import ThreadLocalDB
+
+# Worker threads running queued jobs (override with CUTFILE_JOB_WORKERS)
+JOB_WORKERS = int(os.environ.get('CUTFILE_JOB_WORKERS', 2))
+# Finished jobs are forgotten after this many seconds (override with CUTFILE_JOB_RETENTION)
+JOB_RETENTION_SECONDS = float(os.environ.get('CUTFILE_JOB_RETENTION', 3600))
+# Hard cap on finished job records kept in memory
+MAX_FINISHED_JOBS = 200
+# Seconds between syncs of running jobs with the shared job store
+STORE_SYNC_SECONDS = 0.5
+# Seconds between deletions of expired records from the job store
+STORE_PRUNE_SECONDS = 60
+# Jobs whose worker process has not checked in for this long are reported as failed
+STALE_JOB_SECONDS = 30
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+FINISHED_STATES = (DONE, FAILED, CANCELLED)
+
+
+class JobCancelled(Exception):
+    """Raised inside a job's work function once the job has been cancelled."""
+
+
+class Job:
+    """State of one queued unit of work, shared between its worker and observers."""
+
+    def __init__(self, kind):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.status = QUEUED
+        self.progress = {}
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.version = 0
+        self.saved_version = None
+        self.saved_at = 0
+        self._cancel = threading.Event()
+        self._procs = set()
+        self._cond = threading.Condition()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def check_cancelled(self):
+        """Raises JobCancelled when the job was cancelled."""
+        if self._cancel.is_set():
+            raise JobCancelled()
+
+    def _changed(self):
+        # Caller holds self._cond
+        self.version += 1
+        self._cond.notify_all()
+
+    def update(self, **progress):
+        """Merges progress fields and wakes up observers."""
+        with self._cond:
+            self.progress.update(progress)
+            self._changed()
+
+    def track(self, proc):
+        """Registers a child process so cancel() can kill it."""
+        with self._cond:
+            self._procs.add(proc)
+        if self._cancel.is_set():
+            proc.kill()
+
+    def untrack(self, proc):
+        with self._cond:
+            self._procs.discard(proc)
+
+    def cancel(self):
+        """Flags the job as cancelled and kills its running child processes."""
+        self._cancel.set()
+        with self._cond:
+            procs = list(self._procs)
+            self._changed()
+        for proc in procs:
+            try:
+                proc.kill()
+            except OSError:
+                pass
+
+    def set_status(self, status, result=None, error=None):
+        with self._cond:
+            self.status = status
+            if status == RUNNING:
+                self.started = time.time()
+            elif status in FINISHED_STATES:
+                self.finished = time.time()
+                self.result = result
+                self.error = error
+            self._changed()
+
+    def wait_for_change(self, version, timeout):
+        """Blocks until the job moves past version or timeout expires; returns the current version."""
+        with self._cond:
+            self._cond.wait_for(lambda: self.version != version, timeout)
+            return self.version
+
+    def to_dict(self):
+        with self._cond:
+            return {
+                'id': self.id,
+                'kind': self.kind,
+                'status': self.status,
+                'progress': dict(self.progress),
+                'result': self.result,
+                'error': self.error,
+                'created': self.created,
+                'started': self.started,
+                'finished': self.finished,
+            }
+
+
+class JobManager:
+    """Runs jobs on a bounded worker pool and keeps their records for a while."""
+
+    def __init__(self, workers=JOB_WORKERS, retention=JOB_RETENTION_SECONDS, max_finished=MAX_FINISHED_JOBS,
+                 store=None):
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='job')
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self.retention = retention
+        self.max_finished = max_finished
+        # With a JobStore, jobs run by other worker processes can be watched and cancelled too
+        self.store = store
+        self._sync_thread = None
+        self._store_pruned = 0
+
+    def submit(self, kind, fn, *args, **kwargs):
+        """Queues fn(job, *args, **kwargs) and returns the new Job right away."""
+        job = Job(kind)
+        with self._lock:
+            self._jobs[job.id] = job
+        self.prune()
+        if self.store is not None:
+            self.store.save(job)
+            self._start_sync()
+        # The job sees the submitter's context variables (e.g. a request trace)
+        self._pool.submit(contextvars.copy_context().run, self._run, job, fn, args, kwargs)
+        return job
+
+    def _run(self, job, fn, args, kwargs):
+        try:
+            if job.cancelled:
+                job.set_status(CANCELLED)
+                return
+            job.set_status(RUNNING)
+            self._save(job)
+            try:
+                result = fn(job, *args, **kwargs)
+            except JobCancelled:
+                job.set_status(CANCELLED)
+            except Exception as e:
+                job.set_status(FAILED, error=str(e))
+            else:
+                job.set_status(CANCELLED if job.cancelled else DONE, result=result)
+        finally:
+            self._save(job)
+
+    def _save(self, job):
+        if self.store is not None:
+            self.store.save(job)
+
+    def _start_sync(self):
+        with self._lock:
+            if self._sync_thread is None:
+                self._sync_thread = threading.Thread(target=self._sync_loop, name='job-sync', daemon=True)
+                self._sync_thread.start()
+
+    def _sync_loop(self):
+        """Publishes progress of this process's running jobs and picks up cancels sent to other workers."""
+        while True:
+            time.sleep(STORE_SYNC_SECONDS)
+            with self._lock:
+                active = [job for job in self._jobs.values() if job.status not in FINISHED_STATES]
+            if not active:
+                continue
+            for job in active:
+                # Saving also refreshes the heartbeat that tells other workers this process is alive
+                if job.version != job.saved_version or time.time() - job.saved_at > STALE_JOB_SECONDS / 3:
+                    self.store.save(job)
+            for job_id in self.store.cancel_requests([job.id for job in active]):
+                job = self._jobs.get(job_id)
+                if job is not None and not job.cancelled:
+                    job.cancel()
+
+    def get(self, job_id):
+        """Returns the job, or a StoredJob when another worker process runs it; None if unknown."""
+        self.prune()
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None and self.store is not None:
+            job = self.store.load(job_id)
+        return job
+
+    def cancel(self, job_id):
+        """Cancels a job; returns it, or None when the id is unknown."""
+        job = self.get(job_id)
+        if job is not None and job.status not in FINISHED_STATES:
+            job.cancel()
+        return job
+
+    def prune(self):
+        """Drops finished jobs older than the retention period or beyond the cap."""
+        now = time.time()
+        with self._lock:
+            finished = [job for job in self._jobs.values() if job.status in FINISHED_STATES]
+            expired = [job for job in finished if now - job.finished > self.retention]
+            overflow = len(finished) - len(expired) - self.max_finished
+            if overflow > 0:
+                expired += [job for job in finished if job not in expired][:overflow]
+            for job in expired:
+                self._jobs.pop(job.id, None)
+        if self.store is not None and now - self._store_pruned > STORE_PRUNE_SECONDS:
+            self._store_pruned = now
+            self.store.prune(now - self.retention)
+
+
+class StoredJob:
+    """Read-only view of a job that another worker process is running, refreshed from the JobStore."""
+
+    def __init__(self, store, snapshot, version):
+        self.store = store
+        self.id = snapshot['id']
+        self.snapshot = snapshot
+        self.version = version
+
+    @property
+    def status(self):
+        return self.snapshot['status']
+
+    @property
+    def result(self):
+        return self.snapshot['result']
+
+    @property
+    def error(self):
+        return self.snapshot['error']
+
+    def refresh(self):
+        loaded = self.store.load(self.id)
+        if loaded is not None:
+            self.snapshot, self.version = loaded.snapshot, loaded.version
+
+    def wait_for_change(self, version, timeout):
+        """Polls the store until the job moves past version or timeout expires."""
+        deadline = time.monotonic() + timeout
+        while self.version == version:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            time.sleep(min(STORE_SYNC_SECONDS, remaining))
+            self.refresh()
+        return self.version
+
+    def cancel(self):
+        """Asks the owning process to cancel; it notices within STORE_SYNC_SECONDS."""
+        self.store.request_cancel(self.id)
+
+    def to_dict(self):
+        return dict(self.snapshot)
+
+
+class JobStore:
+    """Job snapshots in a SQLite file shared by every worker process of a server.
+
+    Each process runs its own jobs and saves them here on every status
+    change and, while they run, every STORE_SYNC_SECONDS. Any process can
+    then answer status, SSE and cancel requests for any job.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        # Without the store each process still serves its own jobs
+        self._db = ThreadLocalDB(path, (
+            'CREATE TABLE IF NOT EXISTS jobs ('
+            ' id TEXT PRIMARY KEY,'
+            ' snapshot TEXT NOT NULL,'
+            ' version INTEGER NOT NULL,'
+            ' heartbeat REAL NOT NULL,'
+            ' finished REAL,'
+            ' cancel_requested INTEGER NOT NULL DEFAULT 0)',
+        ))
+
+    def save(self, job):
+        conn = self._db.connect()
+        if conn is None:
+            return
+        # Read the version first: a change in between only means one extra save later
+        version = job.version
+        snapshot = job.to_dict()
+        try:
+            conn.execute(
+                'INSERT INTO jobs (id, snapshot, version, heartbeat, finished) VALUES (?, ?, ?, ?, ?)'
+                ' ON CONFLICT(id) DO UPDATE SET snapshot = excluded.snapshot, version = excluded.version,'
+                ' heartbeat = excluded.heartbeat, finished = excluded.finished',
+                (job.id, json.dumps(snapshot, default=str), version, time.time(), job.finished))
+            conn.commit()
+        except sqlite3.Error:
+            return
+        job.saved_version = version
+        job.saved_at = time.time()
+
+    def load(self, job_id):
+        """Returns a StoredJob, or None when the id is unknown."""
+        conn = self._db.connect()
+        if conn is None:
+            return None
+        try:
+            row = conn.execute('SELECT snapshot, version, heartbeat FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        except sqlite3.Error:
+            return None
+        if row is None:
+            return None
+        snapshot, version, heartbeat = json.loads(row[0]), row[1], row[2]
+        if snapshot['status'] not in FINISHED_STATES and time.time() - heartbeat > STALE_JOB_SECONDS:
+            # The owning process died (or was restarted) mid-job
+            snapshot.update(status=FAILED, error='The worker process running this job exited', finished=heartbeat)
+            version = -version - 1
+        return StoredJob(self, snapshot, version)
+
+    def request_cancel(self, job_id):
+        conn = self._db.connect()
+        if conn is None:
+            return
+        try:
+            conn.execute('UPDATE jobs SET cancel_requested = 1 WHERE id = ?', (job_id,))
+            conn.commit()
+        except sqlite3.Error:
+            pass
+
+    def cancel_requests(self, job_ids):
+        """The subset of job_ids that some process asked to cancel."""
+        conn = self._db.connect()
+        if conn is None or not job_ids:
+            return set()
+        try:
+            rows = conn.execute(
+                f"SELECT id FROM jobs WHERE cancel_requested = 1 AND id IN ({','.join('?' * len(job_ids))})",
+                job_ids).fetchall()
+        except sqlite3.Error:
+            return set()
+        return {row[0] for row in rows}
+
+    def prune(self, finished_before):
+        conn = self._db.connect()
+        if conn is None:
+            return
+        try:
+            conn.execute('DELETE FROM jobs WHERE finished IS NOT NULL AND finished < ?', (finished_before,))
+            conn.commit()
+        except sqlite3.Error:
+            pass
@@ -0,0 +1,199 @@
+import os
+import shutil
+import tempfile
+
+import loudness
+import mp3_frames
+import smart_render
+from media_probe import ProbeError, probe
+from split_engine import BACKENDS, run_ffmpeg
+
+
+class JoinError(Exception):
+    """Raised when input files cannot be joined."""
+
+
+def _total_duration(file_paths):
+    """Sums the cached durations of the inputs, None if any cannot be probed."""
+    try:
+        return sum(probe(path)['duration'] for path in file_paths)
+    except ProbeError:
+        return None
+
+
+def _join_native(file_paths, output_path, job=None):
+    """Frame-level join; raises mp3_frames.Mp3FormatError when ffmpeg has to do it."""
+    progress = None
+    if job is not None:
+        job.update(position=0, totalSeconds=_total_duration(file_paths), filesDone=0, filesTotal=len(file_paths))
+
+        def progress(done, seconds):
+            job.check_cancelled()
+            job.update(position=seconds, filesDone=done)
+    mp3_frames.join_files(file_paths, output_path, progress)
+
+
+def _join_ffmpeg(file_paths, output_path, job=None):
+    """Joins with ffmpeg's concat demuxer; returns stderr text on failure, None on success."""
+    # The list gets a unique name so concurrent joins into one folder cannot clash
+    fd, temp_list_path = tempfile.mkstemp(prefix='cutfile_concat_', suffix='.txt')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            for file_path in file_paths:
+                # Escape single quotes and use absolute paths
+                escaped_path = os.path.abspath(file_path).replace("'", "'\\''")
+                f.write(f"file '{escaped_path}'\n")
+
+        cmd = [
+            'ffmpeg',
+            '-y',
+            '-f', 'concat',
+            '-safe', '0',
+            '-i', temp_list_path,
+            '-c', 'copy',
+            output_path
+        ]
+
+        on_time = None
+        if job is not None:
+            total = _total_duration(file_paths)
+            job.update(position=0, totalSeconds=total)
+            on_time = lambda seconds: job.update(position=seconds)
+
+        return run_ffmpeg(cmd, job, on_time)
+    finally:
+        os.remove(temp_list_path)
+
+
+def _join_rendered(file_paths, output_path, crossfade, job=None):
+    """Decodes every input and encodes the whole join again; returns stderr text on failure, None on success.
+
+    Used for crossfades when the smart render cannot run (non-MP3 or
+    mismatched inputs). crossfade 0 concatenates the decoded audio, so
+    each input's own encoder delay and padding are still dropped.
+    """
+    try:
+        info = probe(file_paths[0])
+    except ProbeError:
+        info = {}
+    inputs = []
+    for file_path in file_paths:
+        inputs += ['-i', file_path]
+    if crossfade > 0:
+        parts = []
+        previous = '[0:a]'
+        for i in range(1, len(file_paths)):
+            label = '[out]' if i == len(file_paths) - 1 else f"[x{i}]"
+            parts.append(f"{previous}[{i}:a]acrossfade=d={crossfade:.6f}{label}")
+            previous = label
+        graph = ';'.join(parts)
+    else:
+        graph = ''.join(f"[{i}:a]" for i in range(len(file_paths))) + f"concat=n={len(file_paths)}:v=0:a=1[out]"
+    cmd = ['ffmpeg', '-y', '-v', 'error'] + inputs + [
+        '-filter_complex', graph, '-map', '[out]', '-map_metadata', '0',
+        '-c:a', 'libmp3lame'] + loudness.encode_options(info) + [output_path]
+
+    on_time = None
+    if job is not None:
+        total = _total_duration(file_paths)
+        if total is not None:
+            total = max(0.0, total - crossfade * (len(file_paths) - 1))
+        job.update(stage='render', position=0, totalSeconds=total)
+        on_time = lambda seconds: job.update(position=seconds)
+    return run_ffmpeg(cmd, job, on_time)
+
+
+def _join_any(file_paths, output_path, backend, job=None, crossfade=None):
+    """Joins with the frame-level engines where they apply, otherwise with ffmpeg.
+
+    Without a crossfade that is mp3_frames.join_files or the concat
+    demuxer; with one (0 for gapless) smart_render.join_files or a full
+    re-encode. Returns stderr text on failure, None on success.
+    """
+    if backend != 'ffmpeg':
+        try:
+            if crossfade is None:
+                _join_native(file_paths, output_path, job)
+                return None
+            return smart_render.join_files(file_paths, output_path, crossfade, job)
+        except mp3_frames.Mp3FormatError:
+            pass  # mixed or non-MP3 input, let ffmpeg handle it
+    if crossfade is None:
+        return _join_ffmpeg(file_paths, output_path, job)
+    return _join_rendered(file_paths, output_path, crossfade, job)
+
+
+def _join_normalized(file_paths, output_path, normalize, job=None, crossfade=None):
+    """Encodes loudness-normalized copies of the inputs in parallel, then joins their frames."""
+    temp_dir = tempfile.mkdtemp(prefix='cutfile_loudnorm_')
+    try:
+        temp_paths = [os.path.join(temp_dir, f"{i}.mp3") for i in range(len(file_paths))]
+        try:
+            loudness.normalize_files(file_paths, temp_paths, *normalize, job=job)
+        except (loudness.LoudnessError, OSError) as e:
+            raise JoinError(str(e))
+        if job is not None:
+            job.update(stage='join')
+        # The copies share one format, so the frame-level engines normally apply
+        return _join_any(temp_paths, output_path, 'auto', job, crossfade)
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+def join_files(file_paths, output_path, job=None, backend='auto', normalize=None, crossfade=None):
+    """Concatenates file_paths into output_path, without re-encoding unless normalizing or fading.
+
+    Returns the final output path (with a .mp3 extension). backend is one
+    of split_engine.BACKENDS: 'native' and 'auto' copy the MP3 frames
+    directly (see mp3_frames.join_files) and fall back to ffmpeg's concat
+    demuxer when an input is not MP3 or the formats differ; 'ffmpeg'
+    always uses ffmpeg. normalize, a (target_lufs, true_peak) pair,
+    re-encodes each input at its own loudness gain first (see loudness.py).
+    crossfade, in seconds, fades each input into the next; 0 makes a
+    gapless join without encoder delay and padding between the inputs.
+    Only a few frames around each boundary are re-encoded (see
+    smart_render.py), unless the backend is 'ffmpeg' or the inputs need
+    the ffmpeg fallback, which re-encodes everything. With a job,
+    progress is reported as position/totalSeconds and the join can be
+    cancelled. Raises JoinError when the join fails.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown join backend: {backend}")
+
+    # Ensure output has .mp3 extension
+    if not output_path.lower().endswith('.mp3'):
+        output_path += '.mp3'
+
+    output_abs = os.path.normcase(os.path.abspath(output_path))
+    if any(os.path.normcase(os.path.abspath(path)) == output_abs for path in file_paths):
+        raise JoinError('The output file cannot be one of the inputs')
+
+    if crossfade is not None:
+        if not 0 <= crossfade <= smart_render.MAX_CROSSFADE_SECONDS:
+            raise JoinError(f'Crossfade must be between 0 and {smart_render.MAX_CROSSFADE_SECONDS:g} seconds')
+        for path in file_paths:
+            try:
+                duration = probe(path)['duration']
+            except ProbeError:
+                continue  # reported by the join itself
+            if duration <= crossfade:
+                raise JoinError(f'{os.path.basename(path)} is shorter than the crossfade')
+
+    try:
+        if normalize is not None:
+            error = _join_normalized(file_paths, output_path, normalize, job, crossfade)
+        else:
+            error = _join_any(file_paths, output_path, backend, job, crossfade)
+    except BaseException:
+        # Do not leave a truncated join behind (e.g. after a cancel)
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        raise
+
+    if error is not None:
+        raise JoinError(f'FFmpeg error: {error}')
+
+    if not os.path.exists(output_path):
+        raise JoinError('Output file was not created')
+
+    return output_path
@@ -0,0 +1,246 @@
+import contextvars
+import json
+import math
+import os
+import re
+import sqlite3
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from media_probe import CACHE_DIR, ProbeError, probe
+from split_engine import TIME_EPSILON, get_startupinfo, run_ffmpeg
+from sqlite_store import ThreadLocalDB
+
+LOUDNESS_DB_PATH = os.path.join(CACHE_DIR, 'loudness.sqlite3')
+
+# EBU R128 streaming targets used when none are given
+DEFAULT_TARGET_LUFS = -16.0
+DEFAULT_TRUE_PEAK = -1.5
+# Parallel encode passes (override with CUTFILE_NORMALIZE_WORKERS)
+NORMALIZE_WORKERS = int(os.environ.get('CUTFILE_NORMALIZE_WORKERS', os.cpu_count() or 1))
+# LAME VBR quality used when the source bitrate is unknown (~190 kbps)
+FALLBACK_VBR_QUALITY = '2'
+# Bump when the measurement changes so cached values are taken again
+ANALYSIS_VERSION = 1
+
+class LoudnessError(Exception):
+    """Raised when a file's loudness cannot be measured."""
+
+
+# A read-only or broken cache just means measuring every time
+_db = ThreadLocalDB(LOUDNESS_DB_PATH, (
+    'CREATE TABLE IF NOT EXISTS loudness ('
+    ' path TEXT PRIMARY KEY,'
+    ' size INTEGER NOT NULL,'
+    ' mtime_ns INTEGER NOT NULL,'
+    ' version INTEGER NOT NULL,'
+    ' measurement TEXT NOT NULL)',
+))
+
+
+def _run_analysis(cmd, job):
+    """Runs ffmpeg and returns (returncode, stderr text); killed when the job is cancelled."""
+    if job is not None:
+        job.check_cancelled()
+    try:
+        proc = metrics.popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                             text=True, errors='replace', startupinfo=get_startupinfo())
+    except FileNotFoundError:
+        raise LoudnessError('ffmpeg not found. Please ensure ffmpeg is installed and in your PATH.')
+    if job is not None:
+        job.track(proc)
+    try:
+        _, stderr = proc.communicate()
+    finally:
+        if job is not None:
+            job.untrack(proc)
+    if job is not None:
+        job.check_cancelled()
+    return proc.returncode, stderr
+
+
+def _parse_loudnorm(stderr):
+    """Extracts the JSON block loudnorm prints at the end of a measurement pass."""
+    match = re.search(r'\{[^{}]*"input_i"[^{}]*\}', stderr)
+    if match is None:
+        return None
+    values = json.loads(match.group(0))
+    return {
+        'integrated': float(values['input_i']),
+        'truePeak': float(values['input_tp']),
+        'lra': float(values['input_lra']),
+        'threshold': float(values['input_thresh']),
+    }
+
+
+def measure(input_file, job=None):
+    """EBU R128 loudness of input_file from ffmpeg's loudnorm filter.
+
+    Returns {integrated, truePeak, lra, threshold} in LUFS/dBTP/LU. The
+    result is cached by path, size and mtime, so a source is analysed once
+    however often it is cut or joined. Silent input has an integrated
+    loudness of -inf.
+    """
+    st = os.stat(input_file)
+    path = os.path.abspath(input_file)
+    conn = _db.connect()
+    if conn is not None:
+        try:
+            row = conn.execute('SELECT size, mtime_ns, version, measurement FROM loudness WHERE path = ?',
+                               (path,)).fetchone()
+            if row is not None and row[:3] == (st.st_size, st.st_mtime_ns, ANALYSIS_VERSION):
+                return json.loads(row[3])
+        except sqlite3.Error:
+            pass
+
+    cmd = ['ffmpeg', '-hide_banner', '-nostdin', '-nostats', '-i', input_file, '-map', '0:a:0',
+           '-af', 'loudnorm=print_format=json', '-f', 'null', '-']
+    with metrics.span('loudness', file=os.path.basename(input_file)):
+        returncode, stderr = _run_analysis(cmd, job)
+    measurement = _parse_loudnorm(stderr) if returncode == 0 else None
+    if measurement is None:
+        raise LoudnessError(f"Could not measure loudness of {os.path.basename(input_file)}: "
+                            f"{stderr.strip()[-500:] or 'Unknown error'}")
+
+    if conn is not None:
+        try:
+            # json keeps -inf (silence) as -Infinity, which it also reads back
+            conn.execute('INSERT OR REPLACE INTO loudness (path, size, mtime_ns, version, measurement)'
+                         ' VALUES (?, ?, ?, ?, ?)',
+                         (path, st.st_size, st.st_mtime_ns, ANALYSIS_VERSION, json.dumps(measurement)))
+            conn.commit()
+        except sqlite3.Error:
+            pass
+    return measurement
+
+
+def measure_many(input_files, job=None, workers=NORMALIZE_WORKERS):
+    """Measures several sources concurrently; returns measurements in input order."""
+    return _map_parallel(lambda path: measure(path, job), input_files, workers)
+
+
+def gain_for(measurement, target_lufs=DEFAULT_TARGET_LUFS, true_peak=DEFAULT_TRUE_PEAK):
+    """Linear gain in dB that brings a source to target_lufs without pushing its peak over true_peak.
+
+    One gain per source keeps every segment of a recording at the same
+    relative level, as if the whole file had been normalized before cutting.
+    """
+    integrated = measurement['integrated']
+    if not math.isfinite(integrated):
+        return 0.0  # silence: nothing to normalize
+    gain = target_lufs - integrated
+    if math.isfinite(measurement['truePeak']):
+        gain = min(gain, true_peak - measurement['truePeak'])
+    return round(gain, 2)
+
+
+def encode_options(info):
+    """LAME options that keep roughly the source's bitrate."""
+    if info.get('bitrate'):
+        return ['-b:a', f"{max(32, round(info['bitrate'] / 1000))}k"]
+    return ['-q:a', FALLBACK_VBR_QUALITY]
+
+
+def _map_parallel(fn, items, workers):
+    """Runs fn over items on a thread pool and returns results in order.
+
+    Every task is waited for before an exception is re-raised, so no
+    ffmpeg outlives the call (e.g. after a cancel).
+    """
+    if len(items) <= 1 or workers <= 1:
+        return [fn(item) for item in items]
+    with ThreadPoolExecutor(max_workers=min(workers, len(items))) as pool:
+        # Each task runs in a copy of the caller's context so a request trace follows it
+        futures = [pool.submit(contextvars.copy_context().run, fn, item) for item in items]
+        results = []
+        failure = None
+        for future in futures:
+            try:
+                results.append(future.result())
+            except BaseException as e:
+                failure = failure or e
+                results.append(None)
+        if failure is not None:
+            raise failure
+    return results
+
+
+def normalize_segments(input_file, segments, gain_db, job=None, workers=NORMALIZE_WORKERS, encode=None):
+    """Re-encodes each segment of input_file with gain_db applied, on a worker pool.
+
+    segments are split_engine segment dicts (start, end, path). encode is
+    a list of extra ffmpeg output options (see encode_options; by default
+    derived from the source). Returns (path, error) tuples in segment
+    order, like split_engine.split_segments.
+    """
+    if encode is None:
+        try:
+            encode = encode_options(probe(input_file))
+        except ProbeError:
+            encode = encode_options({})
+    total = len(segments)
+    done = [0]
+    lock = threading.Lock()
+
+    def cut(seg):
+        if seg['end'] - seg['start'] <= TIME_EPSILON:
+            return seg['path'], 'End time must be greater than start time'
+        cmd = ['ffmpeg', '-y', '-v', 'error',
+               '-ss', f"{seg['start']:.6f}", '-t', f"{seg['end'] - seg['start']:.6f}", '-i', input_file,
+               '-map', '0:a:0', '-map_metadata', '0', '-af', f"volume={gain_db:+.2f}dB",
+               '-c:a', 'libmp3lame'] + encode + [seg['path']]
+        error = run_ffmpeg(cmd, job)
+        if job is not None:
+            with lock:
+                done[0] += 1
+                job.update(segmentsDone=done[0], segmentsTotal=total)
+        return seg['path'], error
+
+    return _map_parallel(cut, segments, workers)
+
+
+def normalize_files(input_files, output_paths, target_lufs=DEFAULT_TARGET_LUFS, true_peak=DEFAULT_TRUE_PEAK,
+                    job=None, workers=NORMALIZE_WORKERS):
+    """Writes a loudness-normalized copy of each input, all in one MP3 format.
+
+    Every copy gets the sample rate, channel count and encoder settings of
+    the first input, so the results can be joined frame by frame. Sources
+    are measured (or read from the cache) and encoded on the worker pool.
+    Returns the gains applied, in dB. Raises LoudnessError on failure.
+    """
+    if job is not None:
+        job.update(stage='analyze', filesDone=0, filesTotal=len(input_files))
+    measurements = measure_many(input_files, job, workers)
+    gains = [gain_for(m, target_lufs, true_peak) for m in measurements]
+
+    try:
+        info = probe(input_files[0])
+    except ProbeError:
+        info = {}
+    encode = encode_options(info)
+    if info.get('sample_rate'):
+        encode += ['-ar', str(info['sample_rate'])]
+    if info.get('channels'):
+        encode += ['-ac', str(info['channels'])]
+
+    if job is not None:
+        job.update(stage='encode')
+    done = [0]
+    lock = threading.Lock()
+
+    def encode_one(item):
+        input_file, output_path, gain = item
+        cmd = ['ffmpeg', '-y', '-v', 'error', '-i', input_file, '-map', '0:a:0', '-map_metadata', '0',
+               '-af', f"volume={gain:+.2f}dB", '-c:a', 'libmp3lame'] + encode + [output_path]
+        error = run_ffmpeg(cmd, job)
+        if error is not None:
+            raise LoudnessError(f"Could not encode {os.path.basename(input_file)}: {error.strip()[-500:]}")
+        if job is not None:
+            with lock:
+                done[0] += 1
+                job.update(filesDone=done[0])
+
+    _map_parallel(encode_one, list(zip(input_files, output_paths, gains)), workers)
+    return gains
@@ -0,0 +1,250 @@
+import json
+import os
+import sqlite3
+import subprocess
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from mp3_frames import Mp3FormatError, read_stream_info
+from split_engine import get_startupinfo
+from sqlite_store import ThreadLocalDB
+
+# On-disk caches live here (override with CUTFILE_CACHE_DIR)
+CACHE_DIR = os.environ.get('CUTFILE_CACHE_DIR',
+                           os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache'))
+PROBE_DB_PATH = os.path.join(CACHE_DIR, 'probe.sqlite3')
+
+# Size cap of the probe cache; the least recently used rows go first
+MAX_CACHE_ENTRIES = 50000
+# Fraction of rows dropped at once when the cap is exceeded
+EVICT_FRACTION = 0.1
+# last_used is only rewritten when older than this, so hot rescans stay read-only
+TOUCH_INTERVAL = 60.0
+
+# Probe threads used when scanning a folder; ffprobe is process-bound, not GIL-bound
+SCAN_WORKERS = min(8, (os.cpu_count() or 1) * 2)
+# Probes queued ahead of the consumer, per scan worker
+PROBE_WINDOW = 4
+
+# MP3s are probed from their headers, ffprobe runs only when those cannot be trusted
+# (set CUTFILE_NATIVE_PROBE=0 to always use ffprobe)
+NATIVE_PROBE = os.environ.get('CUTFILE_NATIVE_PROBE', '1') != '0'
+# Header durations agree with ffprobe within this many seconds (see benchmark.py probe-check)
+HEADER_PROBE_TOLERANCE = 0.05
+# Bump when probe results change so cached rows are taken again
+PROBE_VERSION = 2
+
+# Sort keys accepted by sort_media_files
+SORT_KEYS = ('name', 'size', 'mtime')
+
+
+class ProbeError(Exception):
+    """Raised when a media file cannot be probed."""
+
+
+def _migrate(conn):
+    """Adds source/version to caches from before they were recorded; their rows are re-probed."""
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(probe_cache)')}
+    for column, definition in (('source', "TEXT NOT NULL DEFAULT ''"), ('version', 'INTEGER NOT NULL DEFAULT 0')):
+        if column not in columns:
+            conn.execute(f'ALTER TABLE probe_cache ADD COLUMN {column} {definition}')
+
+
+# A read-only or broken cache must never stop probing; it just probes every time
+_db = ThreadLocalDB(PROBE_DB_PATH, (
+    'CREATE TABLE IF NOT EXISTS probe_cache ('
+    ' path TEXT PRIMARY KEY,'
+    ' size INTEGER NOT NULL,'
+    ' mtime_ns INTEGER NOT NULL,'
+    ' data TEXT NOT NULL,'
+    ' last_used REAL NOT NULL,'
+    ' source TEXT NOT NULL DEFAULT \'\','
+    ' version INTEGER NOT NULL DEFAULT 0)',
+    'CREATE INDEX IF NOT EXISTS probe_cache_last_used ON probe_cache(last_used)',
+), _migrate)
+
+
+def run_ffprobe(input_file):
+    """Runs ffprobe and returns duration, bitrate, sample_rate, channels, codec and tags."""
+    cmd = [
+        'ffprobe',
+        '-v', 'error',
+        '-select_streams', 'a:0',
+        '-show_entries', 'format=duration,bit_rate,format_name:format_tags:stream=codec_name,sample_rate,channels,bit_rate',
+        '-of', 'json',
+        input_file
+    ]
+    try:
+        result = metrics.run(cmd, capture_output=True, text=True, check=True, startupinfo=get_startupinfo())
+        data = json.loads(result.stdout)
+        fmt = data['format']
+        stream = (data.get('streams') or [{}])[0]
+        return {
+            'duration': float(fmt['duration']),
+            'bitrate': int(fmt.get('bit_rate') or stream.get('bit_rate') or 0),
+            'sample_rate': int(stream.get('sample_rate') or 0),
+            'channels': int(stream.get('channels') or 0),
+            'codec': stream.get('codec_name') or fmt.get('format_name'),
+            'tags': fmt.get('tags', {}),
+        }
+    except subprocess.CalledProcessError as e:
+        raise ProbeError(f"Error getting duration: {e.stderr.strip() if e.stderr else e}")
+    except FileNotFoundError:
+        raise ProbeError("Error getting duration: ffprobe not found. Please ensure ffmpeg is installed and in your PATH.")
+    except (KeyError, ValueError, TypeError) as e:
+        raise ProbeError(f"Error parsing duration from ffprobe output: {e}")
+
+
+def read_media_info(input_file):
+    """Media info from the MP3 headers when they are trustworthy, otherwise from ffprobe.
+
+    Returns (info, source) with source 'header' or 'ffprobe'.
+    """
+    if NATIVE_PROBE and input_file.lower().endswith('.mp3'):
+        try:
+            return read_stream_info(input_file), 'header'
+        except (Mp3FormatError, OSError):
+            pass
+    return run_ffprobe(input_file), 'ffprobe'
+
+
+def _evict(conn):
+    """Drops the least recently used rows once the cache exceeds its cap."""
+    count = conn.execute('SELECT COUNT(*) FROM probe_cache').fetchone()[0]
+    if count > MAX_CACHE_ENTRIES:
+        excess = count - MAX_CACHE_ENTRIES + int(MAX_CACHE_ENTRIES * EVICT_FRACTION)
+        conn.execute(
+            'DELETE FROM probe_cache WHERE path IN '
+            '(SELECT path FROM probe_cache ORDER BY last_used LIMIT ?)', (excess,))
+
+
+def probe(input_file, st=None):
+    """Returns cached media info for input_file, probing only when it changed.
+
+    The cache key is (absolute path, size, mtime_ns); pass st to reuse a
+    stat result the caller already has. The returned dict also carries
+    'size'. Raises ProbeError when the file cannot be probed.
+    """
+    path = os.path.abspath(input_file)
+    if st is None:
+        try:
+            st = os.stat(path)
+        except OSError as e:
+            raise ProbeError(f"Error getting duration: {e}")
+
+    conn = _db.connect()
+    now = time.time()
+    if conn is not None:
+        try:
+            row = conn.execute(
+                'SELECT data, last_used FROM probe_cache'
+                ' WHERE path = ? AND size = ? AND mtime_ns = ? AND version = ?',
+                (path, st.st_size, st.st_mtime_ns, PROBE_VERSION)).fetchone()
+            if row is not None:
+                if now - row[1] > TOUCH_INTERVAL:
+                    conn.execute('UPDATE probe_cache SET last_used = ? WHERE path = ?', (now, path))
+                    conn.commit()
+                return json.loads(row[0])
+        except sqlite3.Error:
+            pass
+
+    info, source = read_media_info(path)
+    info['size'] = st.st_size
+
+    if conn is not None:
+        try:
+            conn.execute(
+                'INSERT OR REPLACE INTO probe_cache (path, size, mtime_ns, data, last_used, source, version)'
+                ' VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (path, st.st_size, st.st_mtime_ns, json.dumps(info), now, source, PROBE_VERSION))
+            _evict(conn)
+            conn.commit()
+        except sqlite3.Error:
+            pass
+    return info
+
+
+def get_duration(input_file):
+    """Gets the duration of the media file, from the cache when it is unchanged."""
+    return probe(input_file)['duration']
+
+
+def list_media_files(folder_path, recursive=False, extensions=('.mp3',)):
+    """Lists media files under folder_path with os.scandir.
+
+    Returns (relative name, path, stat) tuples; only the directory walk and
+    one stat per file are paid here, probing happens separately.
+    """
+    found = []
+    pending = [folder_path]
+    # Symlinked folders are followed, each real folder once, so a link cycle cannot loop
+    visited = set()
+    while pending:
+        current = pending.pop()
+        try:
+            st = os.stat(current)
+            if (st.st_dev, st.st_ino) in visited:
+                continue
+            visited.add((st.st_dev, st.st_ino))
+            it = os.scandir(current)
+        except OSError:
+            if current == folder_path:
+                raise
+            continue  # an unreadable subfolder is skipped, not fatal
+        with it:
+            for entry in it:
+                try:
+                    if entry.is_dir():
+                        if recursive:
+                            pending.append(entry.path)
+                    elif entry.is_file() and entry.name.lower().endswith(extensions):
+                        found.append((os.path.relpath(entry.path, folder_path), entry.path, entry.stat()))
+                except OSError:
+                    continue  # removed or unreadable while listing
+    return found
+
+
+def sort_media_files(files, sort_key='name', descending=False):
+    """Sorts list_media_files results by name, size or mtime."""
+    if sort_key not in SORT_KEYS:
+        raise ValueError(f"Unknown sort key: {sort_key}")
+    if sort_key == 'size':
+        key = lambda f: (f[2].st_size, f[0])
+    elif sort_key == 'mtime':
+        key = lambda f: (f[2].st_mtime_ns, f[0])
+    else:
+        key = lambda f: f[0]
+    return sorted(files, key=key, reverse=descending)
+
+
+def _probe_entry(entry):
+    name, path, st = entry
+    try:
+        return entry, probe(path, st), None
+    except ProbeError as e:
+        return entry, None, str(e)
+
+
+def probe_many(files, workers=SCAN_WORKERS):
+    """Probes list_media_files entries on a bounded thread pool.
+
+    Yields (entry, info, error) in input order as soon as each result and
+    all results before it are ready. Only a window of PROBE_WINDOW probes
+    per worker is queued ahead of the consumer, and closing the generator
+    (e.g. when a streaming client disconnects) drops the probes not yet
+    started.
+    """
+    workers = max(1, workers)
+    pool = ThreadPoolExecutor(max_workers=workers)
+    window = deque()
+    try:
+        for entry in files:
+            window.append(pool.submit(_probe_entry, entry))
+            if len(window) >= workers * PROBE_WINDOW:
+                yield window.popleft().result()
+        while window:
+            yield window.popleft().result()
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,485 @@
+import atexit
+import bisect
+import contextlib
+import contextvars
+import glob
+import io
+import json
+import logging
+import os
+import re
+import sqlite3
+import subprocess
+import threading
+import time
+import uuid
+
+from sqlite_store import ThreadLocalDB
+
+# Metrics are only collected when CUTFILE_METRICS is set (1/true/yes/on)
+ENABLED = os.environ.get('CUTFILE_METRICS', '').lower() in ('1', 'true', 'yes', 'on')
+# Trace every split job, not only requests asking for it (CUTFILE_TRACE)
+TRACE_ALL = os.environ.get('CUTFILE_TRACE', '').lower() in ('1', 'true', 'yes', 'on')
+
+# Upper bounds (seconds) of the latency histogram buckets
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 1800)
+# Seconds after a change before this process's values are written to the shared store
+STORE_FLUSH_SECONDS = 1.0
+# Values of processes that have not written for this long are dropped from the store
+STORE_RETENTION_SECONDS = 7 * 24 * 3600
+
+logger = logging.getLogger('cutfile.trace')
+if not logger.hasHandlers():
+    # Traces are asked for explicitly, so print them even without logging config
+    logger.addHandler(logging.StreamHandler())
+    logger.setLevel(logging.INFO)
+
+_current_trace = contextvars.ContextVar('cutfile_trace', default=None)
+# Shared store of every worker's values, set up by init_app
+_store = None
+# Output patterns of the segment muxer, e.g. '.split_<uuid>_%06d.mp3'
+_PATTERN = re.compile(r'%0?\d*d')
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    pairs = []
+    for name, value in zip(names, values):
+        escaped = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{escaped}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+class Counter:
+    """Monotonic counter with a fixed set of label names."""
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+        _changed()
+
+    def snapshot(self):
+        """This process's values as JSON-ready [labels, value] pairs."""
+        with self._lock:
+            return [[list(label_values), value] for label_values, value in self._values.items()]
+
+    def render(self, snapshots=None):
+        """Text lines for the sum of snapshots (default: this process only)."""
+        if snapshots is None:
+            snapshots = [self.snapshot()]
+        values = {}
+        for snapshot in snapshots:
+            for label_values, value in snapshot:
+                label_values = tuple(label_values)
+                values[label_values] = values.get(label_values, 0) + value
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for label_values, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {value}")
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus text format."""
+
+    def __init__(self, name, help_text, labels=(), buckets=DURATION_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                # Per-bucket counts (the last one is +Inf), sum, count
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+        _changed()
+
+    def snapshot(self):
+        """This process's series as JSON-ready [labels, bucket counts, sum, count] lists."""
+        with self._lock:
+            return [[list(label_values), list(counts), total, count]
+                    for label_values, (counts, total, count) in self._series.items()]
+
+    def render(self, snapshots=None):
+        """Text lines for the sum of snapshots (default: this process only)."""
+        if snapshots is None:
+            snapshots = [self.snapshot()]
+        merged = {}
+        for snapshot in snapshots:
+            for label_values, counts, total, count in snapshot:
+                if len(counts) != len(self.buckets) + 1:
+                    continue  # written with other buckets by an older version
+                series = merged.setdefault(tuple(label_values), [[0] * len(counts), 0.0, 0])
+                series[0] = [a + b for a, b in zip(series[0], counts)]
+                series[1] += total
+                series[2] += count
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for label_values, (counts, total, count) in sorted(merged.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labels + ('le',), label_values + (bound,))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labels, label_values)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+SUBPROCESS_SPAWN = Histogram('cutfile_subprocess_spawn_seconds',
+                             'Time to start a child process.', ('program',))
+SUBPROCESS_DURATION = Histogram('cutfile_subprocess_duration_seconds',
+                                'Wall time of a child process from spawn to exit.', ('program',))
+SUBPROCESS_BYTES_IN = Counter('cutfile_subprocess_bytes_in_total',
+                              'Size of the input files handed to child processes.', ('program',))
+SUBPROCESS_BYTES_OUT = Counter('cutfile_subprocess_bytes_out_total',
+                               'Bytes child processes wrote to output files and binary pipes.', ('program',))
+SUBPROCESS_EXITS = Counter('cutfile_subprocess_exits_total',
+                           'Child process exits by status (ok, error, killed).', ('program', 'status'))
+HTTP_DURATION = Histogram('cutfile_http_request_duration_seconds',
+                          'API request latency, including streamed bodies.', ('route', 'method'))
+HTTP_REQUESTS = Counter('cutfile_http_requests_total',
+                        'API requests by route, method and status code.', ('route', 'method', 'status'))
+
+REGISTRY = (SUBPROCESS_SPAWN, SUBPROCESS_DURATION, SUBPROCESS_BYTES_IN, SUBPROCESS_BYTES_OUT,
+            SUBPROCESS_EXITS, HTTP_DURATION, HTTP_REQUESTS)
+
+
+class MetricStore:
+    """Metric values of every worker process in a SQLite file, so any worker can serve /metrics.
+
+    Like the job store, each process keeps its own row: its values are
+    written at most every STORE_FLUSH_SECONDS after a change and when it
+    exits, and a scrape adds up the rows of all processes. Rows of
+    processes gone for STORE_RETENTION_SECONDS are dropped.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.process = uuid.uuid4().hex
+        # Without the store each process still reports its own values
+        self._db = ThreadLocalDB(path, (
+            'CREATE TABLE IF NOT EXISTS metrics ('
+            ' process TEXT PRIMARY KEY,'
+            ' updated REAL NOT NULL,'
+            ' data TEXT NOT NULL)',
+        ))
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def changed(self):
+        """Schedules a flush unless one is already pending."""
+        with self._lock:
+            if self._timer is None:
+                self._timer = threading.Timer(STORE_FLUSH_SECONDS, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self):
+        """Writes this process's current values; returns False when the store is unavailable."""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        conn = self._db.connect()
+        if conn is None:
+            return False
+        data = json.dumps({metric.name: metric.snapshot() for metric in REGISTRY})
+        now = time.time()
+        try:
+            conn.execute('INSERT OR REPLACE INTO metrics (process, updated, data) VALUES (?, ?, ?)',
+                         (self.process, now, data))
+            conn.execute('DELETE FROM metrics WHERE updated < ?', (now - STORE_RETENTION_SECONDS,))
+            conn.commit()
+        except sqlite3.Error:
+            return False
+        return True
+
+    def collect(self):
+        """Snapshots of every process, this one up to date; None when the store is unavailable."""
+        if not self.flush():
+            return None
+        try:
+            rows = self._db.connect().execute('SELECT data FROM metrics').fetchall()
+        except sqlite3.Error:
+            return None
+        snapshots = []
+        for (data,) in rows:
+            try:
+                snapshots.append(json.loads(data))
+            except ValueError:
+                continue
+        return snapshots
+
+
+def _changed():
+    store = _store
+    if store is not None:
+        store.changed()
+
+
+def use_store(path):
+    """Shares this process's metrics through the SQLite file at path."""
+    global _store
+    if _store is not None and _store.path == path:
+        return
+    _store = MetricStore(path)
+    atexit.register(_store.flush)
+
+
+def render():
+    """All metrics in the Prometheus text exposition format, summed over every worker sharing the store."""
+    snapshots = _store.collect() if _store is not None else None
+    lines = []
+    for metric in REGISTRY:
+        if snapshots is None:
+            lines.extend(metric.render())
+        else:
+            lines.extend(metric.render([snapshot.get(metric.name, []) for snapshot in snapshots]))
+    return '\n'.join(lines) + '\n'
+
+
+class Trace:
+    """Timeline of one traced request, carried through jobs via contextvars."""
+
+    def __init__(self, name):
+        self.name = name
+        self.started = time.perf_counter()
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, name, started, seconds, **attrs):
+        with self._lock:
+            self.spans.append(dict(attrs, name=name, at=started - self.started, seconds=seconds))
+
+    def to_list(self):
+        with self._lock:
+            return sorted(self.spans, key=lambda span: span['at'])
+
+    def log(self):
+        spans = self.to_list()
+        lines = [f"trace {self.name}: {time.perf_counter() - self.started:.3f}s total, {len(spans)} spans"]
+        for span in spans:
+            attrs = ' '.join(f"{k}={v}" for k, v in span.items() if k not in ('name', 'at', 'seconds'))
+            lines.append(f"  +{span['at']:8.3f}s {span['seconds']:8.3f}s  {span['name']} {attrs}".rstrip())
+        logger.info('\n'.join(lines))
+
+
+@contextlib.contextmanager
+def tracing(name):
+    """Traces the block, and jobs or threads started from it with a copied context."""
+    trace = Trace(name)
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+@contextlib.contextmanager
+def span(name, **attrs):
+    """Times a block into the current trace; a no-op when nothing is traced."""
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(name, started, time.perf_counter() - started, **attrs)
+
+
+class _CountingReader:
+    """Binary pipe wrapper counting the bytes the parent reads."""
+
+    def __init__(self, raw, proc):
+        self._raw = raw
+        self._proc = proc
+
+    def read(self, *args):
+        data = self._raw.read(*args)
+        self._proc.stdout_bytes += len(data)
+        return data
+
+    def __iter__(self):
+        return iter(self._raw)
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+
+def _file_args(cmd):
+    """Path-like arguments of a command line (not options, not pipes)."""
+    return [arg for arg in cmd[1:] if isinstance(arg, str) and arg and not arg.startswith('-')
+            and not arg.startswith('pipe:')]
+
+
+def _input_files(cmd):
+    """Inputs of an ffmpeg (-i) or ffprobe (trailing path) command line."""
+    inputs = [cmd[i + 1] for i, arg in enumerate(cmd[:-1]) if arg == '-i']
+    if not inputs and cmd:
+        inputs = [cmd[-1]]
+    return [path for path in inputs if isinstance(path, str) and os.path.isfile(path)]
+
+
+class TimedPopen(subprocess.Popen):
+    """Popen that reports spawn latency, wall time, bytes and exit status once it is reaped."""
+
+    def __init__(self, args, *a, **kwargs):
+        self.program = os.path.splitext(os.path.basename(str(args[0] if isinstance(args, (list, tuple)) else args)))[0]
+        self.stdout_bytes = 0
+        self._recorded = False
+        self._in_communicate = False
+        self._wall_started = time.time()
+        started = time.perf_counter()
+        super().__init__(args, *a, **kwargs)
+        self.spawned = time.perf_counter()
+        self.spawn_seconds = self.spawned - started
+        self._started = started
+        cmd = list(args) if isinstance(args, (list, tuple)) else [args]
+        self._inputs = _input_files(cmd)
+        self._candidates = [arg for arg in _file_args(cmd) if arg not in self._inputs]
+        if isinstance(self.stdout, io.BufferedReader):
+            self.stdout = _CountingReader(self.stdout, self)
+
+    def _output_bytes(self):
+        total = 0
+        for arg in self._candidates:
+            paths = glob.glob(_PATTERN.sub('[0-9]*', glob.escape(arg))) if _PATTERN.search(arg) else [arg]
+            for path in paths:
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                # Only files this process wrote, not e.g. a concat list it read
+                if st.st_mtime >= self._wall_started - 1 and os.path.isfile(path):
+                    total += st.st_size
+        return total
+
+    def _record(self):
+        if self._recorded or self.returncode is None:
+            return
+        self._recorded = True
+        seconds = time.perf_counter() - self._started
+        bytes_in = 0
+        for path in self._inputs:
+            try:
+                bytes_in += os.path.getsize(path)
+            except OSError:
+                pass
+        bytes_out = self.stdout_bytes + self._output_bytes()
+        status = 'ok' if self.returncode == 0 else ('killed' if self.returncode < 0 else 'error')
+        if ENABLED:
+            SUBPROCESS_SPAWN.observe(self.spawn_seconds, self.program)
+            SUBPROCESS_DURATION.observe(seconds, self.program)
+            SUBPROCESS_BYTES_IN.inc(self.program, amount=bytes_in)
+            SUBPROCESS_BYTES_OUT.inc(self.program, amount=bytes_out)
+            SUBPROCESS_EXITS.inc(self.program, status)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add(self.program, self._started, seconds, spawn=f"{self.spawn_seconds:.4f}",
+                      bytes_in=bytes_in, bytes_out=bytes_out, exit=self.returncode)
+
+    def wait(self, timeout=None):
+        returncode = super().wait(timeout)
+        if not self._in_communicate:
+            self._record()
+        return returncode
+
+    def communicate(self, input=None, timeout=None):
+        before = self.stdout_bytes
+        self._in_communicate = True
+        try:
+            stdout, stderr = super().communicate(input, timeout)
+        finally:
+            self._in_communicate = False
+        # Multi-pipe communicate reads the fd directly, bypassing the counting wrapper
+        if self.stdout_bytes == before and stdout:
+            self.stdout_bytes += len(stdout)
+        self._record()
+        return stdout, stderr
+
+
+def _enabled_here():
+    return ENABLED or _current_trace.get() is not None
+
+
+def popen(args, **kwargs):
+    """subprocess.Popen, timed when metrics or a trace are active."""
+    if not _enabled_here():
+        return subprocess.Popen(args, **kwargs)
+    return TimedPopen(args, **kwargs)
+
+
+def run(args, input=None, capture_output=False, timeout=None, check=False, **kwargs):
+    """subprocess.run, timed when metrics or a trace are active."""
+    if not _enabled_here():
+        return subprocess.run(args, input=input, capture_output=capture_output, timeout=timeout,
+                              check=check, **kwargs)
+    if capture_output:
+        kwargs['stdout'] = kwargs['stderr'] = subprocess.PIPE
+    if input is not None:
+        kwargs['stdin'] = subprocess.PIPE
+    with TimedPopen(args, **kwargs) as proc:
+        try:
+            stdout, stderr = proc.communicate(input, timeout=timeout)
+        except BaseException:
+            proc.kill()
+            raise
+        retcode = proc.poll()
+    if check and retcode:
+        raise subprocess.CalledProcessError(retcode, proc.args, output=stdout, stderr=stderr)
+    return subprocess.CompletedProcess(proc.args, retcode, stdout, stderr)
+
+
+def init_app(app):
+    """Times every API route of a Flask app; installs nothing when metrics are off.
+
+    With a METRICS_DB path in the app config, values are shared with the
+    other worker processes through a MetricStore.
+    """
+    if not ENABLED:
+        return
+    if app.config.get('METRICS_DB'):
+        use_store(app.config['METRICS_DB'])
+    from flask import g, request
+
+    @app.before_request
+    def _start_timer():
+        g.metrics_started = time.perf_counter()
+
+    @app.after_request
+    def _observe(response):
+        started = g.get('metrics_started')
+        if started is None:
+            return response
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        method = request.method
+        status = str(response.status_code)
+
+        # Runs after streamed bodies (ZIP, NDJSON, SSE) have been sent
+        def record():
+            HTTP_DURATION.observe(time.perf_counter() - started, route, method)
+            HTTP_REQUESTS.inc(route, method, status)
+        response.call_on_close(record)
+        return response
@@ -0,0 +1,767 @@
+import bisect
+import errno
+import mmap
+import os
+import struct
+from array import array
+
+# Bitrates in kbps indexed by [version is MPEG1][layer][bitrate index]
+BITRATES = {
+    True: {
+        1: (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+        2: (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+        3: (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    },
+    False: {
+        1: (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+        2: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+        3: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    },
+}
+
+# Sample rates indexed by the header's version bits (0: MPEG2.5, 2: MPEG2, 3: MPEG1)
+SAMPLE_RATES = {
+    0: (11025, 12000, 8000),
+    2: (22050, 24000, 16000),
+    3: (44100, 48000, 32000),
+}
+
+# Header bits that must stay constant across a stream: sync, version, layer, sample rate
+STREAM_MASK = 0xFFFE0C00
+
+XING_TAGS = (b'Xing', b'Info')
+XING_FRAMES_FLAG = 0x01
+XING_BYTES_FLAG = 0x02
+XING_TOC_FLAG = 0x04
+XING_QUALITY_FLAG = 0x08
+
+# Encoder strings that open a LAME-format extension after the Xing tag
+LAME_TAGS = (b'LAME', b'Lavc', b'Lavf')
+
+# Copy granularity used when slicing frames out of the mapped input
+COPY_CHUNK_SIZE = 4 * 1024 * 1024
+
+# Bytes read from the start and the end of a file by read_stream_info
+HEAD_BYTES = 64 * 1024
+TAIL_BYTES = 16 * 1024
+# The first frame must start within this many bytes after the ID3v2 tag
+MAX_LEADING_JUNK = 4096
+# Frames compared at each end of a file without Xing/VBRI header to confirm it is CBR
+CBR_CHECK_FRAMES = 8
+# Xing/VBRI byte counts may disagree with the file by this fraction before the header is distrusted
+VBR_BYTES_TOLERANCE = 0.01
+
+# ID3v2 frames reported under ffprobe's names; other text frames keep their frame id
+ID3V2_TAG_KEYS = {
+    'TALB': 'album', 'TCOM': 'composer', 'TCON': 'genre', 'TCOP': 'copyright', 'TENC': 'encoded_by',
+    'TIT1': 'grouping', 'TIT2': 'title', 'TLAN': 'language', 'TPE1': 'artist', 'TPE2': 'album_artist',
+    'TPE3': 'performer', 'TPOS': 'disc', 'TPUB': 'publisher', 'TRCK': 'track', 'TSSE': 'encoder',
+    'TSOA': 'album-sort', 'TSOP': 'artist-sort', 'TSOT': 'title-sort', 'TCMP': 'compilation',
+    'TDRC': 'date', 'TDRL': 'date', 'TYER': 'date', 'TDEN': 'creation_time',
+}
+ID3V2_ENCODINGS = ('latin-1', 'utf-16', 'utf-16-be', 'utf-8')
+# Larger ID3v2 frames are never text worth reporting (cover art, lyrics dumps) and are skipped
+MAX_TAG_FRAME_BYTES = 64 * 1024
+
+# copy_file_range/sendfile errors meaning "not supported here", not a failed copy
+KERNEL_COPY_UNSUPPORTED = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP,
+                           getattr(errno, 'ENOTSUP', errno.EOPNOTSUPP), getattr(errno, 'ENOTSOCK', errno.EINVAL)}
+
+
+class Mp3FormatError(ValueError):
+    """Raised when a file cannot be handled by the native MP3 code path."""
+
+
+def parse_frame_header(header):
+    """Decodes a 4-byte MPEG audio frame header given as an int.
+
+    Returns a dict with version, bitrate, sample_rate, padding,
+    channels, samples (per frame), length (bytes), crc and side_info
+    (bytes after the header, including the CRC), or None
+    when the header is not a valid Layer III frame with a fixed bitrate.
+    """
+    if (header >> 21) & 0x7FF != 0x7FF:
+        return None
+    version_bits = (header >> 19) & 3
+    layer_bits = (header >> 17) & 3
+    bitrate_index = (header >> 12) & 0xF
+    rate_index = (header >> 10) & 3
+    # Reserved version, non-Layer III, free-format or bad bitrate, reserved rate
+    if version_bits == 1 or layer_bits != 1 or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+
+    mpeg1 = version_bits == 3
+    bitrate = BITRATES[mpeg1][3][bitrate_index] * 1000
+    sample_rate = SAMPLE_RATES[version_bits][rate_index]
+    padding = (header >> 9) & 1
+    mono = (header >> 6) & 3 == 3
+    samples = 1152 if mpeg1 else 576
+
+    if mpeg1:
+        side_info = 17 if mono else 32
+    else:
+        side_info = 9 if mono else 17
+    crc = not (header >> 16) & 1
+    if crc:
+        side_info += 2  # CRC follows the header
+
+    return {
+        'version': version_bits,
+        'bitrate': bitrate,
+        'sample_rate': sample_rate,
+        'padding': padding,
+        'channels': 1 if mono else 2,
+        'samples': samples,
+        'length': samples // 8 * bitrate // sample_rate + padding,
+        'crc': crc,
+        'side_info': side_info,
+    }
+
+
+def id3v2_size(data):
+    """Returns the total size of a leading ID3v2 tag in data, 0 if there is none."""
+    if len(data) < 10 or data[:3] != b'ID3':
+        return 0
+    size = 0
+    for b in data[6:10]:
+        size = (size << 7) | (b & 0x7F)
+    # Flag bit 4 announces a 10-byte footer
+    return 10 + size + (10 if data[5] & 0x10 else 0)
+
+
+def _id3_text(encoding, raw):
+    """Decodes an ID3v2 text field into its non-empty values."""
+    if encoding >= len(ID3V2_ENCODINGS):
+        return []
+    text = raw.decode(ID3V2_ENCODINGS[encoding], errors='replace').replace('\ufeff', '')
+    return [value for value in text.split('\0') if value]
+
+
+def read_id3v2_tags(f, tag_size):
+    """Text frames of the ID3v2 tag at the start of file f, keyed like ffprobe's format tags.
+
+    Frame headers are followed with seeks, so only the text itself is read
+    and cover art costs nothing. Tags that are unsynchronised, compressed
+    or of version 2.2 yield what can be read without decoding them.
+    """
+    f.seek(0)
+    header = f.read(10)
+    version, flags = header[3], header[5]
+    if version not in (3, 4) or flags & 0x80:
+        return {}
+    end = tag_size - (10 if flags & 0x10 else 0)
+    pos = 10
+    if flags & 0x40:
+        size = f.read(4)
+        pos += (id3v2_size(b'ID3\0\0\0' + size) - 10) if version == 4 else 4 + struct.unpack('>I', size)[0]
+
+    tags = {}
+    while pos + 10 <= end:
+        f.seek(pos)
+        frame_header = f.read(10)
+        if len(frame_header) < 10 or frame_header[0] == 0:
+            break  # padding
+        frame_id = frame_header[:4].decode('latin-1')
+        if version == 4:
+            size = id3v2_size(b'ID3\0\0\0' + frame_header[4:8]) - 10
+        else:
+            size = struct.unpack_from('>I', frame_header, 4)[0]
+        data_pos = pos + 10
+        pos = data_pos + size
+        if pos > end or size < 2 or size > MAX_TAG_FRAME_BYTES:
+            continue
+        if not (frame_id[0] == 'T' or frame_id == 'COMM'):
+            continue
+        format_flags = frame_header[9]
+        if format_flags & (0x0E if version == 4 else 0xC0):
+            continue  # compressed, encrypted or unsynchronised
+        body = f.read(size)
+        if version == 4 and format_flags & 0x01:
+            body = body[4:]  # data length indicator
+        if frame_id == 'TXXX':
+            values = _id3_text(body[0], body[1:])
+            key, values = (values[0], values[1:]) if len(values) > 1 else (None, [])
+        elif frame_id == 'COMM':
+            values = _id3_text(body[0], body[4:])
+            key, values = 'comment', values[-1:]
+        else:
+            key, values = ID3V2_TAG_KEYS.get(frame_id, frame_id), _id3_text(body[0], body[1:])
+        if key and values and key not in tags:
+            tags[key] = ';'.join(values)
+    return tags
+
+
+def parse_id3v1_tags(tag):
+    """Fields of a 128-byte ID3v1 tag, keyed like ffprobe's format tags (the genre number is left out)."""
+    fields = {'title': tag[3:33], 'artist': tag[33:63], 'album': tag[63:93], 'date': tag[93:97],
+              'comment': tag[97:127]}
+    tags = {}
+    if tag[125] == 0 and tag[126] != 0:
+        # ID3v1.1: the last comment byte is the track number
+        fields['comment'] = tag[97:125]
+        tags['track'] = str(tag[126])
+    for key, raw in fields.items():
+        value = bytes(raw).split(b'\0', 1)[0].decode('latin-1').strip()
+        if value:
+            tags[key] = value
+    return tags
+
+
+def parse_vbr_header(frame, info):
+    """Parses a Xing/Info or VBRI header inside the first frame.
+
+    Returns a dict with tag, frames, bytes, toc, encoder_delay and
+    encoder_padding (None when absent), or None when there is no header.
+    """
+    pos = 4 + info['side_info']
+    tag = bytes(frame[pos:pos + 4])
+    if tag in XING_TAGS:
+        result = {'tag': tag.decode(), 'frames': None, 'bytes': None, 'toc': None,
+                  'encoder_delay': None, 'encoder_padding': None}
+        flags = struct.unpack_from('>I', frame, pos + 4)[0]
+        pos += 8
+        if flags & XING_FRAMES_FLAG:
+            result['frames'] = struct.unpack_from('>I', frame, pos)[0]
+            pos += 4
+        if flags & XING_BYTES_FLAG:
+            result['bytes'] = struct.unpack_from('>I', frame, pos)[0]
+            pos += 4
+        if flags & XING_TOC_FLAG:
+            result['toc'] = bytes(frame[pos:pos + 100])
+            pos += 100
+        if flags & XING_QUALITY_FLAG:
+            pos += 4
+        # LAME extension: encoder delay and padding as two 12-bit values
+        if len(frame) >= pos + 24 and bytes(frame[pos:pos + 4]) in LAME_TAGS:
+            delay_padding = int.from_bytes(frame[pos + 21:pos + 24], 'big')
+            result['encoder_delay'] = delay_padding >> 12
+            result['encoder_padding'] = delay_padding & 0xFFF
+        return result
+
+    pos = 4 + 32
+    if bytes(frame[pos:pos + 4]) == b'VBRI':
+        return {
+            'tag': 'VBRI',
+            'bytes': struct.unpack_from('>I', frame, pos + 10)[0],
+            'frames': struct.unpack_from('>I', frame, pos + 14)[0],
+            'toc': None,
+            'encoder_delay': struct.unpack_from('>H', frame, pos + 6)[0],
+            'encoder_padding': None,
+        }
+    return None
+
+
+class Mp3Index:
+    """Frame index of an MP3 file mapping time to byte offsets.
+
+    offsets holds the byte position of every audio frame followed by the
+    position just past the last one, so frame i spans offsets[i]:offsets[i + 1].
+    """
+
+    def __init__(self, path, offsets, header, info, tag_size, vbr, cbr):
+        self.path = path
+        self.offsets = offsets
+        self.header = header
+        self.sample_rate = info['sample_rate']
+        self.samples_per_frame = info['samples']
+        self.channels = info['channels']
+        self.tag_size = tag_size
+        self.vbr_header = vbr
+        self.cbr = cbr
+
+    @property
+    def frame_count(self):
+        return len(self.offsets) - 1
+
+    @property
+    def frame_duration(self):
+        return self.samples_per_frame / self.sample_rate
+
+    @property
+    def duration(self):
+        return self.frame_count * self.frame_duration
+
+    def frame_at(self, seconds):
+        """Returns the index of the frame boundary closest to the given time."""
+        frame = int(round(seconds / self.frame_duration))
+        return max(0, min(frame, self.frame_count))
+
+    def byte_range(self, start_frame, end_frame):
+        """Returns the (offset, length) of frames start_frame up to end_frame."""
+        return self.offsets[start_frame], self.offsets[end_frame] - self.offsets[start_frame]
+
+
+def _find_sync(data, pos, end, reference):
+    """Finds the next frame header matching reference, checking the frame after it."""
+    while pos + 4 <= end:
+        pos = data.find(b'\xff', pos, end)
+        if pos == -1 or pos + 4 > end:
+            return -1
+        header = struct.unpack_from('>I', data, pos)[0]
+        info = parse_frame_header(header)
+        if info and (reference is None or header & STREAM_MASK == reference):
+            following = pos + info['length']
+            if following + 4 > end:
+                return pos
+            nxt = struct.unpack_from('>I', data, following)[0]
+            if nxt & STREAM_MASK == header & STREAM_MASK and parse_frame_header(nxt):
+                return pos
+        pos += 1
+    return -1
+
+
+def _audio_end(data):
+    """Returns the offset where trailing ID3v1/APEv2 tags begin."""
+    end = len(data)
+    if end >= 128 and data[end - 128:end - 125] == b'TAG':
+        end -= 128
+    if end >= 32 and data[end - 32:end - 24] == b'APETAGEX':
+        ape_size = struct.unpack_from('<I', data, end - 20)[0]
+        end -= ape_size + (32 if data[end - 9] & 0x80 else 0)
+    return max(end, 0)
+
+
+def scan_frames(data, path=None):
+    """Builds an Mp3Index from a bytes-like object holding a whole MP3 file."""
+    tag_size = id3v2_size(data[:10])
+    end = _audio_end(data)
+
+    pos = _find_sync(data, tag_size, end, None)
+    if pos == -1:
+        raise Mp3FormatError('No MPEG Layer III frames found')
+
+    first_header = struct.unpack_from('>I', data, pos)[0]
+    first_info = parse_frame_header(first_header)
+    reference = first_header & STREAM_MASK
+
+    vbr = parse_vbr_header(data[pos:pos + first_info['length']], first_info)
+    if vbr is not None:
+        # The Xing/VBRI frame carries no audio
+        pos += first_info['length']
+
+    offsets = array('Q')
+    lengths = {}
+    bitrates = set()
+    audio_header = None
+
+    while pos + 4 <= end:
+        header = struct.unpack_from('>I', data, pos)[0]
+        length = lengths.get(header)
+        if length is None:
+            info = parse_frame_header(header) if header & STREAM_MASK == reference else None
+            if info is None:
+                pos = _find_sync(data, pos + 1, end, reference)
+                if pos == -1:
+                    break
+                continue
+            length = info['length']
+            lengths[header] = length
+            bitrates.add(info['bitrate'])
+        if pos + length > end:
+            break  # truncated final frame
+        if audio_header is None:
+            audio_header = header
+        offsets.append(pos)
+        pos += length
+
+    if not offsets:
+        raise Mp3FormatError('No MPEG Layer III frames found')
+    offsets.append(offsets[-1] + lengths[struct.unpack_from('>I', data, offsets[-1])[0]])
+
+    info = parse_frame_header(audio_header)
+    return Mp3Index(path, offsets, audio_header, info, tag_size, vbr, len(bitrates) == 1)
+
+
+class MappedMp3:
+    """A memory-mapped MP3 file together with its frame index.
+
+    Use as a context manager; data and index stay valid until it exits.
+    Raises Mp3FormatError when the file is not a Layer III MP3.
+    """
+
+    def __init__(self, input_file):
+        self._file = open(input_file, 'rb')
+        try:
+            if os.fstat(self._file.fileno()).st_size == 0:
+                raise Mp3FormatError('File is empty')
+            self.data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                self.index = scan_frames(self.data, input_file)
+            except BaseException:
+                self.data.close()
+                raise
+        except BaseException:
+            self._file.close()
+            raise
+
+    def close(self):
+        self.data.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def build_index(input_file):
+    """Memory-maps an MP3 file and returns its Mp3Index."""
+    with MappedMp3(input_file) as mapped:
+        return mapped.index
+
+
+def _check_cbr(data, pos, end, reference, bitrate):
+    """Follows up to CBR_CHECK_FRAMES frames from pos; returns how many, raising if one differs in bitrate."""
+    checked = 0
+    while checked < CBR_CHECK_FRAMES and pos + 4 <= end:
+        header = struct.unpack_from('>I', data, pos)[0]
+        info = parse_frame_header(header) if header & STREAM_MASK == reference else None
+        if info is None:
+            break
+        if info['bitrate'] != bitrate:
+            raise Mp3FormatError('Bitrate changes without a Xing/VBRI header')
+        checked += 1
+        pos += info['length']
+    return checked
+
+
+def read_stream_info(input_file):
+    """Duration and format of an MP3 from its headers alone.
+
+    Only the first and last few KB are read: the ID3v2 tag size, the first
+    frame header and any Xing/Info or VBRI header. A frame count gives the
+    exact duration; without one the file must be true CBR (frames at both
+    ends share the bitrate) and the duration is audio bytes / bitrate.
+    Returns the fields of media_probe.run_ffprobe; tags come from the
+    ID3v2 tag, or the ID3v1 tag when there is no ID3v2 text.
+    Raises Mp3FormatError when the headers are missing or disagree with
+    the file, so the caller can fall back to a full probe.
+    """
+    with open(input_file, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        head = f.read(HEAD_BYTES)
+        tag_size = id3v2_size(head[:10])
+        base = 0
+        if tag_size + MAX_LEADING_JUNK + TAIL_BYTES > len(head) and tag_size < size:
+            # Large tags (cover art) push the first frames past the first read
+            f.seek(tag_size)
+            head = f.read(MAX_LEADING_JUNK + TAIL_BYTES)
+            base = tag_size
+        tail_start = max(0, size - TAIL_BYTES)
+        f.seek(tail_start)
+        tail = f.read()
+        tags = read_id3v2_tags(f, tag_size) if tag_size else {}
+    if not tags and len(tail) >= 128 and tail[-128:-125] == b'TAG':
+        tags = parse_id3v1_tags(tail[-128:])
+
+    tail_end = _audio_end(tail)
+    if tail_end == 0 and tail_start > 0:
+        raise Mp3FormatError('Trailing tags are larger than the tail read')
+    audio_end = tail_start + tail_end
+
+    start = tag_size - base
+    pos = _find_sync(head, start, len(head), None)
+    if pos == -1 or pos - start > MAX_LEADING_JUNK:
+        raise Mp3FormatError('No MPEG Layer III frame after the ID3v2 tag')
+    header = struct.unpack_from('>I', head, pos)[0]
+    info = parse_frame_header(header)
+    reference = header & STREAM_MASK
+    frame_start = base + pos
+    try:
+        vbr = parse_vbr_header(head[pos:pos + info['length']], info)
+    except struct.error:
+        raise Mp3FormatError('Truncated Xing/VBRI header')
+    frame_duration = info['samples'] / info['sample_rate']
+
+    if vbr is not None:
+        audio_start = frame_start + info['length']
+        if not vbr['frames']:
+            raise Mp3FormatError(f"{vbr['tag']} header without a frame count")
+        # The byte count covers the header frame too; a mismatch means a truncated or appended file
+        if vbr['bytes'] and abs(vbr['bytes'] - (audio_end - frame_start)) > vbr['bytes'] * VBR_BYTES_TOLERANCE:
+            raise Mp3FormatError(f"{vbr['tag']} byte count does not match the file size")
+        duration = vbr['frames'] * frame_duration
+        bitrate = (audio_end - audio_start) * 8 / duration
+        # Average frame size must be one a real stream can have
+        rates = [rate * 1000 for rate in BITRATES[info['version'] == 3][3][1:]]
+        if not rates[0] * 0.9 <= bitrate <= rates[-1] * 1.1:
+            raise Mp3FormatError(f"{vbr['tag']} frame count does not match the file size")
+    else:
+        audio_start = frame_start
+        bitrate = info['bitrate']
+        _check_cbr(head, pos, len(head), reference, bitrate)
+        tail_pos = _find_sync(tail, max(0, audio_start - tail_start), tail_end, reference)
+        if tail_pos == -1 or not _check_cbr(tail, tail_pos, tail_end, reference, bitrate):
+            raise Mp3FormatError('No frames found at the end of the file')
+        duration = (audio_end - audio_start) * 8 / bitrate
+
+    if duration <= 0:
+        raise Mp3FormatError('No audio frames')
+    return {
+        'duration': duration,
+        'bitrate': int(round(bitrate)),
+        'sample_rate': info['sample_rate'],
+        'channels': info['channels'],
+        'codec': 'mp3',
+        'tags': tags,
+    }
+
+
+def make_xing_frame(base, cbr, frame_count, audio_bytes, frame_position):
+    """Returns a Xing/Info frame for frame_count frames of audio_bytes bytes.
+
+    base is a frame header of the stream; frame_position(i) gives the byte
+    offset of frame i from the start of the audio, for the TOC.
+    """
+    # Drop CRC and padding, then pick the smallest bitrate that fits the tag
+    base = (base | (1 << 16)) & ~(1 << 9)
+    needed = 4 + 32 + 8 + 4 + 4 + 100 + 4
+    for bitrate_index in range(1, 15):
+        header = (base & ~(0xF << 12)) | (bitrate_index << 12)
+        info = parse_frame_header(header)
+        if info['length'] >= needed:
+            break
+
+    total_bytes = info['length'] + audio_bytes
+
+    toc = bytearray(100)
+    for i in range(100):
+        position = info['length'] + frame_position(i * frame_count // 100)
+        toc[i] = min(255, position * 256 // total_bytes)
+
+    frame = bytearray(info['length'])
+    struct.pack_into('>I', frame, 0, header)
+    pos = 4 + info['side_info']
+    frame[pos:pos + 4] = b'Info' if cbr else b'Xing'
+    struct.pack_into('>IIII', frame, pos + 4,
+                     XING_FRAMES_FLAG | XING_BYTES_FLAG | XING_TOC_FLAG | XING_QUALITY_FLAG,
+                     frame_count, total_bytes, 0)
+    frame[pos + 16:pos + 116] = toc
+    # Quality indicator stays 0
+    return bytes(frame)
+
+
+def build_xing_frame(index, start_frame, end_frame):
+    """Returns a Xing/Info frame describing frames start_frame:end_frame of index."""
+    offset, audio_bytes = index.byte_range(start_frame, end_frame)
+    return make_xing_frame(index.header, index.cbr, end_frame - start_frame, audio_bytes,
+                           lambda frame: index.offsets[start_frame + frame] - offset)
+
+
+def build_join_xing_frame(indexes):
+    """Returns a Xing/Info frame describing the audio frames of indexes back to back."""
+    first_frames = []
+    first_bytes = []
+    frame_count = audio_bytes = 0
+    for index in indexes:
+        first_frames.append(frame_count)
+        first_bytes.append(audio_bytes)
+        frame_count += index.frame_count
+        audio_bytes += index.offsets[-1] - index.offsets[0]
+
+    def frame_position(frame):
+        i = bisect.bisect_right(first_frames, frame) - 1
+        index = indexes[i]
+        return first_bytes[i] + index.offsets[frame - first_frames[i]] - index.offsets[0]
+
+    # Info (CBR) only when every input is CBR at the same bitrate
+    cbr = all(index.cbr for index in indexes) and len({(index.header >> 12) & 0xF for index in indexes}) == 1
+    return make_xing_frame(indexes[0].header, cbr, frame_count, audio_bytes, frame_position)
+
+
+def main_data_info(frame, info):
+    """Returns (main_data_begin, main data length in bytes) from a frame's side info.
+
+    main_data_begin is how many bytes before this frame's payload its main
+    data starts, in the bit reservoir of the frames before it.
+    """
+    size = _side_info_length(info)
+    side = frame[4 + info['side_info'] - size:4 + info['side_info']]
+    bits = int.from_bytes(bytes(side), 'big')
+    total = size * 8
+
+    def field(pos, width):
+        return (bits >> (total - pos - width)) & ((1 << width) - 1)
+
+    stereo = info['channels'] == 2
+    if info['version'] == 3:
+        begin = field(0, 9)
+        pos = 9 + (3 if stereo else 5) + 4 * info['channels']
+        granules, block = 2, 59
+    else:
+        begin = field(0, 8)
+        pos = 8 + (2 if stereo else 1)
+        granules, block = 1, 63
+    length = 0
+    for _ in range(granules * info['channels']):
+        length += field(pos, 12)  # part2_3_length
+        pos += block
+    return begin, (length + 7) // 8
+
+
+def _side_info_length(info):
+    """Side info bytes of a frame, without the CRC."""
+    return info['side_info'] - (2 if info['crc'] else 0)
+
+
+def self_contained_frame(data, offsets, i):
+    """Frame i of a stream, rewritten so its main data does not reach into earlier frames.
+
+    offsets are the frame positions in data (see Mp3Index). Copying frames
+    from i onward behind other audio breaks their bit reservoir, so frame i
+    is rebuilt without CRC at the smallest bitrate that holds its whole
+    main data followed by the rest of the reservoir bytes later frames
+    read; the gap between the two is ancillary data. Returns the frame
+    unchanged when it already starts its own main data, and None when its
+    data does not fit even the largest frame.
+    """
+    offset = offsets[i]
+    header = struct.unpack_from('>I', data, offset)[0]
+    info = parse_frame_header(header)
+    frame = bytes(data[offset:offset + info['length']])
+    begin, length = main_data_info(frame, info)
+    if begin == 0:
+        return frame
+
+    # Reservoir bytes: the tail of the payloads of the frames before i
+    reservoir = b''
+    j = i
+    while len(reservoir) < begin:
+        j -= 1
+        if j < 0:
+            return None
+        prev_info = parse_frame_header(struct.unpack_from('>I', data, offsets[j])[0])
+        reservoir = bytes(data[offsets[j] + 4 + prev_info['side_info']:offsets[j] + prev_info['length']]) + reservoir
+    stream = reservoir[len(reservoir) - begin:] + frame[4 + info['side_info']:]
+    if length > len(stream):
+        return None
+
+    side_length = _side_info_length(info)
+    side = bytearray(frame[4 + info['side_info'] - side_length:4 + info['side_info']])
+    side[0] = 0
+    if info['version'] == 3:
+        side[1] &= 0x7F  # main_data_begin is 9 bits in MPEG-1
+    needed = 4 + side_length + len(stream)
+    base = (header | (1 << 16)) & ~(1 << 9)  # no CRC, no padding
+    for bitrate_index in range(1, 15):
+        new_header = (base & ~(0xF << 12)) | (bitrate_index << 12)
+        new_length = parse_frame_header(new_header)['length']
+        if new_length >= needed:
+            return (struct.pack('>I', new_header) + bytes(side) + stream[:length]
+                    + bytes(new_length - needed) + stream[length:])
+    return None
+
+
+def iter_segment_bytes(index, data, start_frame, end_frame):
+    """Yields the bytes of one output file: tags, a fresh Xing frame and the audio frames."""
+    if index.tag_size:
+        yield data[:index.tag_size]
+    yield build_xing_frame(index, start_frame, end_frame)
+    offset, length = index.byte_range(start_frame, end_frame)
+    for chunk_start in range(offset, offset + length, COPY_CHUNK_SIZE):
+        yield data[chunk_start:min(chunk_start + COPY_CHUNK_SIZE, offset + length)]
+
+
+def segment_frames(index, start, end):
+    """Converts a (start, end) time range in seconds to a frame range."""
+    start_frame = index.frame_at(start)
+    end_frame = index.frame_at(end)
+    if end_frame <= start_frame:
+        raise Mp3FormatError('Segment is outside the audio stream')
+    return start_frame, end_frame
+
+
+def split_segments(input_file, segments, progress=None):
+    """Cuts segments by copying frame byte ranges, without spawning ffmpeg.
+
+    Follows the split_engine.split_segments contract: segments are dicts
+    with 'start', 'end' and 'path', the result is a list of (path, error).
+    progress, if given, is called with the number of segments written so
+    far. Raises Mp3FormatError when the input is not a Layer III MP3.
+    """
+    with MappedMp3(input_file) as mapped:
+        results = []
+        for seg in segments:
+            try:
+                start_frame, end_frame = segment_frames(mapped.index, seg['start'], seg['end'])
+                with open(seg['path'], 'wb') as out:
+                    for chunk in iter_segment_bytes(mapped.index, mapped.data, start_frame, end_frame):
+                        out.write(chunk)
+                results.append((seg['path'], None))
+            except (OSError, Mp3FormatError) as e:
+                results.append((seg['path'], str(e)))
+            if progress is not None:
+                progress(len(results))
+        return results
+
+
+def copy_range(src_fd, dst_fd, offset, length):
+    """Appends length bytes of src_fd starting at offset to dst_fd's current position.
+
+    Uses copy_file_range (or sendfile) so the bytes never enter Python,
+    falling back to read/write where the kernel or filesystem cannot.
+    """
+    end = offset + length
+    kernel_copy = getattr(os, 'copy_file_range', None)
+    if kernel_copy is None and hasattr(os, 'sendfile'):
+        kernel_copy = lambda src, dst, count, offset: os.sendfile(dst, src, offset, count)
+    while kernel_copy is not None and offset < end:
+        try:
+            copied = kernel_copy(src_fd, dst_fd, end - offset, offset)
+        except OSError as e:
+            if e.errno not in KERNEL_COPY_UNSUPPORTED:
+                raise
+            break
+        if copied == 0:
+            break
+        offset += copied
+
+    while offset < end:
+        os.lseek(src_fd, offset, os.SEEK_SET)
+        chunk = os.read(src_fd, min(COPY_CHUNK_SIZE, end - offset))
+        if not chunk:
+            raise Mp3FormatError('Input file changed while it was being copied')
+        os.write(dst_fd, chunk)
+        offset += len(chunk)
+
+
+def stream_key(index):
+    """Properties that must be equal for the frames of two files to form one stream."""
+    return index.header & STREAM_MASK, index.channels
+
+
+def join_files(input_files, output_path, progress=None):
+    """Concatenates the audio frames of same-format MP3 files without re-encoding.
+
+    ID3v2/ID3v1/APE tags and Xing/VBRI frames of the inputs are dropped; the
+    output keeps the first input's ID3v2 tag and gets one fresh Xing/Info
+    frame counting every frame. progress, if given, is called with the
+    number of inputs copied so far and the seconds of audio written.
+    Raises Mp3FormatError when an input is not a Layer III MP3 or the
+    inputs differ in version, sample rate or channel count.
+    """
+    # Index everything first so a mismatch is found before any output exists
+    indexes = [build_index(path) for path in input_files]
+    if not indexes:
+        raise Mp3FormatError('No input files')
+    key = stream_key(indexes[0])
+    for index in indexes[1:]:
+        if stream_key(index) != key:
+            raise Mp3FormatError(f"{os.path.basename(index.path)} does not match the format of "
+                                 f"{os.path.basename(indexes[0].path)}")
+
+    seconds = 0.0
+    with open(output_path, 'wb', buffering=0) as out:
+        if indexes[0].tag_size:
+            with open(input_files[0], 'rb') as f:
+                out.write(f.read(indexes[0].tag_size))
+        out.write(build_join_xing_frame(indexes))
+        for done, (path, index) in enumerate(zip(input_files, indexes), 1):
+            with open(path, 'rb', buffering=0) as src:
+                if os.fstat(src.fileno()).st_size < index.offsets[-1]:
+                    raise Mp3FormatError(f"{os.path.basename(path)} changed while joining")
+                copy_range(src.fileno(), out.fileno(), index.offsets[0], index.offsets[-1] - index.offsets[0])
+            seconds += index.duration
+            if progress is not None:
+                progress(done, seconds)
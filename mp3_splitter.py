@@ -1,42 +1,30 @@
 import argparse
-import subprocess
 import os
-import random
-import string
 import sys
-import json
 import shutil
-
-def get_random_string(length=5):
-    """Generates a random string of fixed length using lowercase letters and digits."""
-    letters_and_digits = string.ascii_lowercase + string.digits
-    return ''.join(random.choice(letters_and_digits) for i in range(length))
+import batch_split
+import loudness
+import media_probe
+import silence
+from split_engine import BACKENDS, build_fixed_segments, discard_placeholder, reserve_output_path, split_segments
 
 def get_duration(input_file):
-    """Gets the duration of the media file using ffprobe."""
-    cmd = [
-        'ffprobe',
-        '-v', 'error',
-        '-show_entries', 'format=duration',
-        '-of', 'json',
-        input_file
-    ]
+    """Gets the duration of the media file (cached ffprobe lookup)."""
     try:
-        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-        data = json.loads(result.stdout)
-        return float(data['format']['duration'])
-    except subprocess.CalledProcessError as e:
-        print(f"Error getting duration: {e.stderr}", file=sys.stderr)
-        sys.exit(1)
-    except (KeyError, json.JSONDecodeError, ValueError):
-        print("Error parsing duration from ffprobe output.", file=sys.stderr)
-        sys.exit(1)
-    except FileNotFoundError:
-        print("Error: ffprobe not found. Please ensure ffmpeg is installed and in your PATH.", file=sys.stderr)
+        return media_probe.get_duration(input_file)
+    except media_probe.ProbeError as e:
+        print(e, file=sys.stderr)
         sys.exit(1)
 
-def split_mp3(input_file, segment_length, output_dir):
-    """Splits the MP3 file into segments."""
+def split_mp3(input_file, segment_length, output_dir, backend='ffmpeg', jobs=1, on_silence=False,
+              silence_threshold=silence.DEFAULT_THRESHOLD_DB, min_silence=silence.DEFAULT_MIN_SILENCE,
+              normalize=None):
+    """Splits the MP3 file into segments, optionally moving cuts to nearby pauses.
+
+    normalize, a (target_lufs, true_peak) pair, re-encodes the segments at
+    one loudness gain measured over the whole file. Returns the number of
+    files created and the indexes of failed segments.
+    """
     if not os.path.exists(input_file):
         print(f"Error: Input file '{input_file}' not found.", file=sys.stderr)
         sys.exit(1)
@@ -45,74 +33,160 @@ def split_mp3(input_file, segment_length, output_dir):
         print("Error: Segment length must be greater than 0.", file=sys.stderr)
         sys.exit(1)
 
-    # Check if ffmpeg is available
-    if shutil.which('ffmpeg') is None:
+    if jobs < 1:
+        print("Error: --jobs must be at least 1.", file=sys.stderr)
+        sys.exit(1)
+
+    # Check if ffmpeg is available (the native backend still needs ffprobe for the duration)
+    if (backend == 'ffmpeg' or normalize is not None) and shutil.which('ffmpeg') is None:
         print("Error: ffmpeg not found. Please ensure ffmpeg is installed and in your PATH.", file=sys.stderr)
         sys.exit(1)
 
     duration = get_duration(input_file)
-    num_segments = int(duration // segment_length) + (1 if duration % segment_length > 0 else 0)
-    
     print(f"Total duration: {duration:.2f}s")
-    print(f"Splitting into {num_segments} segments of {segment_length}s each...")
+    if on_silence:
+        try:
+            ranges, silences = silence.detect_segments(input_file, duration, segment_length,
+                                                       silence_threshold, min_silence)
+        except silence.SilenceError as e:
+            print(f"Error: {e}", file=sys.stderr)
+            sys.exit(1)
+        print(f"Found {silences} pauses; splitting into {len(ranges)} segments of about {segment_length}s each...")
+    else:
+        ranges = build_fixed_segments(duration, segment_length)
+        print(f"Splitting into {len(ranges)} segments of {segment_length}s each...")
+
+    # Measured before any output name is reserved, so a failure leaves no placeholders behind
+    if normalize is not None:
+        print("Measuring loudness...")
+        try:
+            gain_db = loudness.gain_for(loudness.measure(input_file), *normalize)
+        except loudness.LoudnessError as e:
+            print(f"Error: {e}", file=sys.stderr)
+            sys.exit(1)
 
     if output_dir:
         os.makedirs(output_dir, exist_ok=True)
     else:
         output_dir = os.path.dirname(os.path.abspath(input_file))
 
-    base_name = os.path.splitext(os.path.basename(input_file))[0]
-    
-    created_files = 0
-    
-    for i in range(num_segments):
-        start_time = i * segment_length
-        # Ensure we don't go past the end, though ffmpeg handles this gracefully usually.
-        # For the last segment, we can just let it run to end or specify duration.
-        # Specifying duration is safer to ensure equal chunks except last.
-        
+    # Names are reserved up front in index order, so they do not depend on which
+    # worker finishes first and cannot collide with a concurrent run
+    segments = []
+    for i, (start_time, end_time) in enumerate(ranges):
         index = i + 1
-        rand_suffix = get_random_string()
-        output_filename = f"{index}_{rand_suffix}.mp3"
-        output_path = os.path.join(output_dir, output_filename)
-        
-        # Handle existing file
-        while os.path.exists(output_path):
-            rand_suffix = get_random_string()
-            output_filename = f"{index}_{rand_suffix}.mp3"
-            output_path = os.path.join(output_dir, output_filename)
-
-        cmd = [
-            'ffmpeg',
-            '-y', # Overwrite if we somehow generated a name that exists (though we check above)
-            '-i', input_file,
-            '-ss', str(start_time),
-            '-t', str(segment_length),
-            '-c', 'copy', # Fast stream copy
-            '-map', '0', # Map all streams
-            '-vn', # Disable video
-            output_path
-        ]
-
-        # Suppress ffmpeg output unless error
-        try:
-            subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
-            print(f"Created: {output_filename}")
+        output_path = reserve_output_path(output_dir, index)
+        segments.append({'start': start_time, 'end': end_time, 'path': output_path, 'index': index})
+
+    try:
+        if normalize is not None:
+            print(f"Applying {gain_db:+.2f} dB to reach {normalize[0]:g} LUFS; encoding on {jobs} workers...")
+            results = loudness.normalize_segments(input_file, segments, gain_db, workers=jobs)
+        else:
+            results = split_segments(input_file, segments, backend, workers=jobs)
+    except BaseException:
+        for seg in segments:
+            discard_placeholder(seg['path'])
+        raise
+
+    created_files = 0
+    failed = []
+    for seg, (output_path, error) in zip(segments, results):
+        if error is None:
+            print(f"Created: {os.path.basename(output_path)}")
             created_files += 1
-        except subprocess.CalledProcessError as e:
-            print(f"Error creating segment {index}: {e.stderr.decode()}", file=sys.stderr)
+        else:
+            discard_placeholder(output_path)
+            failed.append(seg['index'])
+            print(f"Error creating segment {seg['index']}: {error}", file=sys.stderr)
 
     print(f"Done. Created {created_files} files in '{output_dir}'.")
+    if failed:
+        print(f"Failed segments: {', '.join(str(i) for i in failed)}", file=sys.stderr)
+    return created_files, failed
+
+def split_batch(source, segment_length, output_dir, backend='ffmpeg', jobs=1, journal_path=None, recursive=False):
+    """Splits every file of a folder or JSON/CSV manifest on one shared worker pool.
+
+    Completed segments are journaled with their size and checksum, so
+    running the same batch again only cuts what is missing or damaged.
+    """
+    if jobs < 1:
+        print("Error: --jobs must be at least 1.", file=sys.stderr)
+        sys.exit(1)
+
+    if backend == 'ffmpeg' and shutil.which('ffmpeg') is None:
+        print("Error: ffmpeg not found. Please ensure ffmpeg is installed and in your PATH.", file=sys.stderr)
+        sys.exit(1)
+
+    try:
+        entries = batch_split.load_entries(source, recursive)
+    except (batch_split.BatchError, OSError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    if not output_dir:
+        # Next to the folder rather than inside it, so a recursive rerun does not pick up outputs
+        source_path = os.path.abspath(source).rstrip(os.sep)
+        output_dir = source_path + '_segments' if os.path.isdir(source) else os.path.dirname(source_path)
+    os.makedirs(output_dir, exist_ok=True)
+
+    plan, errors = batch_split.build_plan(entries, output_dir, segment_length)
+    for error in errors:
+        print(f"Skipping {error}", file=sys.stderr)
+    total = sum(len(segments) for _, segments in plan)
+    print(f"Batch: {len(plan)} files, {total} segments, {jobs} workers.")
+
+    journal = batch_split.Journal(journal_path or os.path.join(output_dir, batch_split.JOURNAL_NAME))
+    try:
+        created, skipped, failures = batch_split.run_batch(plan, journal, jobs, backend)
+    finally:
+        journal.close()
+
+    print(f"Done. Created {created} files, skipped {skipped} already done, in '{output_dir}'.")
+    if failures or errors:
+        print(f"{len(failures)} segments and {len(errors)} files failed; run again to retry them.", file=sys.stderr)
+        sys.exit(1)
 
 def main():
     parser = argparse.ArgumentParser(description="Split MP3 file into equal length segments.")
-    parser.add_argument("input_file", help="Path to the input MP3 file.")
+    parser.add_argument("input_file",
+                        help="Path to the input MP3 file, or a folder / .json / .csv manifest for a batch.")
     parser.add_argument("--segment-length", type=float, default=30.0, help="Segment length in seconds (default: 30).")
     parser.add_argument("--output-dir", help="Directory to save output files (default: same as input).")
+    parser.add_argument("--backend", choices=BACKENDS, default='ffmpeg',
+                        help="Cutting backend: ffmpeg, native (frame-accurate byte copy, MP3 only) or auto (default: ffmpeg).")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1,
+                        help="Number of ffmpeg passes to run in parallel (default: CPU count).")
+    parser.add_argument("--split-on-silence", action="store_true",
+                        help="Move each cut to the nearest pause around the segment length (needs NumPy).")
+    parser.add_argument("--silence-threshold", type=float, default=silence.DEFAULT_THRESHOLD_DB,
+                        help=f"Level in dBFS below which audio counts as silence (default: {silence.DEFAULT_THRESHOLD_DB:g}).")
+    parser.add_argument("--min-silence", type=float, default=silence.DEFAULT_MIN_SILENCE,
+                        help=f"Shortest pause in seconds to cut at (default: {silence.DEFAULT_MIN_SILENCE:g}).")
+    parser.add_argument("--normalize", action="store_true",
+                        help="Re-encode segments at one EBU R128 loudness gain measured over the whole file.")
+    parser.add_argument("--target-lufs", type=float, default=loudness.DEFAULT_TARGET_LUFS,
+                        help=f"Loudness target for --normalize (default: {loudness.DEFAULT_TARGET_LUFS:g} LUFS).")
+    parser.add_argument("--true-peak", type=float, default=loudness.DEFAULT_TRUE_PEAK,
+                        help=f"Highest true peak allowed by --normalize (default: {loudness.DEFAULT_TRUE_PEAK:g} dBTP).")
+    parser.add_argument("--recursive", action="store_true", help="Batch: include MP3s in subfolders.")
+    parser.add_argument("--journal",
+                        help=f"Batch: completion journal used to resume (default: <output dir>/{batch_split.JOURNAL_NAME}).")
 
     args = parser.parse_args()
 
-    split_mp3(args.input_file, args.segment_length, args.output_dir)
+    if batch_split.is_batch_input(args.input_file):
+        if args.split_on_silence or args.normalize:
+            print("Error: --split-on-silence and --normalize are not supported in batch mode.", file=sys.stderr)
+            sys.exit(1)
+        split_batch(args.input_file, args.segment_length, args.output_dir, args.backend, args.jobs,
+                    args.journal, args.recursive)
+        return
+
+    normalize = (args.target_lufs, args.true_peak) if args.normalize else None
+    split_mp3(args.input_file, args.segment_length, args.output_dir, args.backend, args.jobs,
+              args.split_on_silence, args.silence_threshold, args.min_silence, normalize)
 
 if __name__ == "__main__":
     main()
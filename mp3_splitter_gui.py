@@ -1,115 +1,138 @@
 import FreeSimpleGUI as sg
-import subprocess
 import os
-import random
-import string
-import sys
-import json
 import shutil
 import threading
-
-def get_random_string(length=5):
-    """Generates a random string of fixed length using lowercase letters and digits."""
-    letters_and_digits = string.ascii_lowercase + string.digits
-    return ''.join(random.choice(letters_and_digits) for i in range(length))
-
-def get_duration(input_file):
-    """Gets the duration of the media file using ffprobe."""
-    cmd = [
-        'ffprobe',
-        '-v', 'error',
-        '-show_entries', 'format=duration',
-        '-of', 'json',
-        input_file
-    ]
-    try:
-        # startupinfo to hide console window on Windows
-        startupinfo = None
-        if os.name == 'nt':
-            startupinfo = subprocess.STARTUPINFO()
-            startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-            
-        result = subprocess.run(cmd, capture_output=True, text=True, check=True, startupinfo=startupinfo)
-        data = json.loads(result.stdout)
-        return float(data['format']['duration'])
-    except Exception as e:
-        raise Exception(f"Error getting duration: {e}")
-
-def split_mp3_thread(window, input_file, segment_length, output_dir):
-    """Splits the MP3 file into segments (runs in a thread)."""
+import time
+from collections import deque
+from jobs import Job, JobCancelled
+from media_probe import get_duration
+from split_engine import build_fixed_segments, discard_placeholder, reserve_output_path, split_segments
+
+# The window polls a running split this often, however fast segments finish
+PROGRESS_INTERVAL_MS = 200
+# Older log lines are dropped so the log widget stays responsive on long runs
+MAX_LOG_LINES = 1000
+
+def split_mp3_thread(window, job, log, input_file, segment_length, output_dir, jobs=1):
+    """Splits the MP3 file into segments (runs in a thread).
+
+    Progress goes to job.progress and log lines are appended to log; the
+    window picks both up on its own timer instead of receiving one event
+    per segment. Only '-DONE-' is posted, with the message to show.
+    """
+    message = "Processing Complete!"
     try:
         if not os.path.exists(input_file):
-            window.write_event_value('-LOG-', f"Error: Input file '{input_file}' not found.")
-            window.write_event_value('-DONE-', None)
+            log.append(f"Error: Input file '{input_file}' not found.")
             return
 
         if shutil.which('ffmpeg') is None:
-            window.write_event_value('-LOG-', "Error: ffmpeg not found. Please ensure ffmpeg is installed and in your PATH.")
-            window.write_event_value('-DONE-', None)
+            log.append("Error: ffmpeg not found. Please ensure ffmpeg is installed and in your PATH.")
             return
 
-        window.write_event_value('-LOG-', f"Getting duration for: {input_file}")
+        log.append(f"Getting duration for: {input_file}")
         try:
             duration = get_duration(input_file)
         except Exception as e:
-            window.write_event_value('-LOG-', str(e))
-            window.write_event_value('-DONE-', None)
+            log.append(str(e))
             return
 
-        num_segments = int(duration // segment_length) + (1 if duration % segment_length > 0 else 0)
-        
-        window.write_event_value('-LOG-', f"Total duration: {duration:.2f}s")
-        window.write_event_value('-LOG-', f"Splitting into {num_segments} segments of {segment_length}s each...")
+        ranges = build_fixed_segments(duration, segment_length)
+        num_segments = len(ranges)
+        job.update(duration=duration, segmentsDone=0, segmentsTotal=num_segments)
+
+        log.append(f"Total duration: {duration:.2f}s")
+        log.append(f"Splitting into {num_segments} segments of {segment_length}s each...")
 
         if output_dir:
             os.makedirs(output_dir, exist_ok=True)
         else:
             output_dir = os.path.dirname(os.path.abspath(input_file))
 
-        created_files = 0
-        
-        startupinfo = None
-        if os.name == 'nt':
-            startupinfo = subprocess.STARTUPINFO()
-            startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-
-        for i in range(num_segments):
-            start_time = i * segment_length
+        # Names are reserved in index order before any worker starts
+        segments = []
+        for i, (start_time, end_time) in enumerate(ranges):
             index = i + 1
-            rand_suffix = get_random_string()
-            output_filename = f"{index}_{rand_suffix}.mp3"
-            output_path = os.path.join(output_dir, output_filename)
-            
-            while os.path.exists(output_path):
-                rand_suffix = get_random_string()
-                output_filename = f"{index}_{rand_suffix}.mp3"
-                output_path = os.path.join(output_dir, output_filename)
-
-            cmd = [
-                'ffmpeg',
-                '-y',
-                '-i', input_file,
-                '-ss', str(start_time),
-                '-t', str(segment_length),
-                '-c', 'copy',
-                '-map', '0',
-                '-vn',
-                output_path
-            ]
+            output_path = reserve_output_path(output_dir, index)
+            segments.append({'start': start_time, 'end': end_time, 'path': output_path, 'index': index})
 
-            try:
-                subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, startupinfo=startupinfo)
-                window.write_event_value('-LOG-', f"Created: {output_filename}")
+        try:
+            results = split_segments(input_file, segments, job=job, workers=jobs)
+        except JobCancelled:
+            # ffmpeg was killed mid-write, so no file of this run can be trusted
+            for seg in segments:
+                try:
+                    os.remove(seg['path'])
+                except OSError:
+                    pass
+            log.append("Cancelled. Removed the segments written by this run.")
+            message = "Split cancelled."
+            return
+
+        created_files = 0
+        failed = []
+        for seg, (output_path, error) in zip(segments, results):
+            if error is None:
+                log.append(f"Created: {os.path.basename(output_path)}")
                 created_files += 1
-            except subprocess.CalledProcessError as e:
-                window.write_event_value('-LOG-', f"Error creating segment {index}: {e.stderr.decode() if e.stderr else 'Unknown error'}")
+            else:
+                discard_placeholder(output_path)
+                failed.append(seg['index'])
+                log.append(f"Error creating segment {seg['index']}: {error}")
+
+        log.append(f"Done. Created {created_files} files in '{output_dir}'.")
+        if failed:
+            log.append(f"Failed segments: {', '.join(str(i) for i in failed)}")
 
-        window.write_event_value('-LOG-', f"Done. Created {created_files} files in '{output_dir}'.")
-        
     except Exception as e:
-        window.write_event_value('-LOG-', f"An unexpected error occurred: {e}")
+        log.append(f"An unexpected error occurred: {e}")
     finally:
-        window.write_event_value('-DONE-', None)
+        window.write_event_value('-DONE-', message)
+
+def format_clock(seconds):
+    """Formats seconds as m:ss, or h:mm:ss from an hour up."""
+    seconds = int(round(seconds))
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{seconds:02d}"
+    return f"{minutes}:{seconds:02d}"
+
+def flush_log(window, lines, log):
+    """Moves pending log lines into the widget in one update, keeping at most MAX_LOG_LINES."""
+    new_lines = []
+    while log:
+        new_lines.append(log.popleft())
+    if not new_lines:
+        return
+    overflow = len(lines) + len(new_lines) > MAX_LOG_LINES
+    lines.extend(new_lines)
+    if overflow:
+        window['-LOG-'].update('\n'.join(lines) + '\n')
+    else:
+        window['-LOG-'].update('\n'.join(new_lines) + '\n', append=True)
+
+def show_progress(window, job, started, jobs):
+    """Updates the progress bar and the status line (segments, speed, ETA) from the job."""
+    progress = dict(job.progress)
+    total = progress.get('segmentsTotal')
+    duration = progress.get('duration')
+    if not total or not duration:
+        return
+    done = progress.get('segmentsDone', 0)
+    fraction = done / total
+    # A single ffmpeg pass reports its exact position; parallel passes only count segments
+    if jobs == 1 and progress.get('position') is not None:
+        fraction = max(fraction, min(progress['position'] / duration, 1.0))
+    window['-PROGRESS-'].update(current_count=int(fraction * 1000))
+
+    elapsed = time.monotonic() - started
+    status = f"{done}/{total} segments ({fraction:.0%})"
+    if fraction > 0 and elapsed > 0:
+        speed = fraction * duration / elapsed
+        remaining = elapsed * (1 - fraction) / fraction
+        status += f" - {speed:.1f}x realtime - ETA {format_clock(remaining)}"
+    window['-STATUS-'].update(status)
 
 def main():
     sg.theme('SystemDefault')
@@ -119,24 +142,42 @@ def main():
         [sg.Input(key='-FILE-', enable_events=True), sg.FileBrowse(file_types=(("MP3 Files", "*.mp3"),))],
         [sg.Text("Segment Length (seconds):")],
         [sg.Input("30", key='-LENGTH-')],
+        [sg.Text("Parallel Jobs:")],
+        [sg.Input(str(os.cpu_count() or 1), key='-JOBS-')],
         [sg.Text("Output Folder:")],
         [sg.Input(key='-FOLDER-'), sg.FolderBrowse()],
-        [sg.Button("Start Split"), sg.Button("Exit")],
+        [sg.Button("Start Split"), sg.Button("Cancel", disabled=True), sg.Button("Exit")],
+        [sg.ProgressBar(1000, orientation='h', size=(40, 15), key='-PROGRESS-')],
+        [sg.Text("", size=(60, 1), key='-STATUS-')],
         [sg.Multiline(size=(60, 15), key='-LOG-', autoscroll=True, disabled=True)]
     ]
 
     window = sg.Window("MP3 Splitter Tool", layout)
+    job = None
+    log = deque()
+    lines = deque(maxlen=MAX_LOG_LINES)
+    started = 0
+    jobs = 1
 
     while True:
-        event, values = window.read()
+        # Poll on a timer only while a split runs; otherwise just wait for input
+        event, values = window.read(timeout=PROGRESS_INTERVAL_MS if job is not None else None)
 
         if event == sg.WIN_CLOSED or event == "Exit":
+            if job is not None:
+                job.cancel()
             break
 
+        if event == "Cancel" and job is not None:
+            job.cancel()
+            window['Cancel'].update(disabled=True)
+            log.append("Cancelling...")
+
         if event == "Start Split":
             input_file = values['-FILE-']
             output_dir = values['-FOLDER-']
             length_str = values['-LENGTH-']
+            jobs_str = values['-JOBS-']
 
             if not input_file:
                 sg.popup_error("Please select an input file.")
@@ -154,18 +195,36 @@ def main():
                 sg.popup_error("Segment length must be a positive number.")
                 continue
 
+            try:
+                jobs = int(jobs_str)
+                if jobs < 1:
+                    raise ValueError
+            except ValueError:
+                sg.popup_error("Parallel jobs must be a positive whole number.")
+                continue
+
             window['-LOG-'].update("") # Clear log
+            lines.clear()
+            window['-PROGRESS-'].update(current_count=0)
+            window['-STATUS-'].update("")
             window['Start Split'].update(disabled=True)
-            
+            window['Cancel'].update(disabled=False)
+
             # Start thread
-            threading.Thread(target=split_mp3_thread, args=(window, input_file, segment_length, output_dir), daemon=True).start()
+            job = Job('split')
+            started = time.monotonic()
+            threading.Thread(target=split_mp3_thread, args=(window, job, log, input_file, segment_length, output_dir, jobs), daemon=True).start()
+
+        if job is not None:
+            flush_log(window, lines, log)
+            show_progress(window, job, started, jobs)
 
-        if event == '-LOG-':
-            window['-LOG-'].update(values[event] + '\n', append=True)
-        
         if event == '-DONE-':
+            flush_log(window, lines, log)
+            job = None
             window['Start Split'].update(disabled=False)
-            sg.popup("Processing Complete!")
+            window['Cancel'].update(disabled=True)
+            sg.popup(values[event])
 
     window.close()
 
@@ -0,0 +1,148 @@
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import time
+import uuid
+
+from media_probe import CACHE_DIR
+from sqlite_store import ThreadLocalDB
+
+SEGMENT_DIR = os.path.join(CACHE_DIR, 'segments')
+SEGMENT_DB_PATH = os.path.join(CACHE_DIR, 'segments.sqlite3')
+
+# Disk budget of cached segments (override with CUTFILE_SEGMENT_CACHE_MB)
+MAX_CACHE_BYTES = int(float(os.environ.get('CUTFILE_SEGMENT_CACHE_MB', 2048)) * 1024 * 1024)
+# Eviction frees down to this fraction of the budget, so it does not run on every store
+EVICT_TARGET = 0.9
+# Bump when cutting changes in a way that makes older cached bytes wrong
+CACHE_FORMAT_VERSION = 1
+
+def _migrate(conn):
+    """Adds mtime_ns to caches from before it was recorded; their rows miss and are cut again."""
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(segment_cache)')}
+    if 'mtime_ns' not in columns:
+        conn.execute('ALTER TABLE segment_cache ADD COLUMN mtime_ns INTEGER NOT NULL DEFAULT 0')
+
+
+# A read-only or broken cache must never stop exporting
+_db = ThreadLocalDB(SEGMENT_DB_PATH, (
+    'CREATE TABLE IF NOT EXISTS segment_cache ('
+    ' key TEXT PRIMARY KEY,'
+    ' size INTEGER NOT NULL,'
+    ' last_used REAL NOT NULL,'
+    ' mtime_ns INTEGER NOT NULL DEFAULT 0)',
+    'CREATE INDEX IF NOT EXISTS segment_cache_last_used ON segment_cache(last_used)',
+), _migrate)
+
+
+def segment_key(input_file, start, end, options):
+    """Content address of a cut: input identity (path, size, mtime), range and codec options."""
+    st = os.stat(input_file)
+    identity = [os.path.abspath(input_file), st.st_size, st.st_mtime_ns,
+                round(float(start), 6), round(float(end), 6), options, CACHE_FORMAT_VERSION]
+    return hashlib.sha256(json.dumps(identity, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def _blob_path(key):
+    return os.path.join(SEGMENT_DIR, key[:2], key + '.mp3')
+
+
+def _link_or_copy(src, dst):
+    """Places src at dst atomically, as a hard link when the filesystem allows it."""
+    try:
+        if os.path.samefile(src, dst):
+            return  # already linked; rename() would leave the temp name behind
+    except OSError:
+        pass
+    temp_path = f"{dst}.{uuid.uuid4().hex[:8]}.tmp"
+    try:
+        os.link(src, temp_path)
+    except OSError:
+        shutil.copyfile(src, temp_path)
+    os.replace(temp_path, dst)
+
+
+def fetch(key, output_path):
+    """Materialises a cached segment at output_path; returns False on a miss.
+
+    Exports are hard links to the blobs, so editing an exported file in
+    place (e.g. retagging it) changes the blob too. A blob whose size or
+    mtime differs from when it was stored is therefore dropped, never served.
+    """
+    conn = _db.connect()
+    if conn is None:
+        return False
+    try:
+        row = conn.execute('SELECT size, mtime_ns FROM segment_cache WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return False
+        blob = _blob_path(key)
+        try:
+            st = os.stat(blob)
+            valid = (st.st_size, st.st_mtime_ns) == tuple(row)
+        except OSError:
+            valid = False
+        if not valid:
+            try:
+                os.remove(blob)  # only the cache's name; an edited export keeps its own
+            except OSError:
+                pass
+            conn.execute('DELETE FROM segment_cache WHERE key = ?', (key,))
+            conn.commit()
+            return False
+        _link_or_copy(blob, output_path)
+        conn.execute('UPDATE segment_cache SET last_used = ? WHERE key = ?', (time.time(), key))
+        conn.commit()
+        return True
+    except (OSError, sqlite3.Error):
+        return False
+
+
+def store(key, output_path):
+    """Adds a freshly cut segment to the cache (linked, not copied, where possible)."""
+    conn = _db.connect()
+    if conn is None:
+        return
+    try:
+        blob = _blob_path(key)
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        _link_or_copy(output_path, blob)
+        st = os.stat(blob)
+        conn.execute('INSERT OR REPLACE INTO segment_cache (key, size, last_used, mtime_ns) VALUES (?, ?, ?, ?)',
+                     (key, st.st_size, time.time(), st.st_mtime_ns))
+        conn.commit()
+        _evict(conn)
+    except (OSError, sqlite3.Error):
+        pass
+
+
+def _evict(conn):
+    """Drops least recently used segments until the cache fits its budget again."""
+    total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM segment_cache').fetchone()[0]
+    if total <= MAX_CACHE_BYTES:
+        return
+    target = MAX_CACHE_BYTES * EVICT_TARGET
+    for key, size in conn.execute('SELECT key, size FROM segment_cache ORDER BY last_used').fetchall():
+        if total <= target:
+            break
+        try:
+            os.remove(_blob_path(key))
+        except OSError:
+            pass
+        conn.execute('DELETE FROM segment_cache WHERE key = ?', (key,))
+        total -= size
+    conn.commit()
+
+
+def release_output(output_path):
+    """Unlinks an existing output before it is rewritten.
+
+    Outputs may be hard links to cache blobs; writing into them in place
+    (ffmpeg -y, open(..., 'wb')) would silently change the cached bytes.
+    """
+    try:
+        os.remove(output_path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,114 @@
+from waveform import WaveformError, iter_pcm
+
+# Audio is analysed as mono s16 at this rate; speech pauses survive it fine
+ANALYSIS_SAMPLE_RATE = 8000
+# RMS window length; silences are located to this resolution
+WINDOW_MS = 20
+# Windows quieter than this (dBFS) count as silence
+DEFAULT_THRESHOLD_DB = -40.0
+# Shortest pause considered a cut candidate, in seconds
+DEFAULT_MIN_SILENCE = 0.5
+# Segments never get shorter than this fraction of the target length
+MIN_SEGMENT_FRACTION = 0.5
+
+# Floor used instead of log10(0) for digital silence
+_SILENCE_FLOOR_DB = -120.0
+
+
+class SilenceError(Exception):
+    """Raised when audio cannot be analysed for silence."""
+
+
+def window_levels(input_file, window_ms=WINDOW_MS):
+    """Decodes input_file once and returns the RMS level (dBFS) of every window.
+
+    PCM is consumed chunk by chunk, so memory holds one decode chunk plus
+    one float32 per window (about 0.7 MB per hour at 20 ms).
+    """
+    try:
+        import numpy as np
+    except ImportError:
+        raise SilenceError('NumPy is required for audio analysis (pip install numpy)')
+
+    window = ANALYSIS_SAMPLE_RATE * window_ms // 1000
+    levels = []
+    carry = np.empty(0, dtype='<i2')
+    for chunk in iter_pcm(input_file, ANALYSIS_SAMPLE_RATE):
+        if carry.size:
+            chunk = np.concatenate((carry, chunk))
+        usable = chunk.size // window * window
+        if usable:
+            frames = chunk[:usable].reshape(-1, window).astype(np.float32)
+            levels.append(np.sqrt(np.mean(frames * frames, axis=1)))
+        carry = chunk[usable:]
+    if carry.size:
+        tail = carry.astype(np.float32)
+        levels.append(np.array([np.sqrt(np.mean(tail * tail))], dtype=np.float32))
+    if not levels:
+        return np.zeros(0, dtype=np.float32)
+
+    rms = np.concatenate(levels) / 32768.0
+    with np.errstate(divide='ignore'):
+        db = 20 * np.log10(rms)
+    return np.maximum(db, _SILENCE_FLOOR_DB).astype(np.float32)
+
+
+def find_silences(levels, threshold_db=DEFAULT_THRESHOLD_DB, min_silence=DEFAULT_MIN_SILENCE, window_ms=WINDOW_MS):
+    """Returns (start, end) seconds of every run of quiet windows lasting at least min_silence."""
+    import numpy as np
+
+    quiet = np.concatenate(([False], levels < threshold_db, [False]))
+    edges = np.flatnonzero(quiet[1:] != quiet[:-1])
+    starts, ends = edges[0::2], edges[1::2]
+    min_windows = max(1, int(round(min_silence * 1000 / window_ms)))
+    keep = (ends - starts) >= min_windows
+    step = window_ms / 1000.0
+    return [(float(s * step), float(e * step)) for s, e in zip(starts[keep], ends[keep])]
+
+
+def propose_cuts(silences, duration, segment_length, search_window=None):
+    """Picks one cut per target length, preferring the middle of a nearby silence.
+
+    Targets are measured from the previous cut, so a cut moved by a pause
+    does not drift the rest of the plan. When no silence lies within
+    search_window seconds of a target, the cut falls back to the target itself.
+    """
+    if search_window is None:
+        search_window = segment_length / 4
+    min_length = segment_length * MIN_SEGMENT_FRACTION
+    points = [(s + e) / 2 for s, e in silences]
+
+    cuts = []
+    last = 0.0
+    i = 0
+    while duration - last > segment_length:
+        target = last + segment_length
+        while i < len(points) and points[i] < last + min_length:
+            i += 1
+        best = None
+        j = i
+        while j < len(points) and points[j] <= target + search_window:
+            if abs(points[j] - target) <= search_window and (best is None or abs(points[j] - target) < abs(best - target)):
+                best = points[j]
+            j += 1
+        cut = best if best is not None else target
+        # Never leave a tail shorter than the minimum behind
+        if duration - cut < min_length:
+            break
+        cuts.append(cut)
+        last = cut
+    return cuts
+
+
+def detect_segments(input_file, duration, segment_length, threshold_db=DEFAULT_THRESHOLD_DB,
+                    min_silence=DEFAULT_MIN_SILENCE, search_window=None):
+    """Returns (segments, silence count), segments being (start, end) tuples cut at pauses."""
+    if segment_length <= 0:
+        raise ValueError('Segment length must be greater than 0')
+    try:
+        levels = window_levels(input_file)
+    except WaveformError as e:
+        raise SilenceError(str(e))
+    silences = find_silences(levels, threshold_db, min_silence)
+    bounds = [0.0] + propose_cuts(silences, duration, segment_length, search_window) + [duration]
+    return [(start, end) for start, end in zip(bounds, bounds[1:]) if end > start], len(silences)
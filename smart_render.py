@@ -0,0 +1,292 @@
+import bisect
+import os
+import shutil
+import tempfile
+from contextlib import ExitStack
+
+import mp3_frames
+from loudness import encode_options
+from media_probe import ProbeError, probe
+from split_engine import run_ffmpeg
+
+# Longest crossfade accepted by the API, in seconds
+MAX_CROSSFADE_SECONDS = 30.0
+# Samples between LAME's encoder input and decoder output (576 encoder + 529 decoder delay)
+LAME_DELAY = 1105
+# Decoder delay alone, assumed for inputs without a LAME/Lavc gapless tag
+DECODER_DELAY = 529
+# Frames decoded ahead of a window so the bit reservoir and the filterbank are primed
+PREROLL_FRAMES = 10
+# Whole frames re-encoded on either side of a fade, so both splices sit in steady audio
+GUARD_FRAMES = 2
+# Frames tried after a window for one whose main data can be made self-contained
+MAX_JUNCTION_FRAMES = 32
+
+
+class _Input:
+    """One mapped input and where its real audio lies in its decoded frames.
+
+    Decoded sample n is sample n of a decode of the bare frames, which
+    ffmpeg returns untrimmed; the audio without encoder delay and padding
+    spans delay:end.
+    """
+
+    def __init__(self, path, mapped):
+        self.path = path
+        self.index = mapped.index
+        self.data = mapped.data
+        self.frames = self.index.frame_count
+        vbr = self.index.vbr_header or {}
+        delay = vbr.get('encoder_delay')
+        self.delay = DECODER_DELAY + (delay or 0)
+        self.end = self.frames * self.index.samples_per_frame + DECODER_DELAY - (vbr.get('encoder_padding') or 0)
+
+
+class _Boundary:
+    """Frame plan of one transition; frame numbers are output frames unless noted."""
+
+    def __init__(self, left, right, left_start, right_start, fade, first, last, junction, junction_frame):
+        self.left = left
+        self.right = right
+        self.left_start = left_start  # output frame of the left input's frame 0
+        self.right_start = right_start  # output frame of the right input's frame 0
+        self.fade = fade  # overlap in samples
+        self.first = first  # first re-encoded frame
+        self.last = last  # first frame after the window: the right input's junction frame
+        self.junction = junction  # that frame, numbered within the right input
+        self.junction_frame = junction_frame  # its self-contained bytes
+        self.frames = None  # re-encoded frames, once rendered
+
+
+def _plan(inputs, fade_samples):
+    """Places every input on the output frame grid and picks the window around each boundary.
+
+    The right input of a boundary starts where the left one's audio ends,
+    minus the fade. The fade is rounded up (by less than one frame) so
+    that the right input's frames land on the output grid and can be
+    copied as they are. Raises Mp3FormatError when a file is too short
+    for its windows; the caller then re-encodes everything instead.
+    """
+    spf = inputs[0].index.samples_per_frame
+    boundaries = []
+    start = 0
+    head = 0  # frames of the current input already covered by the previous window
+    for k in range(len(inputs) - 1):
+        left, right = inputs[k], inputs[k + 1]
+        audio_end = start * spf + left.end
+        fade = fade_samples + (audio_end - fade_samples - right.delay) % spf
+        right_start = (audio_end - fade - right.delay) // spf
+        first = (audio_end - fade) // spf - GUARD_FRAMES
+        if first <= start + head or right_start < 0:
+            raise mp3_frames.Mp3FormatError(f"{os.path.basename(left.path)} is too short for the crossfade")
+
+        junction = -(-(right.delay + fade) // spf) + GUARD_FRAMES
+        junction_frame = None
+        # A junction frame needs one more frame after it for the window's lookahead
+        limit = min(junction + MAX_JUNCTION_FRAMES, right.frames - 2)
+        while junction < limit:
+            junction_frame = mp3_frames.self_contained_frame(right.data, right.index.offsets, junction)
+            if junction_frame is not None:
+                break
+            junction += 1
+        if junction_frame is None:
+            raise mp3_frames.Mp3FormatError(f"No frame of {os.path.basename(right.path)} can start a copy")
+
+        boundaries.append(_Boundary(left, right, start, right_start, fade, first, right_start + junction,
+                                    junction, junction_frame))
+        start = right_start
+        head = junction + 1
+    return boundaries
+
+
+def _write_frames(path, source, first, last):
+    """Writes frames first:last of an input as a bare MP3 stream (no tags, no Xing frame)."""
+    offsets = source.index.offsets
+    with open(path, 'wb') as out:
+        out.write(source.data[offsets[first]:offsets[last]])
+
+
+def _render(boundary, work_dir, encode, job=None):
+    """Re-encodes the frames of one window; returns ffmpeg's error text, or None once boundary.frames is set.
+
+    The PCM fed to LAME starts LAME_DELAY samples after the output frame
+    before the window, so that frame absorbs the encoder's start-up and
+    every following encoded frame decodes to exactly the samples of the
+    output frame it replaces.
+    """
+    left, right = boundary.left, boundary.right
+    spf = left.index.samples_per_frame
+    pcm_start = (boundary.first - 1) * spf + LAME_DELAY
+    pcm_end = (boundary.last + 1) * spf + LAME_DELAY
+
+    # Left side, in the left input's samples: up to the end of its audio
+    left_offset = boundary.left_start * spf
+    left_first = max(0, (pcm_start - left_offset) // spf - PREROLL_FRAMES)
+    left_path = os.path.join(work_dir, 'left.mp3')
+    _write_frames(left_path, left, left_first, left.frames)
+    left_trim = (pcm_start - left_offset - left_first * spf, left.end - left_first * spf)
+
+    # Right side, in the right input's samples: from the start of its audio
+    right_offset = boundary.right_start * spf
+    right_frames = min(right.frames, -(-(pcm_end - right_offset) // spf) + 1)
+    right_path = os.path.join(work_dir, 'right.mp3')
+    _write_frames(right_path, right, 0, right_frames)
+    right_trim = (right.delay, pcm_end - right_offset)
+
+    trims = [f"[{i}:a]atrim=start_sample={begin}:end_sample={end},asetpts=N/SR/TB"
+             for i, (begin, end) in enumerate((left_trim, right_trim))]
+    fade = boundary.fade
+    if fade:
+        # acrossfade with the same linear curves, built from filters that do not drop output on short inputs
+        overlap_at = left_trim[1] - left_trim[0] - fade
+        parts = [f"{trims[0]},afade=t=out:ss={overlap_at}:ns={fade}[s0]",
+                 f"{trims[1]},afade=t=in:ns={fade},adelay={overlap_at}S:all=1[s1]",
+                 "[s0][s1]amix=inputs=2:duration=longest:normalize=0[out]"]
+    else:
+        parts = [f"{trims[0]}[s0]", f"{trims[1]}[s1]", "[s0][s1]concat=n=2:v=0:a=1[out]"]
+
+    window_path = os.path.join(work_dir, 'window.mp3')
+    cmd = ['ffmpeg', '-y', '-v', 'error', '-f', 'mp3', '-i', left_path, '-f', 'mp3', '-i', right_path,
+           '-filter_complex', ';'.join(parts), '-map', '[out]', '-map_metadata', '-1',
+           '-c:a', 'libmp3lame'] + encode + [
+           '-ar', str(left.index.sample_rate), '-ac', str(left.index.channels),
+           # No reservoir: the kept frames must not lean on the frame that is dropped
+           '-reservoir', '0', '-write_xing', '0', '-id3v2_version', '0', '-f', 'mp3', window_path]
+    error = run_ffmpeg(cmd, job)
+    if error is not None:
+        return error
+
+    with open(window_path, 'rb') as f:
+        data = f.read()
+    index = mp3_frames.scan_frames(data, window_path)
+    count = boundary.last - boundary.first
+    if index.frame_count < count + 1 or mp3_frames.stream_key(index) != mp3_frames.stream_key(left.index):
+        raise mp3_frames.Mp3FormatError('The re-encoded window does not fit the stream')
+    frames = []
+    for i in range(1, count + 1):
+        frame = mp3_frames.self_contained_frame(data, index.offsets, i) if i == 1 else \
+            bytes(data[index.offsets[i]:index.offsets[i + 1]])
+        if frame is None:
+            raise mp3_frames.Mp3FormatError('The re-encoded window does not fit the stream')
+        frames.append(frame)
+    boundary.frames = frames
+    return None
+
+
+def _pieces(inputs, boundaries):
+    """The output as a list of pieces: ('copy', input, first frame, end frame) or ('frames', [bytes])."""
+    pieces = []
+    head = 0
+    for k, source in enumerate(inputs):
+        if k < len(boundaries):
+            boundary = boundaries[k]
+            pieces.append(('copy', source, head, boundary.first - boundary.left_start))
+            pieces.append(('frames', boundary.frames + [boundary.junction_frame]))
+            head = boundary.junction + 1
+        else:
+            pieces.append(('copy', source, head, source.frames))
+    return [piece for piece in pieces if piece[0] == 'frames' or piece[3] > piece[2]]
+
+
+def _xing_frame(inputs, pieces):
+    """A Xing frame counting every output frame, with a TOC over all pieces."""
+    first_frames = []
+    first_bytes = []
+    frame_count = audio_bytes = 0
+    for piece in pieces:
+        first_frames.append(frame_count)
+        first_bytes.append(audio_bytes)
+        if piece[0] == 'copy':
+            _, source, first, end = piece
+            frame_count += end - first
+            audio_bytes += source.index.offsets[end] - source.index.offsets[first]
+        else:
+            frame_count += len(piece[1])
+            audio_bytes += sum(len(frame) for frame in piece[1])
+
+    def frame_position(frame):
+        i = bisect.bisect_right(first_frames, frame) - 1
+        piece = pieces[i]
+        offset = frame - first_frames[i]
+        if piece[0] == 'copy':
+            offsets = piece[1].index.offsets
+            return first_bytes[i] + offsets[piece[2] + offset] - offsets[piece[2]]
+        return first_bytes[i] + sum(len(f) for f in piece[1][:offset])
+
+    return mp3_frames.make_xing_frame(inputs[0].index.header, False, frame_count, audio_bytes, frame_position)
+
+
+def join_files(input_files, output_path, crossfade=0.0, job=None):
+    """Joins MP3 files with a crossfade, re-encoding only a few frames around each boundary.
+
+    The interior frames of every input are copied as they are. Around each
+    boundary a window of about crossfade + 5 frames is decoded from the
+    inputs' own frames, faded (crossfade seconds, 0 for a gapless join
+    that only drops the encoder delay and padding) and encoded again with
+    LAME. The first copied frame after a window is repacked so it does not
+    depend on the bit reservoir of the frames it replaced. Work therefore
+    grows with the number of boundaries, not with the total length.
+    A gapless join overlaps the files by less than one frame (26 ms at
+    44.1 kHz) so the frames stay on their grid.
+
+    Returns ffmpeg's error text on failure and None on success. Raises
+    mp3_frames.Mp3FormatError when an input is not a Layer III MP3, the
+    inputs differ in format, or a file is too short for its windows.
+    """
+    with ExitStack() as stack:
+        inputs = [_Input(path, stack.enter_context(mp3_frames.MappedMp3(path))) for path in input_files]
+        if not inputs:
+            raise mp3_frames.Mp3FormatError('No input files')
+        key = mp3_frames.stream_key(inputs[0].index)
+        for source in inputs[1:]:
+            if mp3_frames.stream_key(source.index) != key:
+                raise mp3_frames.Mp3FormatError(f"{os.path.basename(source.path)} does not match the format of "
+                                                f"{os.path.basename(inputs[0].path)}")
+
+        boundaries = _plan(inputs, int(round(crossfade * inputs[0].index.sample_rate)))
+        try:
+            encode = encode_options(probe(input_files[0]))
+        except ProbeError:
+            encode = encode_options({})
+
+        if job is not None:
+            job.update(stage='render', boundariesDone=0, boundariesTotal=len(boundaries))
+        work_dir = tempfile.mkdtemp(prefix='cutfile_crossfade_')
+        try:
+            for done, boundary in enumerate(boundaries, 1):
+                error = _render(boundary, work_dir, encode, job)
+                if error is not None:
+                    return error
+                if job is not None:
+                    job.update(boundariesDone=done)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+        pieces = _pieces(inputs, boundaries)
+        spf = inputs[0].index.samples_per_frame
+        total = sum(len(p[1]) if p[0] == 'frames' else p[3] - p[2] for p in pieces)
+        if job is not None:
+            job.update(stage='join', position=0, totalSeconds=total * spf / inputs[0].index.sample_rate)
+
+        written = 0
+        with open(output_path, 'wb', buffering=0) as out:
+            if inputs[0].index.tag_size:
+                out.write(inputs[0].data[:inputs[0].index.tag_size])
+            out.write(_xing_frame(inputs, pieces))
+            for piece in pieces:
+                if piece[0] == 'copy':
+                    _, source, first, end = piece
+                    offsets = source.index.offsets
+                    with open(source.path, 'rb', buffering=0) as src:
+                        if os.fstat(src.fileno()).st_size < offsets[end]:
+                            raise mp3_frames.Mp3FormatError(f"{os.path.basename(source.path)} changed while joining")
+                        mp3_frames.copy_range(src.fileno(), out.fileno(), offsets[first],
+                                              offsets[end] - offsets[first])
+                    written += end - first
+                else:
+                    out.write(b''.join(piece[1]))
+                    written += len(piece[1])
+                if job is not None:
+                    job.check_cancelled()
+                    job.update(position=written * spf / inputs[0].index.sample_rate)
+    return None
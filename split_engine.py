@@ -0,0 +1,446 @@
+import contextvars
+import os
+import random
+import string
+import subprocess
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+import mp3_frames
+
+# Upper bound on outputs handled by one ffmpeg process when segments cannot
+# be written by the segment muxer (keeps the command line under Windows' limit).
+MAX_OUTPUTS_PER_PASS = 64
+
+# Cutting backends selectable per call; 'auto' prefers native for MP3 input
+BACKENDS = ('ffmpeg', 'native', 'auto')
+
+# Bytes read at a time from an ffmpeg stdout pipe
+PIPE_CHUNK_SIZE = 256 * 1024
+
+# Two boundaries closer than this are considered the same cut point.
+TIME_EPSILON = 0.001
+
+
+def get_startupinfo():
+    """Returns a STARTUPINFO that hides the console window on Windows, None elsewhere."""
+    startupinfo = None
+    if os.name == 'nt':
+        startupinfo = subprocess.STARTUPINFO()
+        startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+    return startupinfo
+
+
+def output_codec_options(input_file):
+    """ffmpeg output options for MP3 segments of input_file: a stream copy for MP3, a LAME encode otherwise.
+
+    The outputs are always .mp3 files, which cannot hold a copied AAC or
+    Vorbis stream. When the input cannot be probed the copy is tried and
+    ffmpeg reports the problem.
+    """
+    # Imported here: both modules import this one
+    from loudness import encode_options
+    from media_probe import ProbeError, probe
+    try:
+        info = probe(input_file)
+    except ProbeError:
+        return ['-c', 'copy']
+    if info.get('codec') == 'mp3':
+        return ['-c', 'copy']
+    return ['-c:a', 'libmp3lame'] + encode_options(info)
+
+
+def get_random_string(length=5):
+    """Generates a random string of fixed length using lowercase letters and digits."""
+    letters_and_digits = string.ascii_lowercase + string.digits
+    return ''.join(random.choice(letters_and_digits) for i in range(length))
+
+
+def reserve_output_path(output_dir, index):
+    """Claims a unique '<index>_<rand5>.mp3' path in output_dir.
+
+    The name is taken by creating an empty placeholder with O_EXCL, so
+    concurrent splitters writing into the same folder never pick the same
+    name. Use discard_placeholder when the segment could not be written.
+    """
+    while True:
+        output_path = os.path.join(output_dir, f"{index}_{get_random_string()}.mp3")
+        try:
+            with open(output_path, 'x'):
+                return output_path
+        except FileExistsError:
+            continue
+
+
+def discard_placeholder(output_path):
+    """Removes a reserved output path that was never written."""
+    try:
+        if os.path.getsize(output_path) == 0:
+            os.remove(output_path)
+    except OSError:
+        pass
+
+
+def build_fixed_segments(duration, segment_length):
+    """Returns (start, end) pairs covering the duration in segment_length steps."""
+    num_segments = int(duration // segment_length) + (1 if duration % segment_length > 0 else 0)
+    return [(i * segment_length, min((i + 1) * segment_length, duration)) for i in range(num_segments)]
+
+
+def is_contiguous(segments):
+    """True when segments are ordered back-to-back in one folder (segment muxer case)."""
+    if len({os.path.dirname(os.path.abspath(seg['path'])) for seg in segments}) != 1:
+        return False
+    for prev, cur in zip(segments, segments[1:]):
+        if abs(cur['start'] - prev['end']) > TIME_EPSILON:
+            return False
+    return True
+
+
+def _parse_progress(stream, on_time):
+    """Reads ffmpeg -progress key=value lines and reports the output time in seconds."""
+    for line in stream:
+        key, _, value = line.strip().partition('=')
+        if key == 'out_time_us' and value.isdigit() and on_time is not None:
+            on_time(int(value) / 1_000_000)
+
+
+def run_ffmpeg(cmd, job=None, on_time=None):
+    """Runs an ffmpeg command and returns stderr text on failure, None on success.
+
+    With a job (see jobs.Job) the process is registered so cancelling the
+    job kills it, and on_time is called with the output position parsed
+    from ffmpeg's -progress stream. Raises jobs.JobCancelled on cancel.
+    """
+    if job is None:
+        try:
+            metrics.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, startupinfo=get_startupinfo())
+            return None
+        except subprocess.CalledProcessError as e:
+            return e.stderr.decode(errors='replace') if e.stderr else 'Unknown error'
+        except FileNotFoundError:
+            return 'ffmpeg not found. Please ensure ffmpeg is installed and in your PATH.'
+
+    job.check_cancelled()
+    cmd = cmd[:1] + ['-nostats', '-progress', 'pipe:1'] + cmd[1:]
+    try:
+        proc = metrics.popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+                            errors='replace', startupinfo=get_startupinfo())
+    except FileNotFoundError:
+        return 'ffmpeg not found. Please ensure ffmpeg is installed and in your PATH.'
+
+    job.track(proc)
+    try:
+        # stderr is drained on a side thread so a chatty ffmpeg cannot block on a full pipe
+        stderr_lines = []
+        drain = threading.Thread(target=lambda: stderr_lines.extend(proc.stderr), daemon=True)
+        drain.start()
+        _parse_progress(proc.stdout, on_time)
+        proc.wait()
+        drain.join()
+    finally:
+        job.untrack(proc)
+
+    job.check_cancelled()
+    if proc.returncode != 0:
+        return ''.join(stderr_lines[-50:]) or 'Unknown error'
+    return None
+
+
+def _report_segments(job, segments, offset=0.0):
+    """Returns an on_time callback that reports how many segments ffmpeg has passed."""
+    ends = [seg['end'] for seg in segments]
+    total = len(segments)
+
+    def on_time(seconds):
+        position = offset + seconds
+        job.update(segmentsDone=sum(1 for end in ends if end <= position + TIME_EPSILON),
+                   segmentsTotal=total, position=position)
+    return on_time
+
+
+def _split_with_segment_muxer(input_file, segments, job=None, seek=False):
+    """Cuts two or more back-to-back segments with one ffmpeg process using the segment muxer.
+
+    With seek the input is opened at the first segment's start instead of
+    being read from byte 0 (used by parallel chunks).
+    """
+    first_start = segments[0]['start']
+    last_end = segments[-1]['end']
+    output_dir = os.path.dirname(os.path.abspath(segments[0]['path']))
+    temp_prefix = f".split_{uuid.uuid4().hex[:12]}_"
+    temp_pattern = os.path.join(output_dir, temp_prefix + '%06d.mp3')
+
+    # segment_times are relative to the output timeline, which starts at first_start
+    boundaries = [seg['start'] - first_start for seg in segments[1:]]
+
+    offset = first_start if seek else 0
+
+    cmd = ['ffmpeg', '-y', '-v', 'error']
+    if offset > 0:
+        cmd += ['-ss', str(offset)]
+    cmd += ['-i', input_file, '-map', '0:a'] + output_codec_options(input_file) + [
+        '-ss', str(first_start - offset),
+        '-to', str(last_end - offset),
+        '-f', 'segment',
+        '-reset_timestamps', '1',
+    ]
+    cmd += ['-segment_times', ','.join(f"{t:.6f}" for t in boundaries), temp_pattern]
+
+    on_time = None
+    if job is not None:
+        on_time = _report_segments(job, segments, first_start)
+    try:
+        error = run_ffmpeg(cmd, job, on_time)
+    except BaseException:
+        _remove_temp_files(output_dir, temp_prefix)
+        raise
+
+    results = []
+    for i, seg in enumerate(segments):
+        temp_path = temp_pattern % i
+        if error is None and os.path.exists(temp_path):
+            # Replaces the reserved placeholder, if any
+            os.replace(temp_path, seg['path'])
+            results.append((seg['path'], None))
+        else:
+            results.append((seg['path'], error or 'Segment contains no audio'))
+
+    # Leftovers only exist when ffmpeg failed part-way or cut an extra piece
+    _remove_temp_files(output_dir, temp_prefix)
+    return results
+
+
+def _remove_temp_files(output_dir, temp_prefix):
+    for name in os.listdir(output_dir):
+        if name.startswith(temp_prefix):
+            os.remove(os.path.join(output_dir, name))
+
+
+def _split_with_output_mapping(input_file, segments, job=None, seek=False):
+    """Cuts arbitrary segments with one ffmpeg process per batch of outputs.
+
+    With seek even the first batch opens the input at its start time.
+    """
+    results = {}
+    ordered = sorted(segments, key=lambda seg: seg['start'])
+    codec = output_codec_options(input_file)
+
+    for b in range(0, len(ordered), MAX_OUTPUTS_PER_PASS):
+        batch = ordered[b:b + MAX_OUTPUTS_PER_PASS]
+        # Later batches seek the input so no pass re-reads from byte 0
+        offset = batch[0]['start'] if b > 0 or seek else 0
+
+        cmd = ['ffmpeg', '-y', '-v', 'error']
+        if offset > 0:
+            cmd += ['-ss', str(offset)]
+        cmd += ['-i', input_file]
+        for seg in batch:
+            cmd += ['-map', '0:a'] + codec + [
+                '-ss', str(seg['start'] - offset),
+                '-to', str(seg['end'] - offset),
+                seg['path']
+            ]
+
+        on_time = None
+        if job is not None:
+            on_time = _report_segments(job, ordered, offset)
+        try:
+            error = run_ffmpeg(cmd, job, on_time)
+        except BaseException:
+            # A cancelled pass leaves truncated outputs behind
+            for seg in batch:
+                if os.path.exists(seg['path']):
+                    os.remove(seg['path'])
+            raise
+        for seg in batch:
+            results[id(seg)] = (seg['path'], error)
+
+    return [results[id(seg)] for seg in segments]
+
+
+class _ChunkJob:
+    """Forwards a job to one parallel chunk and sums segmentsDone across chunks."""
+
+    def __init__(self, job, counts, index, lock):
+        self._job = job
+        self._counts = counts
+        self._index = index
+        self._lock = lock
+
+    def check_cancelled(self):
+        self._job.check_cancelled()
+
+    def track(self, proc):
+        self._job.track(proc)
+
+    def untrack(self, proc):
+        self._job.untrack(proc)
+
+    def update(self, segmentsDone=0, segmentsTotal=None, **progress):
+        with self._lock:
+            self._counts[self._index] = segmentsDone
+            done = sum(self._counts)
+        self._job.update(segmentsDone=done, **progress)
+
+
+def _split_chunk(input_file, segments, job, seek):
+    # Without -segment_times the segment muxer would cut every segment_time (2 s by default)
+    if len(segments) > 1 and is_contiguous(segments):
+        return _split_with_segment_muxer(input_file, segments, job, seek)
+    return _split_with_output_mapping(input_file, segments, job, seek)
+
+
+def _split_parallel(input_file, segments, workers, job, seek=False):
+    """Splits segments in up to `workers` time-ordered chunks, one ffmpeg pass each."""
+    ordered = sorted(segments, key=lambda seg: seg['start'])
+    size = -(-len(ordered) // workers)
+    chunks = [ordered[i:i + size] for i in range(0, len(ordered), size)]
+
+    counts = [0] * len(chunks)
+    lock = threading.Lock()
+    results = {}
+    with ThreadPoolExecutor(max_workers=len(chunks)) as pool:
+        futures = []
+        for i, chunk in enumerate(chunks):
+            chunk_job = _ChunkJob(job, counts, i, lock) if job is not None else None
+            # Each chunk runs in a copy of the caller's context so a request trace follows it
+            futures.append(pool.submit(contextvars.copy_context().run,
+                                       _split_chunk, input_file, chunk, chunk_job, seek or i > 0))
+        # Wait for every chunk before re-raising, so no ffmpeg outlives the call
+        failure = None
+        for chunk, future in zip(chunks, futures):
+            try:
+                for seg, result in zip(chunk, future.result()):
+                    results[id(seg)] = result
+            except BaseException as e:
+                failure = failure or e
+        if failure is not None:
+            raise failure
+
+    return [results[id(seg)] for seg in segments]
+
+
+def split_segments(input_file, segments, backend='ffmpeg', job=None, workers=1, seek=False):
+    """Writes every segment of input_file while reading the input once.
+
+    segments is a list of dicts with 'start', 'end' (seconds) and 'path'.
+    backend is one of BACKENDS; 'native' and 'auto' cut MP3 input by frame
+    byte ranges and fall back to ffmpeg for anything else. Returns a list of
+    (path, error) tuples in the same order, where error is None for
+    segments that were created. Passing a job reports per-segment progress
+    and makes the split cancellable (see run_ffmpeg). With workers > 1 the
+    ffmpeg backend runs that many passes concurrently, each over its own
+    time-ordered chunk of segments. seek opens the input at the first
+    segment instead of reading it from byte 0, for callers that cut one
+    file in several calls.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown split backend: {backend}")
+
+    valid = []
+    invalid = {}
+    for seg in segments:
+        if seg['end'] - seg['start'] <= TIME_EPSILON:
+            invalid[id(seg)] = (seg['path'], 'End time must be greater than start time')
+        else:
+            valid.append(seg)
+
+    done = {}
+    if valid:
+        results = None
+        if backend != 'ffmpeg':
+            try:
+                progress = None
+                if job is not None:
+                    def progress(done):
+                        job.check_cancelled()
+                        job.update(segmentsDone=done, segmentsTotal=len(valid))
+                results = mp3_frames.split_segments(input_file, valid, progress)
+            except mp3_frames.Mp3FormatError:
+                results = None  # not a Layer III MP3, let ffmpeg handle it
+        if results is None:
+            if workers > 1 and len(valid) > 1:
+                results = _split_parallel(input_file, valid, min(workers, len(valid)), job, seek)
+            else:
+                results = _split_chunk(input_file, valid, job, seek)
+        for seg, result in zip(valid, results):
+            done[id(seg)] = result
+
+    return [invalid.get(id(seg)) or done[id(seg)] for seg in segments]
+
+
+def _iter_ffmpeg_segment(input_file, seg, errors, codec):
+    """Yields one segment as MP3 bytes piped from ffmpeg's stdout; codec as from output_codec_options."""
+    cmd = [
+        'ffmpeg',
+        '-v', 'error',
+        '-ss', str(seg['start']),
+        '-i', input_file,
+        '-t', str(seg['end'] - seg['start']),
+        '-map', '0:a'
+    ] + codec + ['-f', 'mp3', 'pipe:1']
+    try:
+        proc = metrics.popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, startupinfo=get_startupinfo())
+    except FileNotFoundError:
+        errors.append(f"{seg['path']}: ffmpeg not found. Please ensure ffmpeg is installed and in your PATH.")
+        return
+    finished = False
+    try:
+        while True:
+            chunk = proc.stdout.read(PIPE_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+        finished = True
+    finally:
+        # The consumer went away early (e.g. the download was aborted)
+        if not finished:
+            proc.kill()
+        stderr = proc.stderr.read()
+        proc.stdout.close()
+        proc.stderr.close()
+        proc.wait()
+    if proc.returncode != 0:
+        errors.append(f"{seg['path']}: {stderr.decode(errors='replace') or 'Unknown error'}")
+
+
+def stream_segments(input_file, segments, backend='auto', errors=None):
+    """Yields (segment, chunks) pairs without writing anything to disk.
+
+    Each segment is only cut while its chunks iterator is consumed, so a
+    caller can forward bytes as soon as they exist. MP3 input is sliced
+    from the frame index unless backend is 'ffmpeg'; otherwise ffmpeg pipes
+    each segment. Failures are appended to errors as strings.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown split backend: {backend}")
+    if errors is None:
+        errors = []
+
+    mapped = None
+    if backend != 'ffmpeg':
+        try:
+            mapped = mp3_frames.MappedMp3(input_file)
+        except mp3_frames.Mp3FormatError:
+            mapped = None  # not a Layer III MP3, let ffmpeg handle it
+
+    if mapped is not None:
+        with mapped:
+            for seg in segments:
+                try:
+                    start_frame, end_frame = mp3_frames.segment_frames(mapped.index, seg['start'], seg['end'])
+                except mp3_frames.Mp3FormatError as e:
+                    errors.append(f"{seg['path']}: {e}")
+                    continue
+                yield seg, mp3_frames.iter_segment_bytes(mapped.index, mapped.data, start_frame, end_frame)
+        return
+
+    codec = output_codec_options(input_file)
+    for seg in segments:
+        if seg['end'] - seg['start'] <= TIME_EPSILON:
+            errors.append(f"{seg['path']}: End time must be greater than start time")
+            continue
+        yield seg, _iter_ffmpeg_segment(input_file, seg, errors, codec)
@@ -0,0 +1,42 @@
+import os
+import sqlite3
+import threading
+
+
+class ThreadLocalDB:
+    """One SQLite connection per thread to a WAL-mode database file.
+
+    Used by the on-disk caches and the job store. schema is a sequence of
+    statements (CREATE TABLE/INDEX IF NOT EXISTS) run when a thread first
+    connects; migrate, if given, is then called with the connection to
+    upgrade older files. A database that cannot be opened (read-only
+    folder, broken file) is reported as None rather than raised, and the
+    thread does not try again.
+    """
+
+    def __init__(self, path, schema, migrate=None):
+        self.path = path
+        self.schema = tuple(schema)
+        self.migrate = migrate
+        self._local = threading.local()
+
+    def connect(self):
+        """Returns this thread's connection, or None when the database is unavailable."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None or getattr(self._local, 'failed', False):
+            return conn
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            for statement in self.schema:
+                conn.execute(statement)
+            if self.migrate is not None:
+                self.migrate(conn)
+            conn.commit()
+        except (OSError, sqlite3.Error):
+            self._local.failed = True
+            return None
+        self._local.conn = conn
+        return conn
@@ -3,18 +3,22 @@ let state = {
     duration: 0,
     segments: [],
     outputFolder: null,
-    playingIdx: null
+    playingIdx: null,
+    exportJobId: null
 };
 
 // DOM Elements
 const els = {
     inputFile: document.getElementById('input-file-path'),
     browseFileBtn: document.getElementById('browse-file-btn'),
+    uploadFileBtn: document.getElementById('upload-file-btn'),
+    uploadFileInput: document.getElementById('upload-file-input'),
     fileInfo: document.getElementById('file-info'),
     fileDuration: document.getElementById('file-duration'),
     segmentLength: document.getElementById('segment-length'),
     keepLockedCb: document.getElementById('keep-locked-cb'),
     generateBtn: document.getElementById('generate-segments-btn'),
+    silenceBtn: document.getElementById('silence-segments-btn'),
     segmentsList: document.getElementById('segments-list'),
     addSegmentBtn: document.getElementById('add-segment-btn'),
     clearSegmentsBtn: document.getElementById('clear-segments-btn'),
@@ -22,9 +26,30 @@ const els = {
     browseFolderBtn: document.getElementById('browse-folder-btn'),
     exportBtn: document.getElementById('export-btn'),
     exportZipBtn: document.getElementById('export-zip-btn'),
-    exportStatus: document.getElementById('export-status')
+    nativeCutCb: document.getElementById('native-cut-cb'),
+    normalizeCb: document.getElementById('normalize-cb'),
+    exportCancelBtn: document.getElementById('export-cancel-btn'),
+    exportStatus: document.getElementById('export-status'),
+    waveformPanel: document.getElementById('waveform-panel'),
+    waveformCanvas: document.getElementById('waveform-canvas'),
+    waveformZoomIn: document.getElementById('waveform-zoom-in'),
+    waveformZoomOut: document.getElementById('waveform-zoom-out'),
+    waveformScroll: document.getElementById('waveform-scroll'),
+    waveformRange: document.getElementById('waveform-range')
 };
 
+// Waveform view: only the visible window is fetched, at a zoom level picked by the server
+const waveform = {
+    start: 0,
+    span: 0,
+    requestId: 0,
+    peaks: null,
+    bucketMs: 0,
+    firstBucket: 0
+};
+
+const MIN_WAVEFORM_SPAN = 2; // seconds
+
 // Utils
 function formatTime(seconds) {
     const h = Math.floor(seconds / 3600);
@@ -45,6 +70,36 @@ function getBaseFilename() {
     return filename.replace(/\.[^/.]+$/, ''); // Remove extension
 }
 
+function formatPercent(done, total) {
+    if (!total) return '';
+    return ` (${Math.min(100, Math.floor(done / total * 100))}%)`;
+}
+
+// Jobs: long split/join work runs server-side and reports progress over SSE
+function watchJob(jobId, onProgress) {
+    return new Promise((resolve, reject) => {
+        const source = new EventSource(`/api/jobs/${jobId}/events`);
+        source.onmessage = (e) => {
+            const job = JSON.parse(e.data);
+            if (['done', 'failed', 'cancelled'].includes(job.status)) {
+                source.close();
+                resolve(job);
+            } else if (onProgress) {
+                onProgress(job);
+            }
+        };
+        source.onerror = () => {
+            // The stream only ends on its own after the final snapshot
+            source.close();
+            reject(new Error('Lost connection to job progress'));
+        };
+    });
+}
+
+async function cancelJob(jobId) {
+    await fetch(`/api/jobs/${jobId}/cancel`, { method: 'POST' });
+}
+
 function getSegmentLength() {
     const val = els.segmentLength.value.trim();
     if (val.includes(':')) {
@@ -53,35 +108,117 @@ function getSegmentLength() {
     return parseInt(val) || 0;
 }
 
-// Event Listeners
-els.browseFileBtn.addEventListener('click', async () => {
-    const res = await fetch('/api/browse-file');
+// Browse dialogs only exist when the server runs on this desktop; otherwise the path is typed in
+async function browsePath(url, input, onPath) {
+    const res = await fetch(url);
     const data = await res.json();
     if (data.path) {
-        state.filePath = data.path;
+        onPath(data.path);
+    } else if (data.error && input.readOnly) {
+        input.readOnly = false;
+        input.placeholder = 'Type a path on the server and press Enter...';
+        input.addEventListener('change', () => {
+            if (input.value.trim()) onPath(input.value.trim());
+        });
+        input.focus();
+        alert(data.error);
+    }
+}
+
+// Event Listeners
+els.browseFileBtn.addEventListener('click', () => browsePath('/api/browse-file', els.inputFile, (path) => {
+    state.filePath = path;
+    els.inputFile.value = state.filePath;
+    loadFileInfo();
+}));
+
+// Uploads: the file is sent in chunks; after a dropped connection the server says where to resume
+const UPLOAD_RETRIES = 5;
+
+async function uploadFile(file, onProgress) {
+    let res = await fetch('/api/uploads', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ filename: file.name, size: file.size })
+    });
+    let data = await res.json();
+    if (!res.ok) throw new Error(data.error);
+    const uploadId = data.uploadId;
+    const chunkSize = data.chunkSize;
+    let offset = 0;
+    let failures = 0;
+
+    while (offset < file.size) {
+        try {
+            res = await fetch(`/api/uploads/${uploadId}?offset=${offset}`, {
+                method: 'PUT',
+                headers: { 'Content-Type': 'application/octet-stream' },
+                body: file.slice(offset, offset + chunkSize)
+            });
+            data = await res.json();
+            if (res.ok || res.status === 409) {
+                offset = data.offset;
+                failures = 0;
+                onProgress(offset, file.size);
+                continue;
+            }
+            throw new Error(data.error);
+        } catch (e) {
+            if (++failures > UPLOAD_RETRIES) throw e;
+            await new Promise(resolve => setTimeout(resolve, 1000 * failures));
+            // Ask how much arrived before the connection dropped
+            const status = await fetch(`/api/uploads/${uploadId}`).then(r => r.json()).catch(() => null);
+            if (status && status.offset !== undefined) offset = status.offset;
+        }
+    }
+
+    res = await fetch(`/api/uploads/${uploadId}/complete`, { method: 'POST' });
+    data = await res.json();
+    if (!res.ok) throw new Error(data.error);
+    return data.path;
+}
+
+els.uploadFileBtn.addEventListener('click', () => els.uploadFileInput.click());
+
+els.uploadFileInput.addEventListener('change', async () => {
+    const file = els.uploadFileInput.files[0];
+    els.uploadFileInput.value = '';
+    if (!file) return;
+
+    els.uploadFileBtn.disabled = true;
+    try {
+        const path = await uploadFile(file, (done, total) => {
+            els.inputFile.value = `Uploading ${file.name}...${formatPercent(done, total)}`;
+        });
+        state.filePath = path;
         els.inputFile.value = state.filePath;
         loadFileInfo();
+    } catch (e) {
+        els.inputFile.value = state.filePath || '';
+        alert('Upload failed: ' + e.message);
+    } finally {
+        els.uploadFileBtn.disabled = false;
     }
 });
 
-els.browseFolderBtn.addEventListener('click', async () => {
-    const res = await fetch('/api/browse-folder');
-    const data = await res.json();
-    if (data.path) {
-        state.outputFolder = data.path;
-        els.outputFolder.value = state.outputFolder;
-        checkExportReady();
-    }
-});
+els.browseFolderBtn.addEventListener('click', () => browsePath('/api/browse-folder', els.outputFolder, (path) => {
+    state.outputFolder = path;
+    els.outputFolder.value = state.outputFolder;
+    checkExportReady();
+}));
 
 els.generateBtn.addEventListener('click', () => generateSegments(true));
+els.silenceBtn.addEventListener('click', detectSilenceSegments);
 els.addSegmentBtn.addEventListener('click', addSegment);
 els.clearSegmentsBtn.addEventListener('click', () => {
     state.segments = [];
     renderSegments();
 });
-els.exportBtn.addEventListener('click', () => exportSegments(false));
-els.exportZipBtn.addEventListener('click', () => exportSegments(true));
+els.exportBtn.addEventListener('click', exportSegments);
+els.exportZipBtn.addEventListener('click', downloadZip);
+els.exportCancelBtn.addEventListener('click', () => {
+    if (state.exportJobId) cancelJob(state.exportJobId);
+});
 
 async function loadFileInfo() {
     try {
@@ -96,10 +233,12 @@ async function loadFileInfo() {
             els.fileDuration.textContent = formatTime(state.duration);
             els.fileInfo.classList.remove('hidden');
             els.generateBtn.disabled = false;
+            els.silenceBtn.disabled = false;
 
             // Reset segments when a new file is selected
             state.segments = [];
             renderSegments();
+            resetWaveform();
         }
     } catch (err) {
         console.error(err);
@@ -107,6 +246,120 @@ async function loadFileInfo() {
     }
 }
 
+function resetWaveform() {
+    waveform.start = 0;
+    waveform.span = state.duration;
+    waveform.peaks = null;
+    els.waveformScroll.value = 0;
+    els.waveformPanel.classList.remove('hidden');
+    fetchWaveform();
+}
+
+async function fetchWaveform() {
+    if (!state.filePath || !waveform.span) return;
+    const requestId = ++waveform.requestId;
+    const canvas = els.waveformCanvas;
+    els.waveformRange.textContent = waveform.peaks ? els.waveformRange.textContent : 'Building waveform...';
+
+    try {
+        const res = await fetch('/api/waveform', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({
+                path: state.filePath,
+                start: waveform.start,
+                end: waveform.start + waveform.span,
+                width: canvas.clientWidth
+            })
+        });
+        // A newer zoom/scroll request superseded this one
+        if (requestId !== waveform.requestId) return;
+        if (!res.ok) {
+            const data = await res.json();
+            els.waveformRange.textContent = 'Waveform unavailable: ' + data.error;
+            return;
+        }
+        waveform.bucketMs = parseInt(res.headers.get('X-Bucket-Ms'));
+        waveform.firstBucket = parseInt(res.headers.get('X-First-Bucket'));
+        waveform.peaks = new Int16Array(await res.arrayBuffer());
+        drawWaveform();
+    } catch (err) {
+        console.error(err);
+    }
+}
+
+function drawWaveform() {
+    const canvas = els.waveformCanvas;
+    const width = canvas.clientWidth;
+    const height = canvas.clientHeight;
+    canvas.width = width * window.devicePixelRatio;
+    canvas.height = height * window.devicePixelRatio;
+    const ctx = canvas.getContext('2d');
+    ctx.scale(window.devicePixelRatio, window.devicePixelRatio);
+    ctx.clearRect(0, 0, width, height);
+
+    const end = waveform.start + waveform.span;
+    els.waveformRange.textContent = `${formatTime(waveform.start)} - ${formatTime(end)}`;
+    if (!waveform.peaks) return;
+
+    // Each pixel column covers a run of buckets; draw its overall min/max
+    const peaks = waveform.peaks;
+    const buckets = peaks.length / 2;
+    const bucketSec = waveform.bucketMs / 1000;
+    const mid = height / 2;
+    ctx.fillStyle = '#3b82f6';
+    for (let x = 0; x < width; x++) {
+        const t0 = waveform.start + (x / width) * waveform.span;
+        const t1 = waveform.start + ((x + 1) / width) * waveform.span;
+        let from = Math.floor(t0 / bucketSec) - waveform.firstBucket;
+        let to = Math.max(from + 1, Math.ceil(t1 / bucketSec) - waveform.firstBucket);
+        from = Math.max(0, from);
+        to = Math.min(buckets, to);
+        if (from >= to) continue;
+        let lo = 32767, hi = -32768;
+        for (let b = from; b < to; b++) {
+            if (peaks[2 * b] < lo) lo = peaks[2 * b];
+            if (peaks[2 * b + 1] > hi) hi = peaks[2 * b + 1];
+        }
+        const top = mid - (hi / 32768) * mid;
+        const bottom = mid - (lo / 32768) * mid;
+        ctx.fillRect(x, top, 1, Math.max(1, bottom - top));
+    }
+
+    // Segment boundaries on top of the waveform
+    ctx.fillStyle = '#ef4444';
+    state.segments.forEach(seg => {
+        if (seg.start < waveform.start || seg.start > end) return;
+        const x = ((seg.start - waveform.start) / waveform.span) * width;
+        ctx.fillRect(Math.round(x), 0, 1, height);
+    });
+}
+
+function zoomWaveform(factor) {
+    if (!waveform.span) return;
+    const center = waveform.start + waveform.span / 2;
+    waveform.span = Math.min(state.duration, Math.max(MIN_WAVEFORM_SPAN, waveform.span * factor));
+    waveform.start = Math.min(Math.max(0, center - waveform.span / 2), state.duration - waveform.span);
+    syncWaveformScroll();
+    fetchWaveform();
+}
+
+function syncWaveformScroll() {
+    const scrollable = state.duration - waveform.span;
+    els.waveformScroll.value = scrollable > 0 ? Math.round(waveform.start / scrollable * 1000) : 0;
+}
+
+els.waveformZoomIn.addEventListener('click', () => zoomWaveform(0.5));
+els.waveformZoomOut.addEventListener('click', () => zoomWaveform(2));
+els.waveformScroll.addEventListener('input', () => {
+    waveform.start = (els.waveformScroll.value / 1000) * Math.max(0, state.duration - waveform.span);
+    drawWaveform();
+    fetchWaveform();
+});
+window.addEventListener('resize', () => {
+    if (waveform.peaks) fetchWaveform();
+});
+
 function generateSegments(isReset) {
     const segLen = getSegmentLength();
     if (!segLen || segLen <= 0) {
@@ -186,6 +439,43 @@ function generateSegments(isReset) {
     renderSegments();
 }
 
+// Same as Apply / Reset, but the server moves each cut to the nearest pause
+async function detectSilenceSegments() {
+    const segLen = getSegmentLength();
+    if (!segLen || segLen <= 0) {
+        alert("Please enter a valid segment length (HH:MM:SS or seconds)");
+        return;
+    }
+
+    els.silenceBtn.disabled = true;
+    const label = els.silenceBtn.textContent;
+    els.silenceBtn.textContent = 'Analysing...';
+    try {
+        const res = await fetch('/api/detect-silence', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ path: state.filePath, segmentLength: segLen })
+        });
+        const data = await res.json();
+        if (!res.ok) throw new Error(data.error || 'Silence detection failed');
+
+        state.segments = data.segments.map((seg, i) => ({
+            id: Date.now() + Math.random(),
+            start: seg.start,
+            end: seg.end,
+            locked: false,
+            outputName: `part_${i + 1}_${getBaseFilename()}`
+        }));
+        renderSegments();
+    } catch (err) {
+        console.error(err);
+        alert('Error detecting pauses: ' + err.message);
+    } finally {
+        els.silenceBtn.textContent = label;
+        els.silenceBtn.disabled = false;
+    }
+}
+
 function addSegment() {
     const lastSeg = state.segments[state.segments.length - 1];
     const start = lastSeg ? lastSeg.end : 0;
@@ -198,88 +488,183 @@ function addSegment() {
         locked: false,
         outputName: `part_auto_${getBaseFilename()}` // Temp, will be renumbered
     });
-    renumberSegments();
+    renumberSegments(state.segments.length - 1);
     renderSegments();
 }
 
+// Only the rows in view exist in the DOM. They are absolutely positioned,
+// keyed by segment index and recycled while scrolling, so a plan with
+// thousands of segments costs no more to edit than one with twenty.
+const SEGMENT_OVERSCAN = 10; // rows kept rendered above and below the viewport
+const ESTIMATED_ROW_HEIGHT = 58; // px, until a visible row can be measured
+
+const segmentView = {
+    canvas: null,
+    rows: new Map(), // segment index -> row element
+    pool: [],
+    rowHeight: 0,
+    frame: null
+};
+
 function renderSegments() {
-    els.segmentsList.innerHTML = '';
     if (state.segments.length === 0) {
+        segmentView.canvas = null;
+        segmentView.rows.clear();
         els.segmentsList.innerHTML = '<div class="empty-state">No segments generated yet.</div>';
         checkExportReady();
         return;
     }
 
-    state.segments.forEach((seg, index) => {
-        const row = document.createElement('div');
-        row.className = `segment-row ${seg.locked ? 'locked' : ''} ${state.playingIdx === index ? 'playing' : ''}`;
-        row.dataset.idx = index;
-
-        // Shift input only for index > 0
-        const shiftInput = index > 0 ? `<input type="number" class="shift-input" placeholder="+/- min" data-idx="${index}">` : '';
-        const shiftSecInput = index > 0 ? `<input type="number" class="shift-sec-input" placeholder="+/- s" data-idx="${index}">` : '';
+    if (!segmentView.canvas) {
+        els.segmentsList.innerHTML = '';
+        segmentView.canvas = document.createElement('div');
+        segmentView.canvas.className = 'segments-canvas';
+        els.segmentsList.appendChild(segmentView.canvas);
+    }
+    renderVisibleRows();
+    checkExportReady();
+    if (waveform.peaks) drawWaveform();
+}
 
-        row.innerHTML = `
-            <div class="idx">${index + 1}</div>
-            <input type="text" class="time-input start" value="${formatTime(seg.start)}" data-idx="${index}" data-field="start">
-            <div style="text-align: center;">${shiftInput}</div>
-            <div style="text-align: center;">${shiftSecInput}</div>
-            <input type="text" class="time-input end" value="${formatTime(seg.end)}" data-idx="${index}" data-field="end">
-            <div style="text-align: center;">
-                <input type="checkbox" ${seg.locked ? 'checked' : ''} data-idx="${index}" class="lock-cb">
-            </div>
-            <div class="col-duration">
-                ${formatTime(seg.end - seg.start)}
-            </div>
-            <input type="text" value="${seg.outputName}" data-idx="${index}" data-field="outputName" class="name-input">
-            <button class="del-btn" data-idx="${index}">×</button>
-        `;
-        els.segmentsList.appendChild(row);
+// Re-renders after scrolling, at most once per frame
+function scheduleVisibleRows() {
+    if (segmentView.frame || !segmentView.canvas) return;
+    segmentView.frame = requestAnimationFrame(() => {
+        segmentView.frame = null;
+        if (segmentView.canvas) renderVisibleRows();
     });
+}
 
-    attachListeners();
-    checkExportReady();
+function segmentRowHeight() {
+    if (segmentView.rowHeight) return segmentView.rowHeight;
+    for (const row of segmentView.rows.values()) {
+        if (row.offsetHeight > 0) {
+            segmentView.rowHeight = row.offsetHeight + parseFloat(getComputedStyle(row).marginBottom);
+            return segmentView.rowHeight;
+        }
+    }
+    return ESTIMATED_ROW_HEIGHT;
 }
 
-function attachListeners() {
-    document.querySelectorAll('.time-input').forEach(inp => {
-        inp.addEventListener('change', handleTimeChange);
-    });
-    document.querySelectorAll('.shift-input').forEach(inp => {
-        inp.addEventListener('change', handleShiftChange);
-    });
-    document.querySelectorAll('.lock-cb').forEach(cb => {
-        cb.addEventListener('change', (e) => {
-            const idx = parseInt(e.target.dataset.idx);
-            state.segments[idx].locked = e.target.checked;
-            renderSegments(); // Re-render to show visual lock state
-        });
-    });
-    document.querySelectorAll('.name-input').forEach(inp => {
-        inp.addEventListener('change', (e) => {
-            const idx = parseInt(e.target.dataset.idx);
-            state.segments[idx].outputName = e.target.value;
-        });
-    });
-    document.querySelectorAll('.shift-sec-input').forEach(el => {
-        el.addEventListener('change', (e) => {
-            handleShiftSecondsChange(e);
-        });
-    });
-    document.querySelectorAll('.del-btn').forEach(btn => {
-        btn.addEventListener('click', (e) => {
-            const idx = parseInt(e.target.dataset.idx);
-            state.segments.splice(idx, 1);
-            // If we delete, we might create a gap. 
-            // For now, just render. User can manually adjust or regenerate.
-            renumberSegments();
-            renderSegments();
-        });
+function renderVisibleRows() {
+    const list = els.segmentsList;
+    const total = state.segments.length;
+    const rowHeight = segmentRowHeight();
+    const viewport = list.clientHeight || window.innerHeight;
+    const first = Math.max(0, Math.floor(list.scrollTop / rowHeight) - SEGMENT_OVERSCAN);
+    const last = Math.min(total, Math.ceil((list.scrollTop + viewport) / rowHeight) + SEGMENT_OVERSCAN);
+
+    // Rows that left the window go back to the pool; the one being typed in stays
+    segmentView.rows.forEach((row, index) => {
+        const focused = row.contains(document.activeElement);
+        if (index >= total || ((index < first || index >= last) && !focused)) {
+            segmentView.rows.delete(index);
+            row.remove();
+            segmentView.pool.push(row);
+        }
     });
+    for (let index = first; index < last; index++) {
+        if (segmentView.rows.has(index)) continue;
+        const row = segmentView.pool.pop() || createSegmentRow();
+        row.querySelector('.shift-input').value = '';
+        row.querySelector('.shift-sec-input').value = '';
+        segmentView.canvas.appendChild(row);
+        segmentView.rows.set(index, row);
+    }
+    segmentView.rows.forEach((row, index) => fillSegmentRow(row, index, rowHeight));
+    segmentView.canvas.style.height = `${total * rowHeight}px`;
+
+    if (!segmentView.rowHeight && segmentRowHeight() !== rowHeight) {
+        renderVisibleRows(); // first visible render: place rows by their real height
+    }
+}
+
+function createSegmentRow() {
+    const row = document.createElement('div');
+    row.className = 'segment-row';
+    row.innerHTML = `
+        <div class="idx"></div>
+        <input type="text" class="time-input start" data-field="start">
+        <div style="text-align: center;"><input type="number" class="shift-input" placeholder="+/- min"></div>
+        <div style="text-align: center;"><input type="number" class="shift-sec-input" placeholder="+/- s"></div>
+        <input type="text" class="time-input end" data-field="end">
+        <div style="text-align: center;">
+            <input type="checkbox" class="lock-cb">
+        </div>
+        <div class="col-duration"></div>
+        <input type="text" data-field="outputName" class="name-input">
+        <button class="del-btn">×</button>
+    `;
+    return row;
 }
 
+// Writes only the values that differ, so unchanged rows cost no layout
+function fillSegmentRow(row, index, rowHeight) {
+    const seg = state.segments[index];
+    const setValue = (el, value) => {
+        if (el.value !== value) el.value = value;
+    };
+    const setText = (el, text) => {
+        if (el.textContent !== text) el.textContent = text;
+    };
+
+    if (row.dataset.idx !== String(index)) {
+        row.dataset.idx = index;
+        row.style.top = `${index * rowHeight}px`;
+        setText(row.querySelector('.idx'), String(index + 1));
+        // Shift is relative to the previous segment, so the first row has none
+        row.querySelector('.shift-input').style.visibility = index > 0 ? '' : 'hidden';
+        row.querySelector('.shift-sec-input').style.visibility = index > 0 ? '' : 'hidden';
+    } else if (row.style.top !== `${index * rowHeight}px`) {
+        row.style.top = `${index * rowHeight}px`;
+    }
+    row.classList.toggle('locked', seg.locked);
+    row.classList.toggle('playing', state.playingIdx === index);
+    setValue(row.querySelector('.time-input.start'), formatTime(seg.start));
+    setValue(row.querySelector('.time-input.end'), formatTime(seg.end));
+    setText(row.querySelector('.col-duration'), formatTime(seg.end - seg.start));
+    setValue(row.querySelector('.name-input'), seg.outputName);
+    const lock = row.querySelector('.lock-cb');
+    if (lock.checked !== seg.locked) lock.checked = seg.locked;
+}
+
+function segmentIndex(el) {
+    return parseInt(el.closest('.segment-row').dataset.idx);
+}
+
+// One listener per event type for the whole list; rows come and go while scrolling
+els.segmentsList.addEventListener('change', (e) => {
+    if (!e.target.closest('.segment-row')) return;
+    const classes = e.target.classList;
+    if (classes.contains('time-input')) {
+        handleTimeChange(e);
+    } else if (classes.contains('shift-input')) {
+        handleShiftChange(e);
+    } else if (classes.contains('shift-sec-input')) {
+        handleShiftSecondsChange(e);
+    } else if (classes.contains('lock-cb')) {
+        state.segments[segmentIndex(e.target)].locked = e.target.checked;
+        renderSegments(); // Re-render to show visual lock state
+    } else if (classes.contains('name-input')) {
+        state.segments[segmentIndex(e.target)].outputName = e.target.value;
+    }
+});
+
+els.segmentsList.addEventListener('click', (e) => {
+    if (!e.target.classList.contains('del-btn')) return;
+    const idx = segmentIndex(e.target);
+    state.segments.splice(idx, 1);
+    // If we delete, we might create a gap.
+    // For now, just render. User can manually adjust or regenerate.
+    renumberSegments(idx);
+    renderSegments();
+});
+
+els.segmentsList.addEventListener('scroll', scheduleVisibleRows, { passive: true });
+window.addEventListener('resize', scheduleVisibleRows);
+
 function handleShiftChange(e) {
-    const idx = parseInt(e.target.dataset.idx);
+    const idx = segmentIndex(e.target);
     const valMinutes = parseFloat(e.target.value);
 
     if (isNaN(valMinutes) || valMinutes === 0) return;
@@ -291,7 +676,7 @@ function handleShiftChange(e) {
 
     // Find limit (Next Locked Segment or Total Duration)
     let limitTime = state.duration;
-    const nextAnchorIdx = state.segments.findIndex((s, i) => i > idx && s.locked);
+    const nextAnchorIdx = nextLockedIndex(idx);
     if (nextAnchorIdx !== -1) {
         limitTime = state.segments[nextAnchorIdx].start;
     }
@@ -334,12 +719,13 @@ function handleShiftChange(e) {
     }
 
     // Cascade from this segment
+    e.target.value = "";
     cascadeFrom(idx);
     renderSegments();
 }
 
 function handleShiftSecondsChange(e) {
-    const idx = parseInt(e.target.dataset.idx);
+    const idx = segmentIndex(e.target);
     const valSeconds = parseFloat(e.target.value);
 
     if (isNaN(valSeconds) || valSeconds === 0) return;
@@ -350,7 +736,7 @@ function handleShiftSecondsChange(e) {
 
     // Find limit (Next Locked Segment or Total Duration)
     let limitTime = state.duration;
-    const nextAnchorIdx = state.segments.findIndex((s, i) => i > idx && s.locked);
+    const nextAnchorIdx = nextLockedIndex(idx);
     if (nextAnchorIdx !== -1) {
         limitTime = state.segments[nextAnchorIdx].start;
     }
@@ -393,12 +779,13 @@ function handleShiftSecondsChange(e) {
     }
 
     // Cascade from this segment
+    e.target.value = "";
     cascadeFrom(idx);
     renderSegments();
 }
 
 function handleTimeChange(e) {
-    const idx = parseInt(e.target.dataset.idx);
+    const idx = segmentIndex(e.target);
     const field = e.target.dataset.field;
     const val = parseTime(e.target.value);
     const seg = state.segments[idx];
@@ -439,7 +826,7 @@ function handleTimeChange(e) {
 
 function cascadeFrom(idx) {
     const currentSeg = state.segments[idx];
-    const nextAnchorIdx = state.segments.findIndex((s, i) => i > idx && s.locked);
+    const nextAnchorIdx = nextLockedIndex(idx);
 
     let limitTime = state.duration;
     let limitIdx = state.segments.length;
@@ -477,13 +864,22 @@ function cascadeFrom(idx) {
     const removeCount = limitIdx - (idx + 1);
     state.segments.splice(idx + 1, removeCount, ...newSegs);
 
-    // Renumber segments to ensure consistent naming
-    renumberSegments();
+    // Renumber segments to ensure consistent naming; the ones before idx keep their numbers
+    renumberSegments(idx + 1);
 }
 
-function renumberSegments() {
-    let autoIdx = 1;
-    state.segments.forEach(seg => {
+function nextLockedIndex(idx) {
+    for (let i = idx + 1; i < state.segments.length; i++) {
+        if (state.segments[i].locked) return i;
+    }
+    return -1;
+}
+
+function renumberSegments(from = 0) {
+    const base = getBaseFilename();
+    for (let i = from; i < state.segments.length; i++) {
+        const seg = state.segments[i];
+        const autoIdx = i + 1;
         // If segment is auto-generated (not locked), we enforce the naming convention
         if (!seg.locked) {
             // Find the first available index
@@ -494,10 +890,9 @@ function renumberSegments() {
             // The constraint "segment_auto_..." suggests we should only target those or target all unlocked.
             // Let's target all unlocked to force the "stt index" pattern the user wants.
 
-            seg.outputName = `part_${autoIdx}_${getBaseFilename()}`;
+            seg.outputName = `part_${autoIdx}_${base}`;
         }
-        autoIdx++;
-    });
+    }
 }
 
 // Audio & Preview
@@ -507,13 +902,78 @@ function renumberSegments() {
 function checkExportReady() {
     const ready = state.segments.length > 0 && state.outputFolder;
     els.exportBtn.disabled = !ready;
-    els.exportZipBtn.disabled = !ready;
+    // The ZIP is streamed to the browser, so it needs no output folder
+    els.exportZipBtn.disabled = !(state.segments.length > 0 && state.filePath);
+}
+
+// The plan as parallel start/end arrays. Names are listed only where they differ
+// from part_<n>_<base>, so a 10,000-segment plan stays a small request.
+function compactSegments() {
+    const base = getBaseFilename();
+    const names = {};
+    const starts = new Array(state.segments.length);
+    const ends = new Array(state.segments.length);
+    state.segments.forEach((seg, i) => {
+        starts[i] = seg.start;
+        ends[i] = seg.end;
+        if (seg.outputName !== `part_${i + 1}_${base}`) names[i] = seg.outputName;
+    });
+    return { starts: starts, ends: ends, namePrefix: 'part_', nameSuffix: `_${base}`, names: names };
 }
 
+// Checks the plan first, then posts it through a hidden form into a hidden frame, so the
+// browser streams the ZIP straight to a download and an error never replaces this page
+async function downloadZip() {
+    const plan = {
+        inputFile: state.filePath,
+        segments: compactSegments(),
+        backend: els.nativeCutCb.checked ? 'auto' : 'ffmpeg'
+    };
 
+    try {
+        const res = await fetch('/api/split-zip', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ ...plan, check: true })
+        });
+        const checked = await res.json();
+        if (!checked.success) {
+            els.exportStatus.textContent = "Download failed: " + checked.error;
+            return;
+        }
+    } catch (err) {
+        els.exportStatus.textContent = "Download failed: " + err;
+        return;
+    }
+    els.exportStatus.textContent = "";
+
+    let frame = document.getElementById('zip-download-frame');
+    if (!frame) {
+        frame = document.createElement('iframe');
+        frame.id = 'zip-download-frame';
+        frame.name = 'zip-download-frame';
+        frame.style.display = 'none';
+        document.body.appendChild(frame);
+    }
 
+    const form = document.createElement('form');
+    form.method = 'POST';
+    form.action = '/api/split-zip';
+    form.target = frame.name;
+    form.style.display = 'none';
+
+    const field = document.createElement('input');
+    field.type = 'hidden';
+    field.name = 'plan';
+    field.value = JSON.stringify(plan);
+    form.appendChild(field);
+
+    document.body.appendChild(form);
+    form.submit();
+    form.remove();
+}
 
-async function exportSegments(createZip) {
+async function exportSegments() {
     els.exportBtn.disabled = true;
     els.exportZipBtn.disabled = true;
     els.exportStatus.textContent = "Exporting...";
@@ -525,27 +985,51 @@ async function exportSegments(createZip) {
             body: JSON.stringify({
                 inputFile: state.filePath,
                 outputDir: state.outputFolder,
-                segments: state.segments,
-                createZip: createZip
+                segments: compactSegments(),
+                // 'auto' uses the native frame cutter for MP3 and ffmpeg otherwise
+                backend: els.nativeCutCb.checked ? 'auto' : 'ffmpeg',
+                normalize: els.normalizeCb.checked
             })
         });
-        const data = await res.json();
-        if (data.success) {
+        const queued = await res.json();
+        if (!queued.success) {
+            els.exportStatus.textContent = "Export failed: " + queued.error;
+            return;
+        }
+
+        state.exportJobId = queued.jobId;
+        els.exportCancelBtn.classList.remove('hidden');
+        const job = await watchJob(queued.jobId, (job) => {
+            const p = job.progress;
+            if (p.stage === 'analyze') {
+                els.exportStatus.textContent = "Measuring loudness...";
+            } else if (p.segmentsTotal) {
+                els.exportStatus.textContent = `Exporting... ${p.segmentsDone || 0}/${p.segmentsTotal} segments` +
+                    formatPercent(p.segmentsDone || 0, p.segmentsTotal);
+            }
+        });
+
+        if (job.status === 'cancelled') {
+            els.exportStatus.textContent = "Export cancelled.";
+        } else if (job.status === 'failed') {
+            els.exportStatus.textContent = "Export failed: " + job.error;
+        } else {
+            const data = job.result;
             let msg = `Success! Created ${data.created.length} files.`;
-            if (data.zipPath) {
-                msg += `\nZip saved to ${data.zipPath}`;
+            if (data.reused) {
+                msg += ` (${data.reused} unchanged segments reused, ${data.cut} cut)`;
             }
             alert(msg);
             els.exportStatus.textContent = "";
             if (data.errors.length > 0) {
                 alert("Some errors occurred:\n" + data.errors.join('\n'));
             }
-        } else {
-            els.exportStatus.textContent = "Export failed: " + data.error;
         }
     } catch (err) {
         els.exportStatus.textContent = "Export failed: " + err;
     } finally {
+        state.exportJobId = null;
+        els.exportCancelBtn.classList.add('hidden');
         checkExportReady();
     }
 }
@@ -557,7 +1041,10 @@ async function exportSegments(createZip) {
 let joinState = {
     inputFolder: null,
     outputFolder: null,
-    files: []
+    files: [],
+    jobId: null,
+    // Aborts the folder listing still streaming in, if any
+    listController: null
 };
 
 // Automatically set output folder to project's Output directory on page load
@@ -586,10 +1073,15 @@ const joinEls = {
     fileCountValue: document.getElementById('join-file-count-value'),
     filesList: document.getElementById('join-files-list'),
     refreshBtn: document.getElementById('join-refresh-btn'),
+    recursiveCb: document.getElementById('join-recursive-cb'),
+    normalizeCb: document.getElementById('join-normalize-cb'),
+    crossfade: document.getElementById('join-crossfade'),
+    gaplessCb: document.getElementById('join-gapless-cb'),
     outputFolderPath: document.getElementById('join-output-folder-path'),
     browseOutputBtn: document.getElementById('join-browse-output-btn'),
     outputFilename: document.getElementById('join-output-filename'),
     executeBtn: document.getElementById('join-execute-btn'),
+    cancelBtn: document.getElementById('join-cancel-btn'),
     status: document.getElementById('join-status')
 };
 
@@ -607,58 +1099,109 @@ document.querySelectorAll('.tab-btn').forEach(btn => {
             content.classList.remove('active');
         });
         document.getElementById(`${targetTab}-tab`).classList.add('active');
+        // Rows rendered while the tab was hidden could not be measured
+        scheduleVisibleRows();
     });
 });
 
 // Join Event Listeners
-joinEls.browseFolderBtn.addEventListener('click', async () => {
-    const res = await fetch('/api/browse-folder');
-    const data = await res.json();
-    if (data.path) {
-        joinState.inputFolder = data.path;
-        joinEls.inputFolderPath.value = joinState.inputFolder;
-        await loadJoinFiles();
-    }
-});
-
-joinEls.browseOutputBtn.addEventListener('click', async () => {
-    const res = await fetch('/api/browse-folder');
-    const data = await res.json();
-    if (data.path) {
-        joinState.outputFolder = data.path;
-        joinEls.outputFolderPath.value = joinState.outputFolder;
-        checkJoinReady();
-    }
-});
+joinEls.browseFolderBtn.addEventListener('click', () => browsePath('/api/browse-folder', joinEls.inputFolderPath, (path) => {
+    joinState.inputFolder = path;
+    joinEls.inputFolderPath.value = joinState.inputFolder;
+    loadJoinFiles();
+}));
+
+joinEls.browseOutputBtn.addEventListener('click', () => browsePath('/api/browse-folder', joinEls.outputFolderPath, (path) => {
+    joinState.outputFolder = path;
+    joinEls.outputFolderPath.value = joinState.outputFolder;
+    checkJoinReady();
+}));
 
 joinEls.refreshBtn.addEventListener('click', loadJoinFiles);
+joinEls.recursiveCb.addEventListener('change', loadJoinFiles);
 joinEls.executeBtn.addEventListener('click', executeJoin);
+joinEls.cancelBtn.addEventListener('click', () => {
+    if (joinState.jobId) cancelJob(joinState.jobId);
+});
 
 async function loadJoinFiles() {
     if (!joinState.inputFolder) return;
 
+    // A reload or another folder replaces the listing still streaming in
+    if (joinState.listController) joinState.listController.abort();
+    const controller = new AbortController();
+    joinState.listController = controller;
+
+    // Results arrive as NDJSON, one line per probed file, so rows show up while the scan runs
+    const files = [];
+    joinState.files = files;
+    joinEls.fileCountValue.textContent = 0;
+    joinEls.fileCount.classList.remove('hidden');
+    renderJoinFiles();
+
     try {
         const res = await fetch('/api/list-mp3-files', {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ folderPath: joinState.inputFolder })
+            body: JSON.stringify({
+                folderPath: joinState.inputFolder,
+                recursive: joinEls.recursiveCb.checked,
+                stream: true
+            }),
+            signal: controller.signal
         });
-        const data = await res.json();
 
-        if (data.error) {
+        if (!res.ok) {
+            const data = await res.json();
             alert('Error loading files: ' + data.error);
             return;
         }
 
-        joinState.files = data.files;
-        joinEls.fileCountValue.textContent = joinState.files.length;
-        joinEls.fileCount.classList.remove('hidden');
+        const reader = res.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let renderPending = false;
+
+        const scheduleRender = () => {
+            if (renderPending) return;
+            renderPending = true;
+            requestAnimationFrame(() => {
+                renderPending = false;
+                joinEls.fileCountValue.textContent = joinState.files.length;
+                renderJoinFiles();
+                checkJoinReady();
+            });
+        };
+
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done || controller.signal.aborted) break;
+            buffer += decoder.decode(value, { stream: true });
+
+            const lines = buffer.split('\n');
+            buffer = lines.pop();
+            lines.forEach(line => {
+                if (!line.trim()) return;
+                const msg = JSON.parse(line);
+                if (msg.type === 'file') {
+                    files.push(msg);
+                    scheduleRender();
+                } else if (msg.type === 'error') {
+                    console.error(`Error processing ${msg.filename}: ${msg.error}`);
+                }
+            });
+        }
 
+        if (controller.signal.aborted) return;
+        joinEls.fileCountValue.textContent = joinState.files.length;
         renderJoinFiles();
         checkJoinReady();
     } catch (err) {
+        if (controller.signal.aborted) return;
         console.error(err);
         alert('Error loading files');
+    } finally {
+        if (joinState.listController === controller) joinState.listController = null;
     }
 }
 
@@ -821,6 +1364,13 @@ async function executeJoin() {
         return;
     }
 
+    const crossfadeText = joinEls.crossfade.value.trim();
+    const crossfade = crossfadeText ? Number(crossfadeText) : null;
+    if (crossfade !== null && !(crossfade >= 0 && crossfade <= 30)) {
+        alert('Crossfade must be a number of seconds from 0 to 30');
+        return;
+    }
+
     joinEls.executeBtn.disabled = true;
     joinEls.status.textContent = 'Joining files...';
     joinEls.status.style.backgroundColor = 'rgba(59, 130, 246, 0.1)';
@@ -835,11 +1385,38 @@ async function executeJoin() {
             headers: { 'Content-Type': 'application/json' },
             body: JSON.stringify({
                 filePaths: filePaths,
-                outputPath: outputPath
+                outputPath: outputPath,
+                normalize: joinEls.normalizeCb.checked,
+                crossfade: crossfade,
+                gapless: joinEls.gaplessCb.checked
             })
         });
 
-        const data = await res.json();
+        const queued = await res.json();
+        let data = queued;
+
+        if (queued.success) {
+            joinState.jobId = queued.jobId;
+            joinEls.cancelBtn.classList.remove('hidden');
+            const job = await watchJob(queued.jobId, (job) => {
+                const p = job.progress;
+                if (p.stage === 'analyze') {
+                    joinEls.status.textContent = 'Measuring loudness...';
+                } else if (p.stage === 'encode') {
+                    joinEls.status.textContent = `Normalizing... ${p.filesDone || 0}/${p.filesTotal} files`;
+                } else if (p.stage === 'render' && p.boundariesTotal) {
+                    joinEls.status.textContent = `Rendering transitions... ${p.boundariesDone || 0}/${p.boundariesTotal}`;
+                } else if (p.totalSeconds) {
+                    joinEls.status.textContent = `Joining files... ${formatTime(p.position || 0)} / ${formatTime(p.totalSeconds)}` +
+                        formatPercent(p.position || 0, p.totalSeconds);
+                }
+            });
+            if (job.status === 'done') {
+                data = job.result;
+            } else {
+                data = { success: false, error: job.status === 'cancelled' ? 'Join cancelled' : job.error };
+            }
+        }
 
         if (data.success) {
             joinEls.status.textContent = `✓ ${data.message}`;
@@ -859,6 +1436,8 @@ async function executeJoin() {
         joinEls.status.style.color = 'var(--danger-color)';
         alert('Error joining files: ' + err.message);
     } finally {
+        joinState.jobId = null;
+        joinEls.cancelBtn.classList.add('hidden');
         checkJoinReady();
     }
 }
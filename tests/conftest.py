@@ -0,0 +1,64 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Keep the probe, loudness and segment caches out of the checkout
+os.environ.setdefault('CUTFILE_CACHE_DIR', tempfile.mkdtemp(prefix='cutfile_test_cache_'))
+
+if shutil.which('ffmpeg') is None:
+    pytest.skip('ffmpeg is required for these tests', allow_module_level=True)
+
+# Fixture files generated with ffmpeg's lavfi sources: name -> (seconds, encoder options)
+FIXTURES = {
+    'cbr': (6, ['-ac', '2', '-ar', '44100', '-b:a', '128k']),
+    'cbr_b': (5, ['-ac', '2', '-ar', '44100', '-b:a', '128k']),
+    'vbr': (7, ['-ac', '2', '-ar', '44100', '-q:a', '4']),
+    'mono22': (4, ['-ac', '1', '-ar', '22050', '-b:a', '64k']),
+    # Long enough for several segments over ffmpeg's 2 s default segment_time
+    'long': (24, ['-ac', '2', '-ar', '44100', '-b:a', '128k']),
+}
+
+
+def run(cmd):
+    """Runs a command quietly; returns the CompletedProcess with text stderr."""
+    return subprocess.run(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                          text=True, errors='replace')
+
+
+def decode_errors(path):
+    """ffmpeg's complaints when decoding path completely; empty for a clean file."""
+    result = run(['ffmpeg', '-v', 'error', '-i', path, '-f', 'null', '-'])
+    return result.stderr.strip() if result.returncode == 0 else result.stderr.strip() or 'ffmpeg failed'
+
+
+@pytest.fixture(scope='session')
+def media(tmp_path_factory):
+    """Paths of the generated fixture files, keyed by FIXTURES name."""
+    folder = tmp_path_factory.mktemp('media')
+    paths = {}
+    for name, (seconds, options) in FIXTURES.items():
+        path = str(folder / f'{name}.mp3')
+        # Noise rather than a tone, so frame sizes vary like real material
+        result = run(['ffmpeg', '-y', '-v', 'error', '-f', 'lavfi',
+                      '-i', f'anoisesrc=d={seconds}:c=pink:a=0.3:seed=7', '-c:a', 'libmp3lame'] + options + [path])
+        assert result.returncode == 0, result.stderr
+        paths[name] = path
+    return paths
+
+
+@pytest.fixture
+def client(tmp_path):
+    """Test client of an app whose folders live in tmp_path and whose jobs stay in-process."""
+    import app
+    application = app.create_app({
+        'UPLOAD_FOLDER': str(tmp_path / 'uploads'),
+        'OUTPUT_FOLDER': str(tmp_path / 'Output'),
+        'DESKTOP': False,
+        'JOB_DB': '',
+    })
+    return application.test_client()
@@ -0,0 +1,53 @@
+import pytest
+
+import batch_split
+import mp3_frames
+from conftest import decode_errors
+
+
+def _plan(media, tmp_path, length=3):
+    segments = [{'start': start, 'end': start + length, 'path': str(tmp_path / f'{i + 1}_long.mp3'), 'index': i + 1}
+                for i, start in enumerate(range(0, 24, length))]
+    return [(media['long'], segments)]
+
+
+def test_tasks_span_at_most_max_task_seconds(media, tmp_path, monkeypatch):
+    monkeypatch.setattr(batch_split, 'MAX_TASK_SECONDS', 6)
+    tasks = batch_split._tasks(_plan(media, tmp_path), workers=1)
+    assert [len(segments) for _, segments in tasks] == [2, 2, 2, 2]
+    # A segment longer than the limit still gets a task of its own
+    tasks = batch_split._tasks(_plan(media, tmp_path, length=8), workers=1)
+    assert [len(segments) for _, segments in tasks] == [1, 1, 1]
+
+
+def test_interrupted_batch_resumes_after_finished_tasks(media, tmp_path, monkeypatch):
+    monkeypatch.setattr(batch_split, 'MAX_TASK_SECONDS', 6)
+    real_split = batch_split.split_segments
+    calls = []
+
+    def interrupted_split(input_file, segments, backend, **options):
+        calls.append(segments)
+        if len(calls) >= 3:
+            raise KeyboardInterrupt
+        return real_split(input_file, segments, backend, **options)
+
+    plan = _plan(media, tmp_path)
+    journal = batch_split.Journal(str(tmp_path / batch_split.JOURNAL_NAME))
+    monkeypatch.setattr(batch_split, 'split_segments', interrupted_split)
+    with pytest.raises(KeyboardInterrupt):
+        batch_split.run_batch(plan, journal, workers=1)
+    journal.close()
+
+    monkeypatch.setattr(batch_split, 'split_segments', real_split)
+    journal = batch_split.Journal(str(tmp_path / batch_split.JOURNAL_NAME))
+    try:
+        created, skipped, failures = batch_split.run_batch(plan, journal, workers=1)
+    finally:
+        journal.close()
+    assert (created, skipped, failures) == (4, 4, [])
+
+    # Later tasks seek to their start; the cuts still land where they should
+    for seg in plan[0][1]:
+        index = mp3_frames.build_index(seg['path'])
+        assert index.duration == pytest.approx(3, abs=2 * index.frame_duration)
+        assert decode_errors(seg['path']) == ''
@@ -0,0 +1,99 @@
+import os
+
+import pytest
+from flask import Flask, request
+
+from file_response import make_etag, parse_byte_range, send_media_file
+
+SIZE = 1000
+
+
+@pytest.fixture
+def media_file(tmp_path):
+    path = tmp_path / 'clip.mp3'
+    path.write_bytes(bytes(range(256)) * 3 + bytes(SIZE - 768))
+    return str(path)
+
+
+@pytest.fixture
+def serve(media_file):
+    app = Flask(__name__)
+    app.add_url_rule('/media', 'media', lambda: send_media_file(media_file, request))
+    client = app.test_client()
+    return lambda **headers: client.get('/media', headers=headers)
+
+
+@pytest.mark.parametrize('header, expected', [
+    ('bytes=0-99', (0, 99)),
+    ('bytes=990-', (990, 999)),
+    ('bytes=-10', (990, 999)),
+    ('bytes=-5000', (0, 999)),
+    ('bytes=500-5000', (500, 999)),
+    ('bytes=1000-', 'unsatisfiable'),
+    ('bytes=-0', 'unsatisfiable'),
+    ('bytes=0-1,5-6', 'multi'),
+    ('bytes=9-3', None),
+    ('bytes=a-b', None),
+    ('items=0-1', None),
+    ('bytes=', None),
+])
+def test_parse_byte_range(header, expected):
+    assert parse_byte_range(header, SIZE) == expected
+
+
+def test_full_response_advertises_ranges(serve, media_file):
+    response = serve()
+    assert response.status_code == 200
+    assert response.headers['Accept-Ranges'] == 'bytes'
+    assert response.headers['ETag'] == make_etag(os.stat(media_file))
+    assert response.headers['Content-Length'] == str(SIZE)
+    with open(media_file, 'rb') as f:
+        assert response.get_data() == f.read()
+
+
+@pytest.mark.parametrize('header, start, end', [
+    ('bytes=10-19', 10, 19),
+    ('bytes=900-', 900, 999),
+    ('bytes=-25', 975, 999),
+])
+def test_single_range(serve, media_file, header, start, end):
+    response = serve(Range=header)
+    assert response.status_code == 206
+    assert response.headers['Content-Range'] == f'bytes {start}-{end}/{SIZE}'
+    assert response.headers['Content-Length'] == str(end - start + 1)
+    with open(media_file, 'rb') as f:
+        f.seek(start)
+        assert response.get_data() == f.read(end - start + 1)
+
+
+@pytest.mark.parametrize('header', ['bytes=1000-', 'bytes=0-1,5-6'])
+def test_unsatisfiable_and_multi_ranges_are_rejected(serve, header):
+    response = serve(Range=header)
+    assert response.status_code == 416
+    assert response.headers['Content-Range'] == f'bytes */{SIZE}'
+
+
+def test_malformed_range_is_ignored(serve):
+    response = serve(Range='bytes=9-3')
+    assert response.status_code == 200
+    assert len(response.get_data()) == SIZE
+
+
+def test_if_range(serve, media_file):
+    etag = make_etag(os.stat(media_file))
+    assert serve(Range='bytes=0-9', **{'If-Range': etag}).status_code == 206
+    # A stale validator means the file changed: send all of it
+    stale = serve(Range='bytes=0-9', **{'If-Range': '"0-0"'})
+    assert stale.status_code == 200
+    assert len(stale.get_data()) == SIZE
+
+
+def test_conditional_get(serve, media_file):
+    etag = make_etag(os.stat(media_file))
+    response = serve(**{'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.get_data() == b''
+    assert serve(**{'If-None-Match': f'W/{etag}'}).status_code == 304
+    assert serve(**{'If-None-Match': '"other"'}).status_code == 200
+    last_modified = serve().headers['Last-Modified']
+    assert serve(**{'If-Modified-Since': last_modified}).status_code == 304
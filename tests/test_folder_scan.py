@@ -0,0 +1,62 @@
+import os
+import shutil
+import threading
+import time
+
+import pytest
+
+import media_probe
+
+
+def _names(found):
+    return sorted(name.replace(os.sep, '/') for name, _, _ in found)
+
+
+def test_recursive_scan_survives_symlink_cycles(media, tmp_path):
+    (tmp_path / 'a' / 'b').mkdir(parents=True)
+    shutil.copyfile(media['cbr'], tmp_path / 'a' / 'one.mp3')
+    shutil.copyfile(media['cbr'], tmp_path / 'a' / 'b' / 'two.mp3')
+    try:
+        os.symlink(tmp_path / 'a', tmp_path / 'a' / 'b' / 'loop', target_is_directory=True)
+    except (OSError, NotImplementedError):
+        pytest.skip('symlinks are not available')
+    assert _names(media_probe.list_media_files(str(tmp_path), recursive=True)) == ['a/b/two.mp3', 'a/one.mp3']
+
+
+def test_unreadable_subfolder_is_skipped(media, tmp_path, monkeypatch):
+    (tmp_path / 'locked').mkdir()
+    shutil.copyfile(media['cbr'], tmp_path / 'one.mp3')
+    shutil.copyfile(media['cbr'], tmp_path / 'locked' / 'two.mp3')
+    real_scandir = os.scandir
+
+    def scandir(path):
+        if os.path.basename(path) == 'locked':
+            raise PermissionError(13, 'Permission denied', path)
+        return real_scandir(path)
+    monkeypatch.setattr(os, 'scandir', scandir)
+    assert _names(media_probe.list_media_files(str(tmp_path), recursive=True)) == ['one.mp3']
+
+    # The folder asked for must still be reported
+    monkeypatch.setattr(os, 'scandir', lambda path: scandir(os.path.join(path, 'locked')))
+    with pytest.raises(PermissionError):
+        media_probe.list_media_files(str(tmp_path))
+
+
+def test_closing_probe_many_drops_pending_probes(monkeypatch):
+    started = []
+    lock = threading.Lock()
+
+    def slow_probe(entry):
+        with lock:
+            started.append(entry)
+        time.sleep(0.01)
+        return entry, {'duration': 1.0}, None
+    monkeypatch.setattr(media_probe, '_probe_entry', slow_probe)
+
+    entries = [(f'{i}.mp3', f'/nowhere/{i}.mp3', None) for i in range(1000)]
+    results = media_probe.probe_many(entries, workers=2)
+    assert next(results)[0] == entries[0]
+    results.close()
+    # Only the queued window ever ran, not the whole listing
+    assert len(started) <= 2 * media_probe.PROBE_WINDOW + 2
+    assert [entry for entry, _, _ in media_probe.probe_many(entries[:20], workers=2)] == entries[:20]
@@ -0,0 +1,48 @@
+import os
+import subprocess
+import sys
+
+import metrics
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# A worker process that records one ffmpeg exit and one request, then exits
+WORKER = """
+import sys
+import metrics
+metrics.use_store(sys.argv[1])
+metrics.SUBPROCESS_EXITS.inc('ffmpeg', 'ok')
+metrics.HTTP_DURATION.observe(0.2, '/api/split', 'POST')
+"""
+
+
+def _value(text, line_start):
+    return [line.split()[-1] for line in text.splitlines() if line.startswith(line_start)]
+
+
+def test_render_sums_every_worker_sharing_the_store(tmp_path, monkeypatch):
+    path = str(tmp_path / 'metrics.sqlite3')
+    for _ in range(2):
+        subprocess.run([sys.executable, '-c', WORKER, path], cwd=ROOT, check=True)
+
+    monkeypatch.setattr(metrics, '_store', None)
+    metrics.use_store(path)
+    metrics.SUBPROCESS_EXITS.inc('ffmpeg', 'ok')
+    try:
+        text = metrics.render()
+    finally:
+        metrics.SUBPROCESS_EXITS._values.clear()
+
+    assert _value(text, 'cutfile_subprocess_exits_total{program="ffmpeg",status="ok"}') == ['3']
+    assert _value(text, 'cutfile_http_request_duration_seconds_count{route="/api/split",method="POST"}') == ['2']
+    assert _value(text, 'cutfile_http_request_duration_seconds_bucket{route="/api/split",method="POST",le="0.25"}') == ['2']
+
+
+def test_render_without_store_reports_this_process(monkeypatch):
+    monkeypatch.setattr(metrics, '_store', None)
+    metrics.SUBPROCESS_EXITS.inc('ffprobe', 'error', amount=2)
+    try:
+        text = metrics.render()
+    finally:
+        metrics.SUBPROCESS_EXITS._values.clear()
+    assert _value(text, 'cutfile_subprocess_exits_total{program="ffprobe",status="error"}') == ['2']
@@ -0,0 +1,56 @@
+import os
+import shutil
+
+import pytest
+
+import benchmark
+import media_probe
+import mp3_frames
+from conftest import run
+
+if shutil.which('ffprobe') is None:
+    pytest.skip('ffprobe is required for these tests', allow_module_level=True)
+
+
+@pytest.fixture(scope='session')
+def variants(tmp_path_factory):
+    """The encodings benchmark.py probe-check covers (no Xing header, ID3v1, MPEG-2/2.5, mono)."""
+    return benchmark.build_probe_variants(str(tmp_path_factory.mktemp('probe')))
+
+
+def _header_matches_ffprobe(path):
+    try:
+        info = mp3_frames.read_stream_info(path)
+    except mp3_frames.Mp3FormatError:
+        return  # falling back is always allowed; media_probe then uses ffprobe's answer
+    expected = media_probe.run_ffprobe(path)['duration']
+    assert info['duration'] == pytest.approx(expected, abs=media_probe.HEADER_PROBE_TOLERANCE), path
+
+
+@pytest.mark.parametrize('name', ['cbr', 'vbr', 'mono22'])
+def test_header_probe_matches_ffprobe(media, name):
+    # The lavfi fixtures all carry a Xing/Info header, so the header path must not fall back
+    assert mp3_frames.read_stream_info(media[name])['duration'] > 0
+    _header_matches_ffprobe(media[name])
+
+
+@pytest.mark.parametrize('name', sorted(benchmark.PROBE_VARIANTS))
+def test_header_probe_matches_ffprobe_on_variants(variants, name):
+    path = next(path for path in variants if os.path.basename(path) == f'{name}.mp3')
+    _header_matches_ffprobe(path)
+
+
+def test_probe_reads_format_and_tags_from_headers(media, tmp_path):
+    tagged = str(tmp_path / 'tagged.mp3')
+    result = run(['ffmpeg', '-y', '-v', 'error', '-i', media['cbr'], '-c', 'copy',
+                  '-metadata', 'title=Probe', '-metadata', 'artist=Tester', tagged])
+    assert result.returncode == 0, result.stderr
+    info = mp3_frames.read_stream_info(tagged)
+    assert (info['sample_rate'], info['channels'], info['codec']) == (44100, 2, 'mp3')
+    assert info['bitrate'] == pytest.approx(128000, rel=0.01)
+    assert info['tags']['title'] == 'Probe' and info['tags']['artist'] == 'Tester'
+
+    cached = media_probe.probe(tagged)
+    assert cached['duration'] == info['duration']
+    assert cached['tags'] == info['tags']
+    assert cached['size'] == os.path.getsize(tagged)
@@ -0,0 +1,41 @@
+import os
+import shutil
+
+import segment_cache
+
+
+def _export(media, tmp_path, name):
+    path = str(tmp_path / name)
+    shutil.copyfile(media['cbr'], path)
+    return path
+
+
+def test_unchanged_segment_is_reused(media, tmp_path):
+    key = segment_cache.segment_key(media['cbr'], 0, 2, ['unchanged'])
+    segment_cache.store(key, _export(media, tmp_path, 'first.mp3'))
+    again = str(tmp_path / 'again.mp3')
+    assert segment_cache.fetch(key, again)
+    with open(media['cbr'], 'rb') as a, open(again, 'rb') as b:
+        assert a.read() == b.read()
+
+
+def test_export_edited_in_place_is_not_served(media, tmp_path):
+    key = segment_cache.segment_key(media['cbr'], 0, 2, ['edited'])
+    exported = _export(media, tmp_path, 'exported.mp3')
+    segment_cache.store(key, exported)
+
+    # Retag the export in place; with a hard link this rewrites the cached blob as well
+    st = os.stat(exported)
+    with open(exported, 'r+b') as f:
+        f.seek(1000)
+        f.write(b'edited')
+    os.utime(exported, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+
+    again = str(tmp_path / 'again.mp3')
+    assert not segment_cache.fetch(key, again)
+    assert not os.path.exists(again)
+    # The edit survives; only the cache forgot the segment
+    with open(exported, 'rb') as f:
+        f.seek(1000)
+        assert f.read(6) == b'edited'
+    assert not segment_cache.fetch(key, again)
@@ -0,0 +1,65 @@
+import pytest
+
+import join_engine
+import mp3_frames
+import smart_render
+from conftest import decode_errors
+
+
+def _audio_seconds(index, first=True, last=True):
+    """Duration of a file's frames, less its encoder delay (first) and padding (last)."""
+    vbr = index.vbr_header or {}
+    samples = index.frame_count * index.samples_per_frame
+    if first:
+        samples -= vbr.get('encoder_delay') or 0
+    if last:
+        samples -= vbr.get('encoder_padding') or 0
+    return samples / index.sample_rate
+
+
+@pytest.mark.parametrize('names', [('cbr', 'vbr'), ('vbr', 'cbr', 'cbr_b')])
+@pytest.mark.parametrize('crossfade', [0.0, 1.5])
+def test_join_re_encodes_only_boundaries(media, tmp_path, names, crossfade):
+    inputs = [media[name] for name in names]
+    output = str(tmp_path / 'joined.mp3')
+    assert smart_render.join_files(inputs, output, crossfade) is None
+
+    assert decode_errors(output) == ''
+
+    indexes = [mp3_frames.build_index(path) for path in inputs]
+    joined = mp3_frames.build_index(output)
+    expected = sum(_audio_seconds(index) for index in indexes) - crossfade * (len(inputs) - 1)
+    # The output keeps the first input's delay and the last input's padding
+    first, last = indexes[0].vbr_header, indexes[-1].vbr_header
+    actual = (joined.frame_count * joined.samples_per_frame
+              - first['encoder_delay'] - last['encoder_padding']) / joined.sample_rate
+    # Each fade is rounded up by less than one frame to stay on the frame grid
+    assert expected - (len(inputs) - 1) * joined.frame_duration <= actual <= expected + 1e-6
+
+    xing = joined.vbr_header
+    assert xing is not None and xing['tag'] == 'Xing'
+    assert xing['frames'] == joined.frame_count
+    assert xing['bytes'] == joined.offsets[-1] - joined.tag_size
+
+
+def test_join_engine_uses_smart_render(media, tmp_path, monkeypatch):
+    calls = []
+    monkeypatch.setattr(join_engine, '_join_rendered', lambda *args, **kwargs: calls.append(args))
+    output = join_engine.join_files([media['cbr'], media['vbr']], str(tmp_path / 'out'), crossfade=1.0)
+    assert output.endswith('.mp3')
+    assert calls == []
+    assert decode_errors(output) == ''
+
+
+def test_mismatched_inputs_fall_back_to_full_render(media, tmp_path):
+    with pytest.raises(mp3_frames.Mp3FormatError):
+        smart_render.join_files([media['cbr'], media['mono22']], str(tmp_path / 'smart.mp3'), 1.0)
+
+    output = join_engine.join_files([media['cbr'], media['mono22']], str(tmp_path / 'out.mp3'), crossfade=1.0)
+    assert decode_errors(output) == ''
+    assert mp3_frames.build_index(output).duration == pytest.approx(6 + 4 - 1.0, abs=0.1)
+
+
+def test_crossfade_longer_than_an_input_is_rejected(media, tmp_path):
+    with pytest.raises(join_engine.JoinError):
+        join_engine.join_files([media['cbr'], media['mono22']], str(tmp_path / 'out.mp3'), crossfade=5.0)
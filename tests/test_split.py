@@ -0,0 +1,99 @@
+import pytest
+
+import loudness
+import mp3_frames
+import mp3_splitter
+import split_engine
+from conftest import decode_errors, run
+
+
+def _plan(tmp_path, backend, bounds):
+    return [{'start': start, 'end': end, 'path': str(tmp_path / f'{backend}_{i}.mp3')}
+            for i, (start, end) in enumerate(bounds)]
+
+
+@pytest.mark.parametrize('name, bounds', [
+    ('cbr', [(0, 2), (2, 4.5), (4.5, 6)]),
+    ('vbr', [(0, 2), (2, 4.5), (4.5, 7)]),
+])
+def test_native_split_matches_ffmpeg(media, tmp_path, name, bounds):
+    results = {}
+    for backend in ('native', 'ffmpeg'):
+        plan = _plan(tmp_path, backend, bounds)
+        assert split_engine.split_segments(media[name], plan, backend) == [(seg['path'], None) for seg in plan]
+        results[backend] = [mp3_frames.build_index(seg['path']) for seg in plan]
+        for seg in plan:
+            assert decode_errors(seg['path']) == ''
+
+    native, ffmpeg = results['native'], results['ffmpeg']
+    # Both cut on frame boundaries but may round a cut to neighbouring frames
+    assert sum(index.frame_count for index in native) == sum(index.frame_count for index in ffmpeg)
+    for (start, end), a, b in zip(bounds, native, ffmpeg):
+        assert abs(a.frame_count - b.frame_count) <= 1
+        assert a.duration == pytest.approx(end - start, abs=a.frame_duration)
+        # Every native segment carries its own Xing header with exact counts
+        assert a.vbr_header['frames'] == a.frame_count
+
+
+def test_non_mp3_input_is_encoded_to_mp3(tmp_path):
+    source = str(tmp_path / 'tone.m4a')
+    result = run(['ffmpeg', '-y', '-v', 'error', '-f', 'lavfi', '-i', 'sine=frequency=440:duration=4',
+                  '-c:a', 'aac', '-b:a', '96k', source])
+    if result.returncode != 0:
+        pytest.skip(f'ffmpeg cannot encode AAC here: {result.stderr}')
+
+    plan = _plan(tmp_path, 'auto', [(0, 1.5), (1.5, 4)])
+    assert split_engine.split_segments(source, plan, 'auto') == [(seg['path'], None) for seg in plan]
+    for seg in plan:
+        assert decode_errors(seg['path']) == ''
+        assert mp3_frames.build_index(seg['path']).duration == pytest.approx(seg['end'] - seg['start'], abs=0.1)
+
+
+@pytest.mark.parametrize('backend', ['ffmpeg', 'native'])
+def test_single_segment_is_not_cut_short(media, tmp_path, backend):
+    plan = _plan(tmp_path, backend, [(1, 21)])
+    assert split_engine.split_segments(media['long'], plan, backend) == [(plan[0]['path'], None)]
+    index = mp3_frames.build_index(plan[0]['path'])
+    assert index.duration == pytest.approx(20, abs=index.frame_duration)
+    assert decode_errors(plan[0]['path']) == ''
+
+
+def test_single_segment_of_non_mp3_input(tmp_path):
+    source = str(tmp_path / 'tone.wav')
+    result = run(['ffmpeg', '-y', '-v', 'error', '-f', 'lavfi', '-i', 'sine=frequency=440:duration=12', source])
+    assert result.returncode == 0, result.stderr
+
+    plan = _plan(tmp_path, 'auto', [(0, 10)])
+    assert split_engine.split_segments(source, plan, 'auto') == [(plan[0]['path'], None)]
+    assert mp3_frames.build_index(plan[0]['path']).duration == pytest.approx(10, abs=0.1)
+
+
+@pytest.mark.parametrize('workers', [2, 4])
+def test_parallel_split_keeps_full_segments(media, tmp_path, workers):
+    # With 4 workers every chunk holds a single segment
+    bounds = [(0, 6), (6, 12), (12, 18), (18, 24)]
+    plan = _plan(tmp_path, 'ffmpeg', bounds)
+    results = split_engine.split_segments(media['long'], plan, 'ffmpeg', workers=workers)
+    assert results == [(seg['path'], None) for seg in plan]
+    for seg in plan:
+        index = mp3_frames.build_index(seg['path'])
+        assert index.duration == pytest.approx(seg['end'] - seg['start'], abs=2 * index.frame_duration)
+        assert decode_errors(seg['path']) == ''
+
+
+def test_cli_jobs_write_full_segments(media, tmp_path):
+    # As many workers as segments, like the CLI's --jobs default on a short file
+    created, failed = mp3_splitter.split_mp3(media['long'], 10, str(tmp_path), 'ffmpeg', jobs=3)
+    assert (created, failed) == (3, [])
+    outputs = sorted(tmp_path.glob('*.mp3'), key=lambda path: int(path.name.split('_')[0]))
+    durations = [mp3_frames.build_index(str(path)).duration for path in outputs]
+    assert durations == [pytest.approx(10, abs=0.06), pytest.approx(10, abs=0.06), pytest.approx(4, abs=0.1)]
+
+
+def test_failed_loudness_measurement_leaves_no_placeholders(media, tmp_path, monkeypatch):
+    def measure(input_file):
+        raise loudness.LoudnessError('Could not measure loudness')
+    monkeypatch.setattr(loudness, 'measure', measure)
+    with pytest.raises(SystemExit):
+        mp3_splitter.split_mp3(media['long'], 10, str(tmp_path), 'ffmpeg', normalize=(-16.0, -1.5))
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,66 @@
+import hashlib
+import io
+import os
+import threading
+
+import pytest
+
+import uploads
+
+DATA = os.urandom(3 * 1024 * 1024)
+
+
+class _GatedStream(io.BytesIO):
+    """Request body that stalls after its first read until released."""
+
+    def __init__(self, data):
+        super().__init__(data)
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def read(self, size=-1):
+        data = super().read(size)
+        if not self.started.is_set():
+            self.started.set()
+            assert self.release.wait(10)
+        return data
+
+
+def test_workers_never_write_the_same_chunk_twice(tmp_path):
+    # Two managers on one folder stand in for two worker processes
+    first = uploads.UploadManager(str(tmp_path))
+    second = uploads.UploadManager(str(tmp_path))
+    upload = first.init('talk.mp3', len(DATA), hashlib.sha256(DATA).hexdigest())
+
+    slow = _GatedStream(DATA)
+    results = {}
+    writer = threading.Thread(target=lambda: results.setdefault(
+        'first', first.write_chunk(upload.id, 0, slow, len(DATA))))
+    writer.start()
+    assert slow.started.wait(10)
+
+    # A client retry of the same chunk reaches the other worker while the first is mid-write
+    retry = threading.Thread(target=lambda: results.setdefault(
+        'second', second.write_chunk(upload.id, 0, io.BytesIO(DATA), len(DATA))))
+    retry.start()
+    retry.join(0.3)
+    assert retry.is_alive(), 'the retry must wait for the chunk being written'
+
+    slow.release.set()
+    writer.join(10)
+    retry.join(10)
+    assert results == {'first': len(DATA), 'second': len(DATA)}
+
+    done = second.finish(upload.id)
+    with open(done.path, 'rb') as f:
+        assert f.read() == DATA
+
+
+def test_abort_removes_the_lock_file(tmp_path):
+    manager = uploads.UploadManager(str(tmp_path))
+    upload = manager.init('talk.mp3', 10)
+    manager.write_chunk(upload.id, 0, io.BytesIO(b'01234'), 5)
+    manager.abort(upload.id)
+    assert os.listdir(manager.partial_dir) == []
+    with pytest.raises(uploads.UploadError):
+        manager.get(upload.id)
@@ -0,0 +1,22 @@
+import os
+
+import pytest
+
+import waveform
+
+pytest.importorskip('numpy')
+
+
+def test_peak_files_are_evicted_least_recently_used_first(media, monkeypatch):
+    paths = {name: waveform.ensure_pyramid(media[name]) for name in ('cbr', 'vbr')}
+    # Room for two files: building a third evicts the least recently read one
+    monkeypatch.setattr(waveform, 'MAX_CACHE_BYTES', os.path.getsize(paths['cbr']) * 5 // 2)
+    waveform.read_window(media['cbr'], 0, 1)
+    newest = waveform.ensure_pyramid(media['cbr_b'])
+
+    assert os.path.exists(newest)
+    assert os.path.exists(paths['cbr'])
+    assert not os.path.exists(paths['vbr'])
+    # An evicted file is built again on its next use
+    level_ms, first, data = waveform.read_window(media['vbr'], 0, 1)
+    assert first == 0 and len(data) == 1000 // level_ms * waveform.PEAK_SIZE
@@ -0,0 +1,91 @@
+import io
+import struct
+import zipfile
+
+import pytest
+
+import mp3_frames
+import split_engine
+from conftest import decode_errors
+
+# ZIP64 extended information extra field
+ZIP64_EXTRA_ID = 0x0001
+LOCAL_HEADER = struct.Struct('<4s5H3L2H')
+
+
+def _local_extra(data, info):
+    """The extra field block of info's local file header in the archive bytes."""
+    fields = LOCAL_HEADER.unpack_from(data, info.header_offset)
+    assert fields[0] == b'PK\x03\x04'
+    name_length, extra_length = fields[-2:]
+    start = info.header_offset + LOCAL_HEADER.size + name_length
+    return data[start:start + extra_length]
+
+
+def _zip64_extra(extra):
+    """True when a ZIP extra field block contains a ZIP64 record."""
+    pos = 0
+    while pos + 4 <= len(extra):
+        header_id, size = struct.unpack_from('<HH', extra, pos)
+        if header_id == ZIP64_EXTRA_ID:
+            return True
+        pos += 4 + size
+    return False
+
+
+@pytest.mark.parametrize('backend', ['native', 'ffmpeg'])
+def test_split_zip_is_a_valid_zip64_archive(media, tmp_path, client, backend):
+    bounds = [(0, 2), (2, 4.5), (4.5, 7)]
+    response = client.post('/api/split-zip', json={
+        'inputFile': media['vbr'],
+        'backend': backend,
+        'segments': [{'start': start, 'end': end, 'outputName': f'part_{i + 1}'}
+                     for i, (start, end) in enumerate(bounds)],
+    })
+    assert response.status_code == 200
+    assert response.mimetype == 'application/zip'
+    data = response.get_data()
+
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        assert archive.testzip() is None
+        infos = archive.infolist()
+        assert [info.filename for info in infos] == ['part_1.mp3', 'part_2.mp3', 'part_3.mp3']
+        for info, (start, end) in zip(infos, bounds):
+            assert info.compress_type == zipfile.ZIP_STORED
+            # Sizes are unknown while streaming, so every member is written as ZIP64 up front
+            assert _zip64_extra(_local_extra(data, info))
+            path = tmp_path / info.filename
+            path.write_bytes(archive.read(info))
+            assert decode_errors(str(path)) == ''
+            index = mp3_frames.build_index(str(path))
+            # Piped from ffmpeg a member can start with one more frame than the native cut
+            assert index.duration == pytest.approx(end - start, abs=2 * index.frame_duration)
+
+    if backend == 'native':
+        # The streamed members are byte for byte what a native split writes
+        plan = [{'start': start, 'end': end, 'path': str(tmp_path / f'native_{i}.mp3')}
+                for i, (start, end) in enumerate(bounds)]
+        split_engine.split_segments(media['vbr'], plan, backend)
+        with zipfile.ZipFile(io.BytesIO(data)) as archive:
+            for info, seg in zip(archive.infolist(), plan):
+                with open(seg['path'], 'rb') as f:
+                    assert archive.read(info) == f.read()
+
+
+def test_split_zip_check_only_validates(media, client):
+    response = client.post('/api/split-zip', json={
+        'inputFile': media['cbr'], 'check': True,
+        'segments': [{'start': 0, 'end': 2, 'outputName': 'a'}, {'start': 2, 'end': 4, 'outputName': 'b'}],
+    })
+    assert response.status_code == 200
+    assert response.get_json() == {'success': True, 'segments': 2}
+
+    response = client.post('/api/split-zip', json={'inputFile': media['cbr'], 'check': True, 'segments': []})
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize('plan', ['{not json', '[1, 2]'])
+def test_split_zip_rejects_a_malformed_form_plan(client, plan):
+    response = client.post('/api/split-zip', data={'plan': plan})
+    assert response.status_code == 400
+    assert response.get_json() == {'error': 'Invalid plan'}
@@ -0,0 +1,392 @@
+import contextlib
+import errno
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+
+from werkzeug.utils import secure_filename
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# Largest chunk body accepted by one request
+MAX_CHUNK_BYTES = 64 * 1024 * 1024
+# Chunk size suggested to clients
+DEFAULT_CHUNK_BYTES = 8 * 1024 * 1024
+# Bytes copied from the request stream per write
+WRITE_BUFFER_BYTES = 1024 * 1024
+# Largest file accepted (override with CUTFILE_MAX_UPLOAD_MB)
+MAX_UPLOAD_BYTES = int(float(os.environ.get('CUTFILE_MAX_UPLOAD_MB', 8192)) * 1024 * 1024)
+# Uploads untouched for this many seconds are deleted (override with CUTFILE_UPLOAD_TTL)
+UPLOAD_TTL_SECONDS = float(os.environ.get('CUTFILE_UPLOAD_TTL', 24 * 3600))
+# Minimum seconds between two sweeps for abandoned uploads
+SWEEP_INTERVAL_SECONDS = 300
+
+
+class UploadError(Exception):
+    """Raised when an upload request cannot be honoured; status is the HTTP code to answer with."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class OffsetMismatch(UploadError):
+    """Raised when a chunk does not start where the upload left off."""
+
+    def __init__(self, offset):
+        super().__init__(f'Expected a chunk at offset {offset}', 409)
+        self.offset = offset
+
+
+class Upload:
+    """State of one upload; persisted next to its data so it survives a restart."""
+
+    def __init__(self, id, filename, size, sha256=None, offset=0, updated=None, path=None):
+        self.id = id
+        self.filename = filename
+        self.size = size
+        self.sha256 = sha256
+        self.offset = offset
+        self.updated = updated or time.time()
+        self.path = path
+        self.lock = threading.Lock()
+        # Running digest of bytes [0, _hashed); rebuilt from disk after a restart
+        self._hasher = None
+        self._hashed = 0
+
+    def to_dict(self):
+        return {
+            'uploadId': self.id,
+            'filename': self.filename,
+            'size': self.size,
+            'offset': self.offset,
+            'complete': self.path is not None,
+            'path': self.path
+        }
+
+    def _record(self):
+        return {'id': self.id, 'filename': self.filename, 'size': self.size, 'sha256': self.sha256,
+                'offset': self.offset, 'updated': self.updated, 'path': self.path}
+
+
+class UploadManager:
+    """Chunked, resumable uploads written straight into a preallocated file.
+
+    init() reserves the file, write_chunk() copies one request body to its
+    offset while hashing it, and finish() checks size and SHA-256 before
+    moving the file to <folder>/<id>/<filename>. The upload offset is
+    saved after every chunk, so a client whose connection dropped can ask
+    get() where to continue, from any worker process. Writes, finish and
+    abort hold the upload's lock file, so two workers never claim the
+    same offset.
+    """
+
+    def __init__(self, folder):
+        self.folder = os.path.abspath(folder)
+        self.partial_dir = os.path.join(self.folder, '.partial')
+        os.makedirs(self.partial_dir, exist_ok=True)
+        self._uploads = {}
+        self._lock = threading.Lock()
+        self._last_sweep = 0
+
+    def _part_path(self, upload_id):
+        return os.path.join(self.partial_dir, upload_id + '.part')
+
+    def _meta_path(self, upload_id):
+        return os.path.join(self.partial_dir, upload_id + '.json')
+
+    def _lock_path(self, upload_id):
+        return os.path.join(self.partial_dir, upload_id + '.lock')
+
+    @contextlib.contextmanager
+    def _claim(self, upload_id, blocking=True):
+        """Holds an upload against other threads and worker processes; yields it as last saved.
+
+        Non-blocking, yields None when someone else holds it.
+        """
+        upload = self.get(upload_id)
+        if not upload.lock.acquire(blocking):
+            yield None
+            return
+        try:
+            with _file_lock(self._lock_path(upload_id), blocking) as locked:
+                # Another worker may have written or finished it while we waited
+                yield self.get(upload_id) if locked else None
+        finally:
+            upload.lock.release()
+
+    def _save(self, upload):
+        upload.updated = time.time()
+        meta_path = self._meta_path(upload.id)
+        temp_path = meta_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(upload._record(), f)
+        os.replace(temp_path, meta_path)
+
+    def _discard(self, upload_id):
+        with self._lock:
+            self._uploads.pop(upload_id, None)
+        for path in (self._part_path(upload_id), self._meta_path(upload_id)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        try:
+            os.remove(self._lock_path(upload_id))
+        except OSError:
+            pass  # still open on Windows; the next sweep removes it
+
+    def get(self, upload_id):
+        """Returns the upload as last saved; raises UploadError (404) if unknown.
+
+        The record is re-read on every call because chunks of one upload
+        may reach different worker processes.
+        """
+        # Ids are our own uuid4 hex, so anything else never names a file
+        if len(upload_id) != 32 or not all(c in '0123456789abcdef' for c in upload_id):
+            raise UploadError('Upload not found', 404)
+        try:
+            with open(self._meta_path(upload_id), encoding='utf-8') as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            with self._lock:
+                self._uploads.pop(upload_id, None)
+            raise UploadError('Upload not found', 404)
+        with self._lock:
+            upload = self._uploads.get(upload_id)
+            if upload is None:
+                upload = Upload(record['id'], record['filename'], record['size'])
+                self._uploads[upload_id] = upload
+            upload.sha256 = record.get('sha256')
+            upload.offset = record['offset']
+            upload.updated = record['updated']
+            upload.path = record.get('path')
+            return upload
+
+    def init(self, filename, size, sha256=None):
+        """Reserves space for a new upload and returns it."""
+        self.sweep()
+        name = secure_filename(os.path.basename(filename or ''))
+        if not name:
+            raise UploadError('A file name is required')
+        if not isinstance(size, int) or size < 0:
+            raise UploadError('size must be a non-negative integer')
+        if size > MAX_UPLOAD_BYTES:
+            raise UploadError(f'File is larger than the {MAX_UPLOAD_BYTES // (1024 * 1024)} MB limit', 413)
+        if sha256 is not None:
+            sha256 = str(sha256).lower()
+
+        upload = Upload(uuid.uuid4().hex, name, size, sha256)
+        try:
+            with open(self._part_path(upload.id), 'wb') as f:
+                _preallocate(f, size)
+            self._save(upload)
+        except OSError as e:
+            self._discard(upload.id)
+            if e.errno in (errno.ENOSPC, errno.EFBIG):
+                raise UploadError('Not enough disk space for this upload', 507)
+            raise
+        with self._lock:
+            self._uploads[upload.id] = upload
+        return upload
+
+    def write_chunk(self, upload_id, offset, stream, length):
+        """Copies length bytes from stream into the upload at offset.
+
+        A chunk may start before the current offset (a retry of data that
+        already arrived); the overlap is read and dropped. A chunk starting
+        past the offset raises OffsetMismatch. Whatever arrives before a
+        dropped connection is kept. Returns the new offset.
+        """
+        if length > MAX_CHUNK_BYTES:
+            raise UploadError(f'Chunks may be at most {MAX_CHUNK_BYTES} bytes', 413)
+        with self._claim(upload_id) as upload:
+            if upload.path is not None:
+                raise UploadError('Upload is already complete', 409)
+            if offset < 0 or offset > upload.offset:
+                raise OffsetMismatch(upload.offset)
+            if offset + length > upload.size:
+                raise UploadError('Chunk runs past the declared file size', 416)
+
+            skip = min(upload.offset - offset, length)
+            remaining = length
+            hasher = self._running_hash(upload, rebuild=False)
+            try:
+                while skip > 0:
+                    data = stream.read(min(WRITE_BUFFER_BYTES, skip))
+                    if not data:
+                        return upload.offset
+                    skip -= len(data)
+                    remaining -= len(data)
+                with open(self._part_path(upload_id), 'r+b') as f:
+                    f.seek(upload.offset)
+                    while remaining > 0:
+                        data = stream.read(min(WRITE_BUFFER_BYTES, remaining))
+                        if not data:
+                            break
+                        f.write(data)
+                        if hasher is not None:
+                            hasher.update(data)
+                        remaining -= len(data)
+                        upload.offset += len(data)
+                        if hasher is not None:
+                            upload._hashed = upload.offset
+            finally:
+                # The file is flushed by close() before the new offset is recorded
+                self._save(upload)
+            return upload.offset
+
+    def _running_hash(self, upload, rebuild):
+        """The upload's running SHA-256 over bytes [0, offset).
+
+        It is only valid while this process has seen every chunk. Otherwise
+        (another worker took some, or a restart) it is None until finish()
+        rebuilds it from the file in one pass.
+        """
+        if upload._hasher is not None and upload._hashed == upload.offset:
+            return upload._hasher
+        upload._hasher = None
+        if upload.offset == 0 or rebuild:
+            hasher = hashlib.sha256()
+            with open(self._part_path(upload.id), 'rb') as f:
+                remaining = upload.offset
+                while remaining > 0:
+                    data = f.read(min(WRITE_BUFFER_BYTES, remaining))
+                    if not data:
+                        break
+                    hasher.update(data)
+                    remaining -= len(data)
+            upload._hasher = hasher
+            upload._hashed = upload.offset
+        return upload._hasher
+
+    def finish(self, upload_id):
+        """Verifies a fully received upload and moves it into place; returns the upload.
+
+        Calling it again for a completed upload returns the same result, so
+        a client that lost the first response can simply retry.
+        """
+        with self._claim(upload_id) as upload:
+            if upload.path is not None:
+                return upload
+            if upload.offset != upload.size:
+                raise UploadError(f'Upload is incomplete ({upload.offset} of {upload.size} bytes)', 409)
+            digest = self._running_hash(upload, rebuild=True).hexdigest()
+            if upload.sha256 and digest != upload.sha256:
+                self._discard(upload_id)
+                raise UploadError('Checksum mismatch; the upload was discarded', 422)
+
+            part_path = self._part_path(upload_id)
+            with open(part_path, 'r+b') as f:
+                os.fsync(f.fileno())
+            final_dir = os.path.join(self.folder, upload_id)
+            os.makedirs(final_dir, exist_ok=True)
+            final_path = os.path.join(final_dir, upload.filename)
+            os.replace(part_path, final_path)
+            upload.sha256 = digest
+            upload.path = final_path
+            self._save(upload)
+            return upload
+
+    def abort(self, upload_id):
+        """Deletes an unfinished upload."""
+        with self._claim(upload_id) as upload:
+            if upload.path is not None:
+                raise UploadError('Upload is already complete', 409)
+            self._discard(upload_id)
+
+    def sweep(self, force=False):
+        """Deletes unfinished uploads idle for longer than UPLOAD_TTL_SECONDS.
+
+        Records of completed uploads expire the same way; the uploaded files
+        themselves are kept.
+        """
+        now = time.time()
+        if not force and now - self._last_sweep < SWEEP_INTERVAL_SECONDS:
+            return
+        self._last_sweep = now
+        try:
+            names = os.listdir(self.partial_dir)
+        except OSError:
+            return
+        upload_ids = {name[:-5] for name in names if name.endswith(('.part', '.json', '.lock'))}
+        for upload_id in upload_ids:
+            try:
+                upload = self.get(upload_id)
+            except UploadError:
+                # Data (or a lock file) without a record can never be resumed
+                mtimes = []
+                for path in (self._part_path(upload_id), self._lock_path(upload_id)):
+                    try:
+                        mtimes.append(os.path.getmtime(path))
+                    except OSError:
+                        pass
+                if mtimes and now - max(mtimes) > UPLOAD_TTL_SECONDS:
+                    self._discard(upload_id)
+                continue
+            if now - upload.updated > UPLOAD_TTL_SECONDS:
+                try:
+                    with self._claim(upload_id, blocking=False) as claimed:
+                        # Skipped while a chunk is being written, here or in another worker
+                        if claimed is not None and now - claimed.updated > UPLOAD_TTL_SECONDS:
+                            self._discard(upload_id)
+                except UploadError:
+                    pass  # discarded meanwhile
+
+
+@contextlib.contextmanager
+def _file_lock(path, blocking=True):
+    """Exclusive lock on path, held against other processes; yields False when not blocking and taken."""
+    with open(path, 'a+b') as f:
+        try:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            else:
+                f.seek(0)
+                while True:
+                    try:
+                        msvcrt.locking(f.fileno(), msvcrt.LK_LOCK if blocking else msvcrt.LK_NBLCK, 1)
+                        break
+                    except OSError:
+                        if not blocking:
+                            raise
+                        # LK_LOCK gives up after about 10 s; a long chunk can take longer
+        except OSError:
+            if blocking:
+                raise
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def _preallocate(f, size):
+    """Reserves size bytes for f up front, so a full disk fails at init instead of mid-upload."""
+    if size == 0:
+        return
+    free = shutil.disk_usage(os.path.dirname(f.name)).free
+    if size > free:
+        raise OSError(errno.ENOSPC, 'Not enough disk space')
+    if hasattr(os, 'posix_fallocate'):
+        try:
+            os.posix_fallocate(f.fileno(), 0, size)
+            return
+        except OSError as e:
+            if e.errno not in (errno.EINVAL, errno.EOPNOTSUPP):
+                raise
+    # Sparse fallback (e.g. Windows or filesystems without fallocate)
+    f.truncate(size)
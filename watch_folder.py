@@ -0,0 +1,457 @@
+import argparse
+import ctypes
+import ctypes.util
+import fnmatch
+import json
+import os
+import queue
+import select
+import signal
+import string
+import struct
+import sys
+import threading
+import time
+
+import loudness
+import silence
+from media_probe import list_media_files
+from mp3_splitter import split_mp3
+from split_engine import BACKENDS
+
+# A file is split once its size and mtime have not changed for this many seconds
+DEFAULT_SETTLE_SECONDS = 10.0
+# Seconds between directory scans when polling
+DEFAULT_POLL_SECONDS = 5.0
+# With inotify, a full rescan still runs this often to catch missed events (e.g. writes over SMB/NFS)
+RESCAN_SECONDS = 300.0
+# Files waiting to be split; when full, new recordings stay pending instead of piling up
+DEFAULT_QUEUE_SIZE = 16
+# Default state file, created in the first watched folder
+STATE_NAME = '.cutfile_watch_state.json'
+
+# inotify(7) constants
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+EVENT_HEADER = struct.Struct('iIII')  # wd, mask, cookie, name length
+
+
+class InotifyWatcher:
+    """Directory change events from Linux inotify, via ctypes (no extra packages).
+
+    Raises OSError when inotify is not available, so callers can fall back
+    to polling.
+    """
+
+    def __init__(self, folders, recursive=False):
+        if not sys.platform.startswith('linux'):
+            raise OSError('inotify is only available on Linux')
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.recursive = recursive
+        self._dirs = {}
+        self.overflowed = False
+        for folder in folders:
+            self._add_tree(folder)
+
+    def _add(self, folder):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(folder), WATCH_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f'Cannot watch {folder}')
+        self._dirs[wd] = folder
+
+    def _add_tree(self, folder):
+        self._add(folder)
+        if self.recursive:
+            for root, dirs, _ in os.walk(folder):
+                for name in dirs:
+                    self._add(os.path.join(root, name))
+
+    def read(self, timeout):
+        """Paths of MP3s touched since the last call; waits up to timeout seconds for the first event."""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        paths = []
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            name = data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b'\0')
+            offset += EVENT_HEADER.size + length
+            if mask & IN_Q_OVERFLOW:
+                self.overflowed = True  # events were lost; the caller rescans
+                continue
+            folder = self._dirs.get(wd)
+            if folder is None or not name:
+                continue
+            path = os.path.join(folder, os.fsdecode(name))
+            if mask & IN_ISDIR:
+                if self.recursive and mask & (IN_CREATE | IN_MOVED_TO):
+                    try:
+                        self._add_tree(path)
+                    except OSError:
+                        pass
+                    # Files may have landed before the watch existed
+                    paths.extend(p for _, p, _ in list_media_files(path, True))
+            elif path.lower().endswith('.mp3'):
+                paths.append(path)
+        return paths
+
+    def close(self):
+        os.close(self.fd)
+
+
+class WatchState:
+    """JSON record of processed recordings, keyed by path, size and mtime.
+
+    A file is split again only when it changes; the record is rewritten
+    atomically after every file, so a restart picks up where it stopped.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._files = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            try:
+                with open(path, encoding='utf-8') as f:
+                    self._files = json.load(f).get('files', {})
+            except (OSError, ValueError) as e:
+                print(f"Warning: ignoring unreadable state file {path}: {e}", file=sys.stderr)
+
+    def is_done(self, path, st):
+        record = self._files.get(path)
+        return record is not None and record['size'] == st.st_size and record['mtimeNs'] == st.st_mtime_ns
+
+    def output_dirs(self):
+        """Output folders of every recorded split."""
+        with self._lock:
+            return {record['outputDir'] for record in self._files.values() if record.get('outputDir')}
+
+    def record(self, path, st, **details):
+        with self._lock:
+            self._files[path] = dict(details, size=st.st_size, mtimeNs=st.st_mtime_ns, finished=time.time())
+            temp_path = self.path + '.tmp'
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump({'files': self._files}, f, indent=1)
+            os.replace(temp_path, self.path)
+
+
+def load_rules(path):
+    """Reads splitting rules: a JSON list of objects, first match wins.
+
+    Each rule has 'pattern' (a glob matched against the file name and the
+    path relative to its watched folder) and any of 'segmentLength',
+    'outputDir' (may use {folder}, {stem} and {name}), 'backend',
+    'splitOnSilence', 'silenceThreshold', 'minSilence', 'normalize' and
+    'skip'. Unset keys use the command line defaults.
+    """
+    with open(path, encoding='utf-8') as f:
+        rules = json.load(f)
+    if not isinstance(rules, list) or not all(isinstance(rule, dict) and rule.get('pattern') for rule in rules):
+        raise ValueError(f"{path}: expected a list of rules, each with a 'pattern'")
+    return rules
+
+
+def check_output_template(template):
+    """Raises ValueError for an 'outputDir' template that cannot be used.
+
+    Besides unknown fields, that is one putting segments straight into the
+    recording's folder, where they could not be told apart from new
+    recordings.
+    """
+    for _, field, _, _ in string.Formatter().parse(template):
+        if field is not None and field not in ('folder', 'stem', 'name'):
+            raise ValueError(f"Unknown field {{{field}}} in outputDir {template!r}")
+    if os.path.normpath(template.replace('{folder}', 'F')) == 'F':
+        raise ValueError(f"outputDir {template!r} writes segments into the watched folder itself")
+
+
+def match_rule(rules, relative_path):
+    name = os.path.basename(relative_path)
+    for rule in rules:
+        if fnmatch.fnmatch(name, rule['pattern']) or fnmatch.fnmatch(relative_path, rule['pattern']):
+            return rule
+    return {}
+
+
+class WatchDaemon:
+    """Watches folders for new MP3s and splits each one once it stops changing.
+
+    New paths come from inotify or from polling scans. A file becomes ready
+    when its size and mtime are the same for settle seconds; ready files go
+    onto a bounded queue read by `workers` threads calling split_mp3.
+    """
+
+    def __init__(self, folders, state, options, rules=(), recursive=False, output_root=None, workers=1,
+                 settle=DEFAULT_SETTLE_SECONDS, poll=DEFAULT_POLL_SECONDS, queue_size=DEFAULT_QUEUE_SIZE,
+                 use_inotify=True):
+        self.folders = [os.path.abspath(folder) for folder in folders]
+        self.state = state
+        self.options = options
+        self.rules = list(rules)
+        self.recursive = recursive
+        self.output_root = os.path.abspath(output_root) if output_root else None
+        for rule in self.rules:
+            if rule.get('outputDir'):
+                check_output_template(rule['outputDir'])
+        # Folders rule templates expanded to; what appears there is the daemon's own output
+        self._output_dirs = state.output_dirs() if state is not None else set()
+        self.settle = settle
+        self.poll = poll
+        self.queue = queue.Queue(maxsize=max(1, queue_size))
+        self.workers = max(1, workers)
+        self.use_inotify = use_inotify
+        self.stopping = threading.Event()
+        # path -> (size, mtime_ns, monotonic time the pair was first seen)
+        self._pending = {}
+        self._queued = set()
+        self._lock = threading.Lock()
+
+    def _folder_of(self, path):
+        return next((folder for folder in self.folders if path.startswith(folder + os.sep)), None)
+
+    def _output_dir(self, path, rule):
+        folder = self._folder_of(path) or os.path.dirname(path)
+        stem = os.path.splitext(os.path.basename(path))[0]
+        template = rule.get('outputDir')
+        if template:
+            return os.path.abspath(template.format(folder=os.path.dirname(path), stem=stem,
+                                                   name=os.path.basename(path)))
+        # Next to the watched folder rather than inside it, so outputs are never picked up as recordings
+        root = self.output_root or folder.rstrip(os.sep) + '_segments'
+        return os.path.join(root, os.path.dirname(os.path.relpath(path, folder)), stem)
+
+    def _is_output(self, path):
+        roots = [self.output_root] if self.output_root else [folder + '_segments' for folder in self.folders]
+        if any(path.startswith(root + os.sep) for root in roots):
+            return True
+        with self._lock:
+            return os.path.dirname(path) in self._output_dirs
+
+    def observe(self, path):
+        """Notes a path that may have changed; it is checked on the next tick."""
+        path = os.path.abspath(path)
+        if self._is_output(path):
+            return
+        with self._lock:
+            if path not in self._queued and path not in self._pending:
+                self._pending[path] = None
+
+    def scan(self):
+        for folder in self.folders:
+            try:
+                for _, path, _ in list_media_files(folder, self.recursive):
+                    self.observe(path)
+            except OSError as e:
+                print(f"Warning: cannot scan {folder}: {e}", file=sys.stderr)
+
+    def tick(self):
+        """Moves files whose size and mtime have settled onto the work queue."""
+        now = time.monotonic()
+        with self._lock:
+            pending = list(self._pending.items())
+        for path, seen in pending:
+            try:
+                st = os.stat(path)
+            except OSError:
+                with self._lock:
+                    self._pending.pop(path, None)  # deleted or renamed away
+                continue
+            if self.state.is_done(path, st):
+                with self._lock:
+                    self._pending.pop(path, None)
+                continue
+            signature = (st.st_size, st.st_mtime_ns)
+            if seen is None or seen[:2] != signature:
+                with self._lock:
+                    self._pending[path] = signature + (now,)
+                continue
+            if st.st_size == 0 or now - seen[2] < self.settle:
+                continue
+            try:
+                self.queue.put_nowait(path)
+            except queue.Full:
+                break  # backpressure: keep the rest pending until a worker frees a slot
+            with self._lock:
+                self._pending.pop(path, None)
+                self._queued.add(path)
+            print(f"Queued: {path}")
+
+    def _process(self, path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return
+        folder = self._folder_of(path) or os.path.dirname(path)
+        rule = match_rule(self.rules, os.path.relpath(path, folder))
+        if rule.get('skip'):
+            self.state.record(path, st, status='skipped')
+            return
+
+        options = dict(self.options)
+        options.update((key, rule[key]) for key in options if key in rule)
+        normalize = options['normalize']
+        if normalize is True:
+            normalize = (loudness.DEFAULT_TARGET_LUFS, loudness.DEFAULT_TRUE_PEAK)
+        elif isinstance(normalize, dict):
+            normalize = (float(normalize.get('targetLufs', loudness.DEFAULT_TARGET_LUFS)),
+                         float(normalize.get('truePeak', loudness.DEFAULT_TRUE_PEAK)))
+        output_dir = self._output_dir(path, rule)
+        if rule.get('outputDir'):
+            # Registered before the first segment is written, so none of them is taken for a recording
+            with self._lock:
+                self._output_dirs.add(output_dir)
+        try:
+            created, failed = split_mp3(path, float(options['segmentLength']), output_dir, options['backend'],
+                                        options['jobs'], bool(options['splitOnSilence']),
+                                        options['silenceThreshold'], options['minSilence'], normalize or None)
+        except SystemExit:
+            # split_mp3 exits on fatal errors and has already printed why
+            self.state.record(path, st, status='failed', outputDir=output_dir)
+            return
+        except Exception as e:
+            print(f"Error splitting {path}: {e}", file=sys.stderr)
+            self.state.record(path, st, status='failed', outputDir=output_dir, error=str(e))
+            return
+        status = 'done' if not failed else 'partial' if created else 'failed'
+        self.state.record(path, st, status=status, outputDir=output_dir,
+                          created=created, failedSegments=failed)
+
+    def _worker(self):
+        while True:
+            path = self.queue.get()
+            if path is None:
+                return
+            try:
+                if not self.stopping.is_set():
+                    self._process(path)
+            finally:
+                with self._lock:
+                    self._queued.discard(path)
+
+    def run(self):
+        """Watches until stop() is called (or SIGINT/SIGTERM in the main thread)."""
+        workers = [threading.Thread(target=self._worker, name=f'watch-{i}', daemon=True)
+                   for i in range(self.workers)]
+        for worker in workers:
+            worker.start()
+
+        watcher = None
+        if self.use_inotify:
+            try:
+                watcher = InotifyWatcher(self.folders, self.recursive)
+            except OSError as e:
+                print(f"inotify unavailable ({e}); polling every {self.poll:g}s.")
+        mode = 'inotify' if watcher is not None else f'polling every {self.poll:g}s'
+        print(f"Watching {', '.join(self.folders)} ({mode}); files settle after {self.settle:g}s.")
+
+        self.scan()
+        last_scan = time.monotonic()
+        try:
+            while not self.stopping.is_set():
+                if watcher is not None:
+                    # Wake at least once a second so settling files are re-checked
+                    for path in watcher.read(1.0):
+                        self.observe(path)
+                    rescan_every = 0 if watcher.overflowed else RESCAN_SECONDS
+                    watcher.overflowed = False
+                else:
+                    self.stopping.wait(min(1.0, self.poll))
+                    rescan_every = self.poll
+                if time.monotonic() - last_scan >= rescan_every:
+                    self.scan()
+                    last_scan = time.monotonic()
+                self.tick()
+        finally:
+            if watcher is not None:
+                watcher.close()
+            # Workers finish the file they are on; queued files stay unprocessed for the next run
+            self.stopping.set()
+            for _ in workers:
+                while True:
+                    try:
+                        self.queue.get_nowait()
+                    except queue.Empty:
+                        break
+                self.queue.put(None)
+            for worker in workers:
+                worker.join()
+
+    def stop(self, *_):
+        self.stopping.set()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Watch folders and split new MP3 recordings as they arrive.")
+    parser.add_argument("folders", nargs='+', help="Folders to watch.")
+    parser.add_argument("--segment-length", type=float, default=30.0, help="Segment length in seconds (default: 30).")
+    parser.add_argument("--output-dir",
+                        help="Root folder for segments (default: <watched folder>_segments/<recording name>/).")
+    parser.add_argument("--rules", help="JSON file with per-pattern rules (see load_rules).")
+    parser.add_argument("--state", help=f"State file of processed recordings (default: <first folder>/{STATE_NAME}).")
+    parser.add_argument("--recursive", action="store_true", help="Also watch subfolders.")
+    parser.add_argument("--backend", choices=BACKENDS, default='ffmpeg', help="Cutting backend (default: ffmpeg).")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1,
+                        help="ffmpeg passes per recording (default: CPU count).")
+    parser.add_argument("--workers", type=int, default=1, help="Recordings split at the same time (default: 1).")
+    parser.add_argument("--queue-size", type=int, default=DEFAULT_QUEUE_SIZE,
+                        help=f"Ready recordings waiting for a worker (default: {DEFAULT_QUEUE_SIZE}).")
+    parser.add_argument("--settle", type=float, default=DEFAULT_SETTLE_SECONDS,
+                        help=f"Seconds a file must stay unchanged before it is split (default: {DEFAULT_SETTLE_SECONDS:g}).")
+    parser.add_argument("--poll", action="store_true",
+                        help="Poll instead of using inotify (needed for some network shares).")
+    parser.add_argument("--poll-interval", type=float, default=DEFAULT_POLL_SECONDS,
+                        help=f"Seconds between scans when polling (default: {DEFAULT_POLL_SECONDS:g}).")
+    parser.add_argument("--split-on-silence", action="store_true", help="Cut at the nearest pauses (needs NumPy).")
+    parser.add_argument("--normalize", action="store_true", help="Normalize loudness of the segments (re-encodes).")
+    args = parser.parse_args()
+
+    for folder in args.folders:
+        if not os.path.isdir(folder):
+            print(f"Error: '{folder}' is not a folder.", file=sys.stderr)
+            sys.exit(1)
+    rules = ()
+    if args.rules:
+        try:
+            rules = load_rules(args.rules)
+        except (OSError, ValueError) as e:
+            print(f"Error: {e}", file=sys.stderr)
+            sys.exit(1)
+
+    options = {
+        'segmentLength': args.segment_length,
+        'backend': args.backend,
+        'jobs': args.jobs,
+        'splitOnSilence': args.split_on_silence,
+        'silenceThreshold': silence.DEFAULT_THRESHOLD_DB,
+        'minSilence': silence.DEFAULT_MIN_SILENCE,
+        'normalize': args.normalize,
+    }
+    state = WatchState(args.state or os.path.join(args.folders[0], STATE_NAME))
+    try:
+        daemon = WatchDaemon(args.folders, state, options, rules, args.recursive, args.output_dir, args.workers,
+                             args.settle, args.poll_interval, args.queue_size, use_inotify=not args.poll)
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+    signal.signal(signal.SIGINT, daemon.stop)
+    signal.signal(signal.SIGTERM, daemon.stop)
+    daemon.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+import hashlib
+import os
+import sqlite3
+import struct
+import subprocess
+import threading
+import time
+
+import metrics
+from media_probe import CACHE_DIR
+from split_engine import get_startupinfo
+from sqlite_store import ThreadLocalDB
+
+WAVEFORM_DIR = os.path.join(CACHE_DIR, 'waveforms')
+WAVEFORM_DB_PATH = os.path.join(CACHE_DIR, 'waveforms.sqlite3')
+
+# Disk budget of cached peak files (override with CUTFILE_WAVEFORM_CACHE_MB)
+MAX_CACHE_BYTES = int(float(os.environ.get('CUTFILE_WAVEFORM_CACHE_MB', 512)) * 1024 * 1024)
+# Eviction frees down to this fraction of the budget, so it does not run on every build
+EVICT_TARGET = 0.9
+
+# Audio is decoded to mono s16 at this rate; 10 ms is then exactly 80 samples
+PEAK_SAMPLE_RATE = 8000
+# Bucket sizes of the pyramid levels, finest first; each is a multiple of the previous
+LEVELS_MS = (10, 100, 1000)
+# Samples decoded per NumPy pass (about 8 s of audio), which bounds memory use
+DECODE_CHUNK_SAMPLES = PEAK_SAMPLE_RATE * 8
+
+# File layout: header, one entry per level, then int16 (min, max) pairs per level
+MAGIC = b'CFPK'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<4sHIH')         # magic, version, sample rate, level count
+LEVEL_ENTRY = struct.Struct('<IIQ')      # bucket ms, bucket count, data offset
+PEAK_SIZE = 4                            # int16 min + int16 max
+
+_build_locks = {}
+_build_locks_guard = threading.Lock()
+
+
+class WaveformError(Exception):
+    """Raised when peaks cannot be computed or read."""
+
+
+# Without the index peaks are still cached, just never evicted
+_db = ThreadLocalDB(WAVEFORM_DB_PATH, (
+    'CREATE TABLE IF NOT EXISTS peak_cache ('
+    ' name TEXT PRIMARY KEY,'
+    ' size INTEGER NOT NULL,'
+    ' last_used REAL NOT NULL)',
+    'CREATE INDEX IF NOT EXISTS peak_cache_last_used ON peak_cache(last_used)',
+))
+
+
+def _touch(path, evict=False):
+    """Records a use of the peak file at path, then evicts if asked to."""
+    conn = _db.connect()
+    if conn is None:
+        return
+    try:
+        # Files from before the index are picked up here on their next use
+        conn.execute('INSERT OR REPLACE INTO peak_cache (name, size, last_used) VALUES (?, ?, ?)',
+                     (os.path.basename(path), os.path.getsize(path), time.time()))
+        conn.commit()
+        if evict:
+            _evict(conn, os.path.basename(path))
+    except (OSError, sqlite3.Error):
+        pass
+
+
+def _evict(conn, keep):
+    """Drops least recently used peak files until the cache fits its budget again."""
+    total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM peak_cache').fetchone()[0]
+    if total <= MAX_CACHE_BYTES:
+        return
+    target = MAX_CACHE_BYTES * EVICT_TARGET
+    for name, size in conn.execute('SELECT name, size FROM peak_cache ORDER BY last_used').fetchall():
+        if total <= target:
+            break
+        if name == keep:
+            continue  # just built for a caller that is about to read it
+        try:
+            os.remove(os.path.join(WAVEFORM_DIR, name))
+        except FileNotFoundError:
+            pass
+        except OSError:
+            continue  # still open elsewhere (Windows); try again next time
+        conn.execute('DELETE FROM peak_cache WHERE name = ?', (name,))
+        total -= size
+    conn.commit()
+
+
+def cache_path(input_file):
+    """Returns the pyramid file for input_file, keyed like the probe cache."""
+    path = os.path.abspath(input_file)
+    st = os.stat(path)
+    key = f"{path}|{st.st_size}|{st.st_mtime_ns}".encode('utf-8')
+    return os.path.join(WAVEFORM_DIR, hashlib.sha1(key).hexdigest() + '.peaks')
+
+
+def iter_pcm(input_file, sample_rate=PEAK_SAMPLE_RATE, chunk_samples=DECODE_CHUNK_SAMPLES):
+    """Decodes input_file through an ffmpeg pipe, yielding mono int16 NumPy chunks.
+
+    Memory stays bounded by chunk_samples regardless of the file's length.
+    """
+    try:
+        import numpy as np
+    except ImportError:
+        raise WaveformError('NumPy is required for audio analysis (pip install numpy)')
+
+    cmd = [
+        'ffmpeg',
+        '-v', 'error',
+        '-i', input_file,
+        '-map', '0:a:0',
+        '-ac', '1',
+        '-ar', str(sample_rate),
+        '-f', 's16le',
+        'pipe:1'
+    ]
+    try:
+        proc = metrics.popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, startupinfo=get_startupinfo())
+    except FileNotFoundError:
+        raise WaveformError('ffmpeg not found. Please ensure ffmpeg is installed and in your PATH.')
+
+    finished = False
+    try:
+        while True:
+            data = proc.stdout.read(chunk_samples * 2)
+            if not data:
+                break
+            # An odd trailing byte cannot happen with s16le, but never trust a pipe
+            yield np.frombuffer(data[:len(data) // 2 * 2], dtype='<i2')
+        finished = True
+    finally:
+        if not finished:
+            proc.kill()
+        stderr = proc.stderr.read()
+        proc.stdout.close()
+        proc.stderr.close()
+        proc.wait()
+    if proc.returncode != 0:
+        raise WaveformError(f"Error decoding audio: {stderr.decode(errors='replace') or 'Unknown error'}")
+
+
+def compute_peaks(input_file):
+    """Decodes input_file once and returns {bucket_ms: (n, 2) int16 array} for LEVELS_MS."""
+    try:
+        import numpy as np
+    except ImportError:
+        raise WaveformError('NumPy is required for audio analysis (pip install numpy)')
+
+    bucket = PEAK_SAMPLE_RATE * LEVELS_MS[0] // 1000
+    finest = []
+    carry = np.empty(0, dtype='<i2')
+    for chunk in iter_pcm(input_file):
+        if carry.size:
+            chunk = np.concatenate((carry, chunk))
+        usable = chunk.size // bucket * bucket
+        if usable:
+            frames = chunk[:usable].reshape(-1, bucket)
+            finest.append(np.stack((frames.min(axis=1), frames.max(axis=1)), axis=1))
+        carry = chunk[usable:]
+    if carry.size:
+        finest.append(np.array([[carry.min(), carry.max()]], dtype='<i2'))
+
+    levels = {LEVELS_MS[0]: np.concatenate(finest) if finest else np.zeros((0, 2), dtype='<i2')}
+    # Coarser levels are reduced from the previous one instead of re-reading PCM
+    for prev_ms, level_ms in zip(LEVELS_MS, LEVELS_MS[1:]):
+        prev = levels[prev_ms]
+        factor = level_ms // prev_ms
+        pad = (-len(prev)) % factor
+        if pad:
+            # Repeat the last bucket so padding never widens the range
+            prev = np.concatenate((prev, np.repeat(prev[-1:], pad, axis=0)))
+        grouped = prev.reshape(-1, factor, 2)
+        levels[level_ms] = np.stack((grouped[:, :, 0].min(axis=1), grouped[:, :, 1].max(axis=1)), axis=1)
+    return levels
+
+
+def write_pyramid(levels, path):
+    """Writes the levels to path atomically in the CFPK binary layout."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    offset = HEADER.size + LEVEL_ENTRY.size * len(levels)
+    entries = []
+    for level_ms in sorted(levels):
+        count = len(levels[level_ms])
+        entries.append(LEVEL_ENTRY.pack(level_ms, count, offset))
+        offset += count * PEAK_SIZE
+
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, FORMAT_VERSION, PEAK_SAMPLE_RATE, len(levels)))
+        for entry in entries:
+            f.write(entry)
+        for level_ms in sorted(levels):
+            f.write(levels[level_ms].astype('<i2').tobytes())
+    os.replace(temp_path, path)
+
+
+def read_levels(path):
+    """Returns {bucket_ms: (count, offset)} from a pyramid file header."""
+    with open(path, 'rb') as f:
+        magic, version, _, count = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise WaveformError('Unsupported waveform cache file')
+        levels = {}
+        for _ in range(count):
+            level_ms, buckets, offset = LEVEL_ENTRY.unpack(f.read(LEVEL_ENTRY.size))
+            levels[level_ms] = (buckets, offset)
+        return levels
+
+
+def ensure_pyramid(input_file):
+    """Returns the cached pyramid path for input_file, building it on first use."""
+    path = cache_path(input_file)
+    if os.path.exists(path):
+        _touch(path)
+        return path
+    with _build_locks_guard:
+        lock = _build_locks.setdefault(path, threading.Lock())
+    # One build per file at a time; late callers reuse the result
+    with lock:
+        built = not os.path.exists(path)
+        if built:
+            write_pyramid(compute_peaks(input_file), path)
+    with _build_locks_guard:
+        _build_locks.pop(path, None)
+    _touch(path, evict=built)
+    return path
+
+
+def pick_level(levels, start, end, width):
+    """Chooses the coarsest level that still gives at least `width` buckets for the window."""
+    span_ms = max(0.0, end - start) * 1000
+    for level_ms in sorted(levels, reverse=True):
+        if span_ms / level_ms >= width:
+            return level_ms
+    return min(levels)
+
+
+def read_window(input_file, start, end, width=1000, level_ms=None):
+    """Reads the peaks covering start..end seconds.
+
+    Returns (level_ms, first_bucket, bytes of int16 min/max pairs). Only the
+    requested slice of the cache file is read. The level is chosen from
+    width (target bucket count) unless level_ms is given.
+    """
+    path = ensure_pyramid(input_file)
+    levels = read_levels(path)
+    if level_ms is None:
+        level_ms = pick_level(levels, start, end, width)
+    if level_ms not in levels:
+        raise WaveformError(f"Unknown zoom level: {level_ms} ms")
+
+    count, offset = levels[level_ms]
+    first = max(0, min(count, int(start * 1000 // level_ms)))
+    last = max(first, min(count, -(-int(end * 1000) // level_ms)))
+    with open(path, 'rb') as f:
+        f.seek(offset + first * PEAK_SIZE)
+        data = f.read((last - first) * PEAK_SIZE)
+    return level_ms, first, data
@@ -0,0 +1,50 @@
+import time
+import zipfile
+
+
+class _ChunkSink:
+    """Write-only, unseekable file object that hands written bytes back to a generator."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def iter_zip(members):
+    """Yields a ZIP archive piece by piece while members are still being produced.
+
+    members is an iterable of (name, chunks) where chunks is an iterable of
+    bytes. Entries are ZIP_STORED (MP3 does not compress further) and
+    always carry ZIP64 extra fields, since member sizes are unknown up
+    front and exports may exceed 4 GB. Nothing is written to disk.
+    """
+    sink = _ChunkSink()
+    # Without tell()/seek() zipfile writes sizes in data descriptors after each member
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_STORED, allowZip64=True) as archive:
+        for name, chunks in members:
+            info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+            info.compress_type = zipfile.ZIP_STORED
+            with archive.open(info, 'w', force_zip64=True) as member:
+                for chunk in chunks:
+                    member.write(chunk)
+                    data = sink.drain()
+                    if data:
+                        yield data
+            data = sink.drain()
+            if data:
+                yield data
+    # Central directory
+    data = sink.drain()
+    if data:
+        yield data